@@ -0,0 +1,381 @@
+"""
+API HTTP locale sui calcoli del motore, per il gestionale prenotazioni e i job giornalieri.
+
+    python api.py --dati ../data --porta 8502
+
+    GET /kpi?periodo=2025-07&area=Sirmione
+    GET /performance?periodo=2024,2025&giorno=Alti&formato=arrow
+    GET /forecast?area=Desenzano
+    GET /alert?periodo=2025
+    GET /esporta/fatti?periodo=2024,2025&area=Sirmione&formato=parquet
+    GET /versione
+
+Filtri come nella sidebar: periodo (AAAA, AAAA-MM, AAAA-Wss; più periodi separati da virgola
+= confronto, allinea=1 per l'allineamento per giorno della settimana), giorno, cliente, area,
+barca. formato=json (default) o arrow (Arrow IPC stream della tabella principale).
+Le risposte sono in una cache LRU con chiave versione dati + richiesta normalizzata; quelle
+non in cache vengono trasmesse a pezzi (Transfer-Encoding: chunked) mentre si serializzano.
+
+/esporta/<tabella> scarica come file (formato=csv, parquet o xlsx) il registro filtrato
+("fatti"), le spese dei mesi e delle barche selezionati ("spese") o la tabella principale di
+una risorsa (kpi, performance, forecast, alert). Gli export sono generati a blocchi di righe
+dall'indice del filtro e non passano dalla cache.
+"""
+import argparse
+import io
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from dataclasses import asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+import motore
+from motore.cache import CacheLRU
+from motore.esporta import COLONNE_FATTI, FORMATI_EXPORT, esporta_a_pezzi, tabella_esportabile
+
+logger = logging.getLogger("bb_api")
+
+RIGHE_PER_PEZZO = 5_000
+GIORNI = ["Tutti", "Alti", "Bassi", "Confronto Alti/Bassi"]
+CLIENTI = ["Tutti", "Privati", "Gruppo", "Confronto Privati/Gruppo"]
+FORMATI = {"json": "application/json; charset=utf-8", "arrow": "application/vnd.apache.arrow.stream"}
+
+
+class RichiestaNonValida(ValueError):
+    pass
+
+
+class StatoApi:
+    """Dati caricati una volta, rollup e cache delle risposte; ricarica se cambiano i file sorgente."""
+
+    def __init__(self, cartella, meteo=True, max_byte_cache=64 * 1024 * 1024):
+        self.cartella = cartella
+        self.meteo = meteo
+        self.cache = CacheLRU(max_byte_cache)
+        self._lock = threading.Lock()
+        self.df = None
+        self.df_spese = None
+        self.versione = None
+        self.carica()
+
+    def carica(self):
+        inizio = time.perf_counter()
+        # Registro in sola lettura (motore.dati.sola_lettura): le richieste concorrenti lo leggono senza copie
+        fatti = motore.carica_fatti(self.cartella, meteo=self.meteo)
+        if fatti.df.empty:
+            raise SystemExit(f"Nessun file crmboats_taxi*.xlsx in {self.cartella}")
+        for errore in fatti.esito.errori:
+            logger.warning(errore)
+        df = self.df = fatti.df
+        percorso_spese = os.path.join(self.cartella, "Bertoldi Boats.csv")
+        if os.path.exists(percorso_spese):
+            self.df_spese = motore.classifica_spese(motore.carica_spese(percorso_spese))
+        self.rollup = motore.rollup_gerarchici(df)
+        self.versione = fatti.versione
+        self.cache.svuota()
+        logger.info("dati %s caricati in %.1fs (%d righe)", self.versione, time.perf_counter() - inizio, len(df))
+
+    def verifica_versione(self):
+        # I file sorgente sono cambiati (dimensione/mtime) → nuova versione: ricarico una volta sola
+        if motore.versione_dati(self.df, cartella=self.cartella) != self.versione:
+            with self._lock:
+                if motore.versione_dati(self.df, cartella=self.cartella) != self.versione:
+                    self.carica()
+        return self.df, self.rollup, self.versione
+
+
+def leggi_filtri(query, df, formati=FORMATI):
+    """Filtri della richiesta normalizzati (valori di default espliciti) e validati."""
+    def valore(nome, default):
+        return query.get(nome, [default])[-1].strip() or default
+
+    testo_periodo = valore("periodo", str(int(df["Anno"].max())))
+    allinea = valore("allinea", "0").lower() in ("1", "true", "si", "sì")
+    try:
+        periodo = motore.filtri.periodo_da_testo(testo_periodo, allinea)
+    except ValueError as e:
+        raise RichiestaNonValida(str(e))
+    filtri = {
+        "periodo": testo_periodo, "allinea": allinea and periodo["modalita"] == "confronto",
+        "giorno": valore("giorno", "Tutti"), "cliente": valore("cliente", "Tutti"),
+        "area": valore("area", "Tutte"), "barca": valore("barca", "Tutte"),
+        "formato": valore("formato", next(iter(formati))).lower(),
+    }
+    if filtri["giorno"] not in GIORNI:
+        raise RichiestaNonValida(f"giorno non valido: usare uno tra {GIORNI}")
+    if filtri["cliente"] not in CLIENTI:
+        raise RichiestaNonValida(f"cliente non valido: usare uno tra {CLIENTI}")
+    if filtri["area"] != "Tutte" and filtri["area"] not in set(df["Area"].dropna()):
+        raise RichiestaNonValida(f"area sconosciuta: {filtri['area']}")
+    if filtri["barca"] != "Tutte" and filtri["barca"] not in set(df["Barca_Normalizzata"].dropna()):
+        raise RichiestaNonValida(f"barca sconosciuta: {filtri['barca']}")
+    if filtri["formato"] not in formati:
+        raise RichiestaNonValida(f"formato non valido: usare uno tra {list(formati)}")
+    return periodo, filtri
+
+
+# ========== RISORSE: CALCOLO → (payload JSON, tabella principale) ==========
+def _argomenti(periodo, filtri):
+    return periodo, filtri["giorno"], filtri["cliente"], filtri["area"], filtri["barca"]
+
+def risorsa_kpi(df, rollup, periodo, filtri):
+    df_kpi = motore.filtra_dataframe(df, *_argomenti(periodo, filtri))
+    kpi = motore.calcola_kpi(df_kpi, *_argomenti(periodo, filtri), rollup=rollup)
+    righe = [{"nodo": "Selezione", **{k: v for k, v in asdict(kpi).items() if k != "figli"}}]
+    righe += [{"nodo": nome, **{k: v for k, v in asdict(figlio).items() if k != "figli"}}
+              for nome, figlio in kpi.figli.items()]
+    tabella = pd.DataFrame(righe)
+    return {"kpi": tabella.iloc[0].to_dict(), "figli": tabella.iloc[1:]}, tabella
+
+def risorsa_performance(df, rollup, periodo, filtri):
+    df_kpi = motore.filtra_dataframe(df, *_argomenti(periodo, filtri))
+    r = motore.calcola_performance(df_kpi, *_argomenti(periodo, filtri))
+    if r is None:
+        return {"dati": pd.DataFrame()}, pd.DataFrame()
+    pivot = r.pivot.reset_index() if r.pivot is not None else None
+    return {"titolo": r.titolo, "descrizione": r.focus_descr, "nota": r.caption,
+            "raggruppamento": r.split_col, "colore": r.color_col, "dati": r.gdf, "confronto": pivot}, r.gdf
+
+def risorsa_forecast(df, rollup, periodo, filtri):
+    # Come nella dashboard: il forecast parte da tutto lo storico con i soli filtri di contesto
+    df_forecast = motore.filtra_forecast(df, None, filtri["giorno"], filtri["cliente"], filtri["area"], filtri["barca"])
+    r = motore.calcola_forecast(df_forecast, *_argomenti(periodo, filtri))
+    return {"oggi": r.oggi, "mensile": r.forecast_df, "aree": r.area_df}, r.forecast_df
+
+def risorsa_alert(df, rollup, periodo, filtri):
+    df_kpi = motore.filtra_dataframe(df, *_argomenti(periodo, filtri))
+    alert = motore.calcola_alert(df_kpi) if not df_kpi.empty else []
+    tabella = pd.DataFrame([asdict(a) for a in alert],
+                           columns=["famiglia", "icona", "oggetto", "valore", "soglia", "messaggio"])
+    tabella["oggetto"] = tabella["oggetto"].map(lambda o: None if o is None else str(o))
+    tabella = tabella.astype({"valore": float, "soglia": float})
+    return {"alert": tabella}, tabella
+
+RISORSE = {
+    "/kpi": risorsa_kpi,
+    "/performance": risorsa_performance,
+    "/forecast": risorsa_forecast,
+    "/alert": risorsa_alert,
+}
+
+
+def pezzi_export(nome, stato, periodo, filtri):
+    """Generatore dei byte del file per /esporta/<nome>; solleva RichiestaNonValida prima di iniziare."""
+    df, formato = stato.df, filtri["formato"]
+    try:
+        if nome == "fatti":
+            posizioni = motore.filtri.indice_filtro(df, *_argomenti(periodo, filtri))
+            return esporta_a_pezzi(df, formato, posizioni, COLONNE_FATTI, foglio="Registro")
+        if nome == "spese":
+            if stato.df_spese is None:
+                raise RichiestaNonValida(f"nessun file spese in {stato.cartella}")
+            barche = None
+            if filtri["barca"] != "Tutte":
+                barche = [filtri["barca"]]
+            elif filtri["area"] != "Tutte":
+                barche = df.loc[df["Area"] == filtri["area"], "Barca_Normalizzata"].dropna().unique()
+            posizioni = motore.margini.indice_spese(stato.df_spese, periodo, barche)
+            return esporta_a_pezzi(stato.df_spese, formato, posizioni, foglio="Spese")
+        _, tabella = RISORSE[f"/{nome}"](df, stato.rollup, periodo, filtri)
+        return esporta_a_pezzi(tabella_esportabile(tabella), formato, foglio=nome.capitalize())
+    except ValueError as e:  # ad es. troppe righe per un foglio Excel
+        raise RichiestaNonValida(str(e))
+
+ESPORTABILI = ["fatti", "spese"] + [r.strip("/") for r in RISORSE]
+
+
+# ========== SERIALIZZAZIONE A PEZZI ==========
+def _json_valore(v):
+    if isinstance(v, pd.Timestamp):
+        return v.isoformat()
+    if hasattr(v, "item"):          # scalari numpy
+        v = v.item()
+    if isinstance(v, float) and not math.isfinite(v):
+        return None
+    return v
+
+def _json_tabella(tabella):
+    # Array JSON di record, serializzato RIGHE_PER_PEZZO righe alla volta
+    yield b"["
+    for inizio in range(0, len(tabella), RIGHE_PER_PEZZO):
+        pezzo = tabella.iloc[inizio:inizio + RIGHE_PER_PEZZO].to_json(orient="records", date_format="iso", force_ascii=False)
+        yield (b"," if inizio else b"") + pezzo[1:-1].encode("utf-8")
+    yield b"]"
+
+def pezzi_json(payload, versione):
+    yield b'{"versione": ' + json.dumps(versione).encode("utf-8")
+    for chiave, valore in payload.items():
+        yield b", " + json.dumps(chiave).encode("utf-8") + b": "
+        if isinstance(valore, pd.DataFrame):
+            yield from _json_tabella(valore)
+        elif isinstance(valore, dict):
+            yield json.dumps({k: _json_valore(v) for k, v in valore.items()}, ensure_ascii=False).encode("utf-8")
+        else:
+            yield json.dumps(_json_valore(valore), ensure_ascii=False).encode("utf-8")
+    yield b"}"
+
+def pezzi_arrow(tabella, versione):
+    import pyarrow as pa
+
+    tabella = pa.Table.from_pandas(tabella.reset_index(drop=True), preserve_index=False)
+    tabella = tabella.replace_schema_metadata({**(tabella.schema.metadata or {}), b"versione": versione.encode()})
+    buffer = io.BytesIO()
+    with pa.ipc.new_stream(buffer, tabella.schema) as writer:
+        for batch in tabella.to_batches(max_chunksize=RIGHE_PER_PEZZO):
+            writer.write_batch(batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()  # marcatore di fine stream
+
+
+# ========== SERVER HTTP ==========
+class GestoreApi(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    stato = None  # StatoApi, impostato da crea_server
+
+    def log_message(self, formato, *args):
+        logger.info("%s %s", self.address_string(), formato % args)
+
+    def _invia_json(self, codice, corpo):
+        dati = json.dumps(corpo, ensure_ascii=False).encode("utf-8")
+        self.send_response(codice)
+        self.send_header("Content-Type", FORMATI["json"])
+        self.send_header("Content-Length", str(len(dati)))
+        self.end_headers()
+        self.wfile.write(dati)
+
+    def _invia_a_pezzi(self, pezzi):
+        for pezzo in pezzi:
+            if pezzo:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(pezzo), pezzo))
+                yield pezzo
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _esporta(self, nome, query):
+        df, _, versione = self.stato.verifica_versione()
+        if nome not in ESPORTABILI:
+            self._invia_json(404, {"errore": f"tabella non esportabile: {nome}", "tabelle": ESPORTABILI})
+            return
+        periodo, filtri = leggi_filtri(query, df, formati=FORMATI_EXPORT)
+        try:
+            pezzi = pezzi_export(nome, self.stato, periodo, filtri)
+        except RichiestaNonValida:
+            raise
+        except Exception as e:
+            logger.exception("errore nell'export di %s", self.path)
+            self._invia_json(500, {"errore": f"{type(e).__name__}: {e}"})
+            return
+        mime, estensione = FORMATI_EXPORT[filtri["formato"]]
+        file = f"{nome}_{filtri['periodo'].replace(',', '_')}.{estensione}"
+        self.send_response(200)
+        self.send_header("Content-Type", mime)
+        self.send_header("Content-Disposition", f'attachment; filename="{file}"')
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("X-Versione-Dati", versione)
+        self.end_headers()
+        try:
+            for _ in self._invia_a_pezzi(pezzi):
+                pass
+        except Exception:
+            # Intestazioni già inviate: chiudo senza il pezzo finale, il client vede il file troncato
+            logger.exception("export di %s interrotto", self.path)
+            self.close_connection = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        try:
+            if url.path.startswith("/esporta/"):
+                self._esporta(url.path[len("/esporta/"):], query)
+                return
+            df, rollup, versione = self.stato.verifica_versione()
+            if url.path == "/versione":
+                self._invia_json(200, {"versione": versione, "righe": len(df),
+                                       "cache": {"byte": self.stato.cache.byte, "hit": self.stato.cache.hit,
+                                                 "miss": self.stato.cache.miss}})
+                return
+            risorsa = RISORSE.get(url.path)
+            if risorsa is None:
+                self._invia_json(404, {"errore": f"risorsa sconosciuta: {url.path}", "risorse": sorted(RISORSE),
+                                       "export": [f"/esporta/{nome}" for nome in ESPORTABILI]})
+                return
+            periodo, filtri = leggi_filtri(query, df)
+        except RichiestaNonValida as e:
+            self._invia_json(400, {"errore": str(e)})
+            return
+
+        chiave = (versione, url.path, json.dumps(filtri, sort_keys=True))
+        corpo = self.stato.cache.get(chiave)
+        if corpo is not None:
+            self.send_response(200)
+            self.send_header("Content-Type", FORMATI[filtri["formato"]])
+            self.send_header("Content-Length", str(len(corpo)))
+            self.send_header("X-Versione-Dati", versione)
+            self.send_header("X-Cache", "HIT")
+            self.end_headers()
+            self.wfile.write(corpo)
+            return
+
+        try:
+            payload, tabella = risorsa(df, rollup, periodo, filtri)
+        except Exception as e:
+            logger.exception("errore nel calcolo di %s", self.path)
+            self._invia_json(500, {"errore": f"{type(e).__name__}: {e}"})
+            return
+        pezzi = pezzi_arrow(tabella, versione) if filtri["formato"] == "arrow" else pezzi_json(payload, versione)
+
+        self.send_response(200)
+        self.send_header("Content-Type", FORMATI[filtri["formato"]])
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("X-Versione-Dati", versione)
+        self.send_header("X-Cache", "MISS")
+        self.end_headers()
+        # Trasmetto ogni pezzo appena serializzato; tengo una copia per la cache finché ci sta
+        trasmessi, byte = [], 0
+        for pezzo in self._invia_a_pezzi(pezzi):
+            byte += len(pezzo)
+            if trasmessi is not None and byte <= self.stato.cache.max_byte:
+                trasmessi.append(pezzo)
+            else:
+                trasmessi = None
+        if trasmessi is not None:
+            self.stato.cache.put(chiave, b"".join(trasmessi))
+
+
+def crea_server(stato, host="127.0.0.1", porta=8502):
+    gestore = type("Gestore", (GestoreApi,), {"stato": stato})
+    return ThreadingHTTPServer((host, porta), gestore)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="API locale JSON/Arrow sui KPI della dashboard.")
+    parser.add_argument("--dati", default=".", help="cartella con i file crmboats_taxi*.xlsx")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8502)
+    parser.add_argument("--senza-meteo", action="store_true", help="non scaricare i dati meteo all'avvio")
+    parser.add_argument("--cache-mb", type=int, default=int(os.environ.get("BB_CACHE_API_MB", "64")))
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=os.environ.get("BB_LOG_LEVEL", "INFO"), format="%(asctime)s %(name)s %(message)s")
+
+    stato = StatoApi(args.dati, meteo=not args.senza_meteo, max_byte_cache=args.cache_mb * 1024 * 1024)
+    server = crea_server(stato, args.host, args.porta)
+    logger.info("API in ascolto su http://%s:%d (risorse: %s)", args.host, args.porta, ", ".join(sorted(RISORSE)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
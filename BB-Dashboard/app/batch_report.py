@@ -0,0 +1,157 @@
+"""
+Generazione batch dei report PDF di fine periodo: flotta, ogni area e ogni barca.
+
+    python batch_report.py 2025-07 --dati ../data --uscita report_2025-07
+    python batch_report.py 2025 --processi 4
+
+I dati vengono caricati una sola volta e scritti in uno snapshot Arrow IPC non compresso;
+ogni processo del pool lo apre in memory-map, così la tabella dei fatti non viene
+ricaricata dagli Excel né copiata tramite pickle per ogni report. I filtri di ogni report
+lavorano sulla tabella Arrow: solo la fetta filtrata diventa un DataFrame pandas.
+"""
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from motore import dati
+from motore.report import costruisci_report_pdf
+
+# Colonne usate dal report: lo snapshot non porta le colonne grezze degli Excel (tipi misti)
+COLONNE_SNAPSHOT = ["Data", "TipoRiga", "Incasso", "Clienti", "Gasolio", "TipoCliente", "Area", "Barca_Normalizzata"]
+
+_tabella_snapshot = None
+
+
+def scrivi_snapshot(df, percorso):
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    tabella = pa.Table.from_pandas(df[COLONNE_SNAPSHOT].reset_index(drop=True), preserve_index=False)
+    feather.write_feather(tabella, percorso, compression="uncompressed")
+
+
+def _apri_snapshot(percorso):
+    # Initializer dei processi: un solo memory-map per worker, condiviso dai suoi report.
+    # La tabella resta in Arrow (zero-copy sulle pagine del file), niente to_pandas() completo
+    global _tabella_snapshot
+    import pyarrow as pa
+
+    _tabella_snapshot = pa.ipc.open_file(pa.memory_map(percorso, "r")).read_all()
+
+
+def filtra_periodo(df, periodo):
+    """periodo: "AAAA" (anno) o "AAAA-MM" (mese)."""
+    if len(periodo) == 4:
+        return df[df["Data"].dt.year == int(periodo)]
+    mese = pd.Period(periodo, freq="M")
+    return df[df["Data"].dt.to_period("M") == mese]
+
+
+def maschera_periodo(tabella, periodo):
+    """Come filtra_periodo, ma maschera booleana su una tabella Arrow."""
+    import pyarrow.compute as pc
+
+    maschera = pc.equal(pc.year(tabella["Data"]), int(periodo[:4]))
+    if len(periodo) > 4:
+        maschera = pc.and_(maschera, pc.equal(pc.month(tabella["Data"]), int(periodo[5:])))
+    return maschera
+
+
+def elenco_report(df_periodo):
+    """(livello, nome) per flotta, aree e barche con almeno una riga nel periodo."""
+    lavori = [("Flotta", None)]
+    for area in sorted(df_periodo["Area"].dropna().unique()):
+        lavori.append(("Area", area))
+    for barca in sorted(df_periodo["Barca_Normalizzata"].dropna().unique()):
+        lavori.append(("Barca", barca))
+    return lavori
+
+
+def nome_file(periodo, livello, nome):
+    base = "flotta" if nome is None else f"{livello.lower()}_{nome}"
+    base = re.sub(r"[^0-9A-Za-z_-]+", "_", base.replace("’", "")).strip("_")
+    return f"report_{periodo}_{base}.pdf"
+
+
+def genera_report(periodo, livello, nome, cartella_uscita):
+    inizio = time.perf_counter()
+    import pyarrow.compute as pc
+
+    maschera = maschera_periodo(_tabella_snapshot, periodo)
+    if livello == "Area":
+        maschera = pc.and_(maschera, pc.equal(_tabella_snapshot["Area"], nome))
+    elif livello == "Barca":
+        maschera = pc.and_(maschera, pc.equal(_tabella_snapshot["Barca_Normalizzata"], nome))
+    df_periodo = _tabella_snapshot.filter(maschera).to_pandas()
+    ambito = f"{livello} {nome} - {periodo}" if nome else f"Flotta - {periodo}"
+    contenuto = costruisci_report_pdf(df_periodo, ambito=ambito)
+    percorso = os.path.join(cartella_uscita, nome_file(periodo, livello, nome))
+    with open(percorso, "wb") as f:
+        f.write(contenuto)
+    return {"livello": livello, "nome": nome or "Tutte", "righe": len(df_periodo), "byte": len(contenuto),
+            "secondi": time.perf_counter() - inizio, "file": percorso}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report PDF per flotta, aree e barche su un pool di processi.")
+    parser.add_argument("periodo", help='anno "AAAA" o mese "AAAA-MM"')
+    parser.add_argument("--dati", default=".", help="cartella con i file crmboats_taxi*.xlsx")
+    parser.add_argument("--uscita", default=None, help="cartella di destinazione (default report_<periodo>)")
+    parser.add_argument("--processi", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+    if not re.fullmatch(r"\d{4}(-\d{2})?", args.periodo):
+        parser.error('periodo non valido: usare "AAAA" o "AAAA-MM"')
+
+    cartella_uscita = args.uscita or f"report_{args.periodo}"
+    os.makedirs(cartella_uscita, exist_ok=True)
+
+    inizio = time.perf_counter()
+    df = dati.carica_dati(args.dati)
+    if df.empty:
+        print(f"Nessun file crmboats_taxi*.xlsx in {args.dati}", file=sys.stderr)
+        return 1
+    lavori = elenco_report(filtra_periodo(df, args.periodo))
+    if len(lavori) == 1:
+        print(f"Nessun dato per il periodo {args.periodo}", file=sys.stderr)
+        return 1
+    print(f"Dati caricati in {time.perf_counter() - inizio:.1f}s ({len(df)} righe), {len(lavori)} report da generare")
+
+    cartella_snapshot = tempfile.mkdtemp(prefix="bb_snapshot_")
+    try:
+        snapshot = os.path.join(cartella_snapshot, "fatti.arrow")
+        scrivi_snapshot(df, snapshot)
+        del df
+        inizio_batch = time.perf_counter()
+        risultati, errori = [], 0
+        with ProcessPoolExecutor(max_workers=args.processi, initializer=_apri_snapshot,
+                                 initargs=(snapshot,)) as pool:
+            futuri = {pool.submit(genera_report, args.periodo, livello, nome, cartella_uscita): (livello, nome)
+                      for livello, nome in lavori}
+            for futuro in as_completed(futuri):
+                livello, nome = futuri[futuro]
+                try:
+                    r = futuro.result()
+                except Exception as e:
+                    errori += 1
+                    print(f"  ERRORE {livello:<6} {nome or 'Tutte':<14} {type(e).__name__}: {e}", file=sys.stderr)
+                    continue
+                risultati.append(r)
+                print(f"  {r['livello']:<6} {r['nome']:<14} {r['righe']:>6} righe {r['secondi']:>6.2f}s  {r['file']}")
+    finally:
+        shutil.rmtree(cartella_snapshot, ignore_errors=True)
+
+    totale = time.perf_counter() - inizio_batch
+    somma = sum(r["secondi"] for r in risultati)
+    print(f"{len(risultati)} report in {totale:.1f}s (somma tempi report {somma:.1f}s, {args.processi} processi)")
+    return 1 if errori else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""
+Benchmark di scala: genera dataset sintetici (dati_sintetici.py) e cronometra caricamento,
+meteo, filtri e il calcolo di ogni tab del motore, scrivendo i tempi in JSON.
+
+    python benchmark.py --scale piccola,media,grande --uscita benchmark.json
+    python benchmark.py --scale media --dati-sintetici /tmp/bb_media --ripetizioni 5
+
+Il download meteo è sostituito da uno stub deterministico (nessuna rete): si misura
+l'unione dei dati meteo al registro, non la latenza di Open-Meteo. Le tab sono misurate sulle
+funzioni calcola_* del motore che la dashboard disegna (senza il rendering Streamlit).
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+import motore
+from motore.report import costruisci_report_pdf
+from motore.simulatore import STAGIONI_SIMULATORE
+from dati_sintetici import genera_dataset
+
+# Scale predefinite: anni di storico, barche, tratte medie per barca attiva al giorno
+SCALE = {
+    "piccola": {"anni": 2, "barche": 6, "tour_giorno": 3.0},
+    "media": {"anni": 4, "barche": 12, "tour_giorno": 3.3},
+    "grande": {"anni": 8, "barche": 12, "tour_giorno": 6.0},
+    "enorme": {"anni": 15, "barche": 12, "tour_giorno": 10.0},
+}
+# Selezioni misurate da filtra_dataframe (testo come nell'API, "{a}" = ultimo anno dei dati)
+FILTRI_BENCHMARK = {
+    "annuale": "{a}",
+    "mensile": "{a}-07",
+    "settimanale": "{a}-W28",
+    "confronto": "{p},{a}",
+}
+
+
+class RispostaMeteo:
+    """Risposta finta di Open-Meteo: stessi campi daily, valori pseudo-casuali per data."""
+
+    def __init__(self, url):
+        query = parse_qs(urlsplit(url).query)
+        giorni = pd.date_range(query["start_date"][0], query["end_date"][0], freq="D")
+        rng = np.random.default_rng(int(giorni[0].strftime("%Y%m%d")))
+        self._daily = {
+            "time": giorni.strftime("%Y-%m-%d").tolist(),
+            "precipitation_sum": np.round(rng.exponential(1.5, len(giorni)), 1).tolist(),
+            "weathercode": rng.choice([0, 1, 2, 3, 61, 63, 80], len(giorni)).tolist(),
+            "windspeed_10m_max": np.round(rng.gamma(4, 5, len(giorni)), 1).tolist(),
+        }
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"daily": self._daily}
+
+
+def meteo_stub():
+    return mock.patch("requests.get", lambda url, timeout=None: RispostaMeteo(url))
+
+
+def cronometra(funzione, ripetizioni=3, prepara=None):
+    """Tempi (s) di `ripetizioni` chiamate; prepara() fornisce argomenti nuovi fuori dal cronometro."""
+    tempi = []
+    for _ in range(ripetizioni):
+        argomenti = prepara() if prepara else ()
+        inizio = time.perf_counter()
+        funzione(*argomenti)
+        tempi.append(time.perf_counter() - inizio)
+    return tempi
+
+
+def stadi_benchmark(cartella):
+    """
+    Stadi da misurare sul dataset di `cartella`, nell'ordine della dashboard:
+    {nome: (funzione, prepara)}. Carica una volta i dati che servono agli stadi successivi.
+    """
+    percorso_spese = os.path.join(cartella, "Bertoldi Boats.csv")
+    df_grezzo = motore.carica_dati(cartella)
+    with meteo_stub():
+        df, _ = motore.aggiorna_meteo(df_grezzo.copy(), df_grezzo["Data"].min(), df_grezzo["Data"].max())
+    df = motore.dati.sola_lettura(df)  # come il registro condiviso dalle sessioni della dashboard
+    df_spese = motore.classifica_spese(motore.carica_spese(percorso_spese))
+    rollup = motore.rollup_gerarchici(df)
+    anno = int(df["Anno"].max())
+    periodo = motore.periodo_da_testo(str(anno))
+    filtri = (periodo, "Tutti", "Tutti", "Tutte", None)
+    df_kpi = motore.filtra_dataframe(df, *filtri)
+
+    def meteo(df_copia):
+        with meteo_stub():
+            motore.aggiorna_meteo(df_copia, df_copia["Data"].min(), df_copia["Data"].max())
+
+    def simulatore():
+        stats, anno_min = motore.statistiche_simulatore(df_kpi)
+        stagione = "Altissima (giu, lug, ago)"
+        stats_stagione = stats.xs(stagione, level="Stagione")
+        curve = motore.simula_curve(stats_stagione, datetime.now().year - anno_min, 15)
+        barche = {area: 2 for area in stats_stagione.index}
+        motore.simula_monte_carlo(motore.simulatore.giorno_barca_simulatore(df_kpi), stats_stagione,
+                                  STAGIONI_SIMULATORE[stagione], barche, datetime.now().year - anno_min)
+        massimi = {area: int(stats_stagione.at[area, "max_barche"]) for area in stats_stagione.index}
+        motore.ottimizza_flotta(curve, min(8, sum(massimi.values())), {a: 0 for a in massimi}, massimi)
+
+    def suggerimenti():
+        motore.calcola_alert(df_kpi, ctx=motore.contesto_alert(df_kpi))
+        motore.calcola_anomalie(motore.serie_giornaliera_barche(df))
+
+    def spese():
+        cubo = motore.cubo_margini(df, df_spese)
+        motore.conto_economico(motore.fetta_cubo(cubo, periodo), "Incasso", ["Area", "Barca"])
+
+    stadi = {
+        "carica_dati": (lambda: motore.carica_dati(cartella), None),
+        "carica_spese": (lambda: motore.classifica_spese(motore.carica_spese(percorso_spese)), None),
+        "aggiorna_meteo": (meteo, lambda: (df_grezzo.copy(),)),
+        "rollup_gerarchici": (lambda: motore.rollup_gerarchici(df), None),
+    }
+    for nome, testo in FILTRI_BENCHMARK.items():
+        selezione = motore.periodo_da_testo(testo.format(a=anno, p=anno - 1))
+        stadi[f"filtra_dataframe[{nome}]"] = (
+            lambda p=selezione: motore.filtra_dataframe(df, p, "Tutti", "Tutti", "Tutte"), None
+        )
+    stadi.update({
+        "tab_kpi": (lambda: motore.calcola_kpi(df_kpi, *filtri, rollup=rollup), None),
+        "tab_performance": (lambda: motore.calcola_performance(df_kpi, *filtri), None),
+        "tab_popolarita": (lambda: motore.calcola_popolarita(df_kpi, *filtri), None),
+        "tab_stagionalita": (lambda: motore.calcola_stagionalita(df_kpi, *filtri), None),
+        "tab_maltempo": (lambda: motore.calcola_maltempo(df_kpi, *filtri), None),
+        "tab_forecast": (lambda: motore.calcola_forecast(
+            motore.filtra_forecast(df, df_kpi, "Tutti", "Tutti", "Tutte", None), *filtri), None),
+        "tab_simulatore": (simulatore, None),
+        "tab_suggerimenti": (suggerimenti, None),
+        "tab_analisi_spese": (spese, None),
+        "tab_pdf": (lambda: costruisci_report_pdf(df_kpi), None),
+    })
+    info = {"righe": len(df), "righe_selezione": len(df_kpi), "righe_spese": len(df_spese), "anno_selezione": anno}
+    return stadi, info
+
+
+def esegui_scala(nome, parametri, ripetizioni, cartella=None, seed=0):
+    temporanea = cartella is None
+    cartella = cartella or tempfile.mkdtemp(prefix=f"bb_bench_{nome}_")
+    try:
+        inizio = time.perf_counter()
+        if not os.path.exists(os.path.join(cartella, "Bertoldi Boats.csv")):
+            generato = genera_dataset(cartella, seed=seed, **parametri)
+            print(f"[{nome}] {generato['righe_registro']} righe generate in {time.perf_counter() - inizio:.1f}s")
+        stadi, info = stadi_benchmark(cartella)
+        risultati = {}
+        for stadio, (funzione, prepara) in stadi.items():
+            tempi = cronometra(funzione, ripetizioni, prepara)
+            risultati[stadio] = {"min_s": min(tempi), "mediana_s": statistics.median(tempi), "tempi_s": tempi}
+            print(f"[{nome}] {stadio:<32} min {min(tempi) * 1000:>9.1f} ms   mediana {statistics.median(tempi) * 1000:>9.1f} ms")
+        return {"scala": nome, "parametri": parametri, "seed": seed, **info, "stadi": risultati}
+    finally:
+        if temporanea:
+            shutil.rmtree(cartella, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark di caricamento, filtri e tab su dati sintetici.")
+    parser.add_argument("--scale", default="piccola,media", help=f"elenco tra {', '.join(SCALE)}")
+    parser.add_argument("--ripetizioni", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dati-sintetici", default=None,
+                        help="cartella dove generare/riusare i dataset (una sottocartella per scala)")
+    parser.add_argument("--uscita", default="benchmark.json", help="file JSON dei risultati")
+    args = parser.parse_args(argv)
+    scale = [s.strip() for s in args.scale.split(",") if s.strip()]
+    sconosciute = [s for s in scale if s not in SCALE]
+    if sconosciute:
+        parser.error(f"scale sconosciute: {sconosciute} (disponibili: {list(SCALE)})")
+
+    warnings.simplefilter("ignore")  # avvisi di parsing date dei fogli: non sono oggetto del benchmark
+    risultati = []
+    for nome in scale:
+        cartella = os.path.join(args.dati_sintetici, nome) if args.dati_sintetici else None
+        risultati.append(esegui_scala(nome, SCALE[nome], args.ripetizioni, cartella, args.seed))
+
+    rapporto = {
+        "creato": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+        "piattaforma": platform.platform(), "processori": os.cpu_count(),
+        "ripetizioni": args.ripetizioni, "risultati": risultati,
+    }
+    with open(args.uscita, "w", encoding="utf-8") as f:
+        json.dump(rapporto, f, indent=2, ensure_ascii=False)
+    print(f"Risultati scritti in {args.uscita}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+# La cartella app è la radice dei test: `import motore` funziona da tests/ senza installare il pacchetto
@@ -2,9 +2,31 @@ import pandas as pd
 import numpy as np
 import streamlit as st
 import plotly.express as px
-from scipy.stats import ttest_ind
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 from datetime import datetime
-import requests, os, glob, tempfile, base64, calendar
+import os, base64, calendar, threading, logging, json, uuid, gc
+import plotly.io as pio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import motore
+from motore import profilo
+from motore.cache import CacheLRU
+from motore.memoria import CampionatoreRss, ContabilitaMemoria, dimensione_profonda
+from motore.alert import SOGLIE_ALERT, calcola_alert, contesto_alert
+from motore.anomalie import METRICHE_ANOMALIE, aggiorna_anomalie
+from motore.dati import carica_spese, classifica_spese, firma_sorgenti
+from motore.esporta import COLONNE_FATTI, FORMATI_EXPORT, MAX_RIGHE_EXCEL, esporta_su_file, tabella_esportabile
+from motore.filtri import filtra_dataframe
+from motore.forecast import calcola_forecast, filtra_forecast
+from motore.kpi import calcola_kpi
+from motore.maltempo import calcola_maltempo
+from motore.margini import CHIAVI_RIPARTIZIONE, VOCI_COSTO, conto_economico, fetta_cubo, indice_spese
+from motore.performance import calcola_performance
+from motore.popolarita import calcola_popolarita
+from motore.report import costruisci_report_pdf
+from motore.simulatore import STAGIONI_SIMULATORE, ottimizza_flotta, simula_curve, simula_monte_carlo
+from motore.stagionalita import calcola_stagionalita
 
 
 st.set_page_config(
@@ -12,6 +34,29 @@ st.set_page_config(
     layout="wide"
 )
 
+# Traccia dei tempi di questo rerun (pannello "Profiling" in fondo alla sidebar)
+TRACCIA = profilo.avvia("rerun", sessione=st.session_state.setdefault("id_sessione", uuid.uuid4().hex[:8]))
+
+# ========== MEMORIA: SESSIONI, CACHE E TETTO ==========
+MEMORIA_MAX_MB = int(os.environ.get("BB_MEMORIA_MAX_MB", "0"))  # 0 = nessun tetto
+CACHE_DATI = ["fatti_condivisi", "cubo_margini", "giorno_barca_simulatore", "statistiche_simulatore"]
+
+@st.cache_resource
+def contabilita_memoria():
+    return ContabilitaMemoria()
+
+@st.cache_resource
+def campionatore_rss():
+    return CampionatoreRss()
+
+def registra_in_cache(nome, chiave, valore, max_voci=None):
+    # Nelle funzioni in cache: registra la dimensione della voce appena calcolata e la ritorna
+    contabilita_memoria().registra_cache(nome, chiave, dimensione_profonda(valore), max_voci)
+    return valore
+
+campionatore_rss().chiudi(st.session_state.pop("gettone_rss", None))  # rerun precedente interrotto
+GETTONE_RSS = st.session_state["gettone_rss"] = campionatore_rss().apri()
+
 # === PALETTE & STILI ===
 primary_blue = "#073763"
 gold = "#c7a96b"
@@ -113,244 +158,59 @@ def breadcrumb(area=None, barca=None):
 
 # ========== CARICAMENTO DATI KPI (Taxi) ==========
 
-@st.cache_data
-def carica_dati():
-    files = sorted(glob.glob("crmboats_taxi*.xlsx"))
-    dfs = []
-    for file in files:
-        xls = pd.ExcelFile(file)
-        for nome_foglio in xls.sheet_names:
-            nome_clean = str(nome_foglio).strip().lower().replace("<", "").replace(">", "")
-            if any(x in nome_clean for x in ["totale", "totali", "sintesi", "legenda"]):
-                continue
-            tmp = pd.read_excel(xls, sheet_name=nome_foglio, skiprows=2, usecols="B:I")
-            if tmp.shape[0] > 0:
-                tmp = tmp.iloc[:-1]  # Escludi ultima riga (totale mensile)
-            col_data = tmp.columns[0]
-            tmp = tmp.rename(columns={col_data: "Data"})
-            tmp["MeseFoglio"] = nome_foglio
-            tmp["AnnoFile"] = os.path.basename(file)
-            dfs.append(tmp)
-    if not dfs:
-        return pd.DataFrame()
-
-    df = pd.concat(dfs, ignore_index=True)
-    df["Data"] = pd.to_datetime(df["Data"], errors="coerce", dayfirst=True).ffill()
-
-    col_tratte = df.columns[1]
-    col_durata = df.columns[2]
-    col_clienti = df.columns[3]
-    col_barca = df.columns[4]
-    col_dip = df.columns[5]
-    col_incasso = df.columns[6]
-    col_gasolio = df.columns[7]
-
-    df["TipoRiga"] = df[col_dip].apply(lambda x: "Totale" if pd.notnull(x) and str(x).strip() != "" else "Dettaglio")
-    df["Incasso"] = pd.to_numeric(df[col_incasso].replace({r"[€]": ""}, regex=True).str.replace(",", "."), errors="coerce")
-    df["Gasolio"] = pd.to_numeric(df[col_gasolio].replace({r"[€]": ""}, regex=True).str.replace(",", "."), errors="coerce")
-    df["Clienti"] = pd.to_numeric(df[col_clienti], errors="coerce")
-    df["Durata"] = df[col_durata]
-    df["Dipendente"] = df[col_dip]
-
-    # --- Normalizzazione barche: abbreviazioni SOLO su Dettaglio ---
-    ABBREV_TO_FULL = {
-        "Bel": "Beluga", "Lib": "Libera", "Ghi": "Ghibli", "Mag": "Magia", "Kia": "Kiar di Luna",
-        "Bec": "Become", "Ete": "Eternity", "Col": "Columbus", "Can": "Candido", "Vir": "Virgilio", "Riv": "Riva"
-    }
-    FULL_NAMES = set([
-        "Beluga", "Libera", "Ghibli", "Magia", "Kiar di Luna", "Become",
-        "Eternity", "L’Aurora", "L'Aurora", "Columbus", "Candido", "Virgilio", "Riva"
-    ])
-
-    def normalizza_barca_condizionale(nome, tipo_riga):
-        if pd.isnull(nome):
-            return None
-        s = str(nome).strip().replace("’", "'").replace("‘", "'")
-        s_lower = s.lower()
-        if s_lower in ("l'aurora", "l’aurora"):
-            return "L’Aurora"
-        if tipo_riga == "Dettaglio":
-            for abbr, full in ABBREV_TO_FULL.items():
-                if s_lower == abbr.lower():
-                    return full
-            for full in FULL_NAMES:
-                if s_lower == full.lower():
-                    return "L’Aurora" if "aurora" in s_lower else full
-            return None
-        else:  # Totale
-            for full in FULL_NAMES:
-                if s_lower == full.lower():
-                    return "L’Aurora" if "aurora" in s_lower else full
-            return None
-
-    df["Barca_Normalizzata"] = df.apply(
-        lambda r: normalizza_barca_condizionale(r[col_barca], r["TipoRiga"]),
-        axis=1
-    )
-
-    # Assegna area
-    AREE_BARCHE = {
-        "Sirmione": ["Beluga", "Libera", "Ghibli", "Magia", "Kiar di Luna", "Become"],
-        "Desenzano": ["Eternity", "L’Aurora"],
-        "BSD": ["Columbus"],
-        "Exclusive": ["Candido", "Virgilio"],
-        "Riva": ["Riva"]
-    }
-    def assegna_area(nome_barca):
-        if pd.isnull(nome_barca):
-            return None
-        for area, elenco in AREE_BARCHE.items():
-            if nome_barca in elenco:
-                return area
-        return None
-
-    df["Area"] = df["Barca_Normalizzata"].apply(assegna_area)
-    df = df.dropna(subset=["Barca_Normalizzata", "Area"])
-
-    # Colonne derivate
-    df["Anno"] = df["Data"].dt.year
-    oggi = pd.Timestamp(datetime.now().date())
-    df = df[df["Data"] <= oggi]
-    df["TipoGiorno"] = df["Data"].dt.weekday.apply(lambda x: "Alti" if x >= 5 else "Bassi")
-    df["TipoCliente"] = df.apply(
-        lambda row: "Privati" if row["TipoRiga"] == "Dettaglio" and pd.notnull(row["Clienti"]) and row["Clienti"] <= 5
-        else ("Gruppo" if row["TipoRiga"] == "Dettaglio" and pd.notnull(row["Clienti"]) and row["Clienti"] > 5 else None),
-        axis=1
-    )
+RIPROVA_METEO_S = 600  # registro caricato senza (tutto) il meteo: nuovo tentativo dopo 10 minuti
 
-    return df
+@st.cache_resource(max_entries=2, show_spinner="Caricamento registro e meteo…")
+def fatti_condivisi(firma):
+    """
+    Registro con meteo, uno per versione dei file sorgente (`firma`), in sola lettura e condiviso
+    da tutte le sessioni: ogni rerun ne prende una vista, senza copie né merge meteo per sessione.
+    """
+    profilo.conta("cache.fatti_condivisi.miss")
+    fatti = motore.dati.carica_fatti()
+    registra_in_cache("fatti_condivisi", fatti.versione, fatti.df, max_voci=2)
+    return fatti
 
 # Gestione del pulsante per ricaricare i dati
 ricarica = st.sidebar.button("🔄 Ricarica dati")
 if ricarica:
     st.cache_data.clear()
+    fatti_condivisi.clear()
+    for nome in CACHE_DATI:
+        contabilita_memoria().dimentica_cache(nome)
     st.success("Dati ricaricati! Puoi aggiornare la pagina.")
 
 # Carica dati sempre PRIMA di ogni utilizzo!
-df = carica_dati()
-
-def aggiorna_meteo(df, start_date, end_date):
-    import requests
-    lat, lon = 45.492, 10.608  # Sirmione
-    anni = list(range(start_date.year, end_date.year + 1))
-    meteo_dfs = []
-    for anno in anni:
-        inizio = max(start_date, pd.Timestamp(f"{anno}-01-01"))
-        fine = min(end_date, pd.Timestamp(f"{anno}-12-31"))
-        url = (
-            f"https://archive-api.open-meteo.com/v1/archive?"
-            f"latitude={lat}&longitude={lon}"
-            f"&start_date={inizio.strftime('%Y-%m-%d')}&end_date={fine.strftime('%Y-%m-%d')}"
-            f"&daily=precipitation_sum,weathercode,windspeed_10m_max"
-            f"&timezone=Europe%2FBerlin"
-        )
-        try:
-            r = requests.get(url, timeout=10)
-            r.raise_for_status()
-            resp_json = r.json()
-            if "daily" in resp_json and resp_json["daily"]:
-                data = resp_json["daily"]
-                meteo_df = pd.DataFrame(data)
-                meteo_df["Data"] = pd.to_datetime(meteo_df["time"])
-                meteo_df["Maltempo"] = (meteo_df["precipitation_sum"] > 3) | (meteo_df["windspeed_10m_max"] > 40)
-                meteo_dfs.append(meteo_df)
-        except Exception as e:
-            st.warning(f"Errore caricamento meteo per il {anno}: {e}")
-
-    if not meteo_dfs:
-        st.warning("Nessun dato meteo disponibile.")
-        if "Maltempo" not in df.columns:
-            df["Maltempo"] = np.nan
-        return df
-
-    meteo_df_tot = pd.concat(meteo_dfs, ignore_index=True)
-    # Merge: normalizza data per evitare problemi di orario
-    df["DataNorm"] = pd.to_datetime(df["Data"]).dt.normalize()
-    meteo_df_tot["DataNorm"] = meteo_df_tot["Data"].dt.normalize()
-    df = pd.merge(
-        df, 
-        meteo_df_tot[["DataNorm", "precipitation_sum", "windspeed_10m_max", "Maltempo"]],
-        left_on="DataNorm", right_on="DataNorm", how="left"
-    )
-    df.drop(columns=["DataNorm"], inplace=True)
-    st.success(f"Dati meteo scaricati per {len(meteo_df_tot)} giorni (in blocchi annuali).")
-    return df
+with profilo.intervallo("fatti_condivisi", cache="fatti_condivisi") as intervallo:
+    FATTI = fatti_condivisi(firma_sorgenti())
+    if FATTI.esito.errori and datetime.now().timestamp() - FATTI.creato > RIPROVA_METEO_S:
+        fatti_condivisi.clear()
+        contabilita_memoria().dimentica_cache("fatti_condivisi")
+        FATTI = fatti_condivisi(firma_sorgenti())
+    df = FATTI.vista()
+    intervallo.righe = len(df)
+
+esito_meteo = FATTI.esito
+for errore in esito_meteo.errori:
+    st.warning(errore)
+if esito_meteo.giorni:
+    st.success(f"Dati meteo scaricati per {esito_meteo.giorni} giorni (in blocchi annuali).")
+else:
+    st.warning("Nessun dato meteo disponibile.")
 
-start_date = df["Data"].min()
-end_date = df["Data"].max()
-df = aggiorna_meteo(df, start_date, end_date)
-if "Maltempo" not in df.columns:
-    df["Maltempo"] = np.nan
+VERSIONE_DATI = FATTI.versione
 
 # ========== CARICAMENTO SPESE ==========
-
-def carica_spese(path="Bertoldi Boats.csv"):
+with profilo.intervallo("carica_spese") as intervallo:
     try:
-        df_spese = pd.read_csv(path)
+        df_spese = carica_spese("Bertoldi Boats.csv")
     except Exception as e:
         st.error(f"Errore nella lettura del file spese: {e}")
-        return pd.DataFrame()
-
-    colonne_originali = df_spese.columns.str.strip().str.upper()
-    mapping = {}
-    if "DATA" in colonne_originali:
-        mapping[df_spese.columns[colonne_originali.get_loc("DATA")]] = "Data"
-    if "COSTO" in colonne_originali:
-        mapping[df_spese.columns[colonne_originali.get_loc("COSTO")]] = "Costo"
-    if "TIPO SPESA" in colonne_originali:
-        mapping[df_spese.columns[colonne_originali.get_loc("TIPO SPESA")]] = "Tipo_Spesa"
-    if "FORNITORE" in colonne_originali:
-        mapping[df_spese.columns[colonne_originali.get_loc("FORNITORE")]] = "Fornitore"
-    if "CATEGORIA" in colonne_originali:
-        mapping[df_spese.columns[colonne_originali.get_loc("CATEGORIA")]] = "Categoria"
-    if "DESTINAZIONE" in colonne_originali:
-        mapping[df_spese.columns[colonne_originali.get_loc("DESTINAZIONE")]] = "Destinazione"
-    if "METODO PAGAMENTO" in colonne_originali:
-        mapping[df_spese.columns[colonne_originali.get_loc("METODO PAGAMENTO")]] = "Metodo_Pagamento"
-    df_spese = df_spese.rename(columns=mapping)
-
-    if "Data" in df_spese.columns:
-        df_spese["Data"] = pd.to_datetime(df_spese["Data"], dayfirst=True, errors="coerce")
-    if "Costo" in df_spese.columns:
-        df_spese["Costo"] = (
-            df_spese["Costo"]
-            .astype(str)
-            .str.replace("€", "")
-            .str.replace(".", "")
-            .str.replace(",", ".")
-            .str.strip()
-        )
-        df_spese["Costo"] = pd.to_numeric(df_spese["Costo"], errors="coerce")
-    return df_spese
-
-df_spese = carica_spese("Bertoldi Boats.csv")
-
-# ========== CLASSIFICAZIONE SPESE ==========
-def classifica_spese(df):
-    df.columns = [c.strip().capitalize() for c in df.columns]
-
-    def macro_categoria(row):
-        cat = str(row.get("Categoria", "")).lower() if pd.notnull(row.get("Categoria", "")) else ""
-        tipo = str(row.get("Tipo_spesa", "")).lower() if pd.notnull(row.get("Tipo_spesa", "")) else ""
-        if "acquisto nuovo" in cat:
-            return "Acquisto nuovo"
-        elif "provvigioni" in cat:
-            return "Provvigioni"
-        elif "gasolio" in cat:
-            return "Gasolio"
-        elif "stipendi" in cat or "f24" in cat:
-            return "Stipendi"
-        elif tipo == "fissi" and not any(x in cat for x in ["acquisto nuovo", "gasolio", "provvigioni", "tasse"]):
-            return "Spese fisse"
-        elif tipo == "variabili" and "acquisto nuovo" not in cat and "provvigioni" not in cat:
-            return "Spese variabili"
-        else:
-            return "Altro"
-    df["MACRO_CATEGORIA"] = df.apply(macro_categoria, axis=1)
-    return df
+        df_spese = pd.DataFrame()
 
-if not df_spese.empty:
-    df_spese = classifica_spese(df_spese)
+    if not df_spese.empty:
+        df_spese = classifica_spese(df_spese)
+    intervallo.righe = len(df_spese)
 
 # ========== FILTRI E SIDEBAR ==========
 anni = sorted(df["Anno"].dropna().unique())
@@ -383,30 +243,40 @@ if modalita == "Analisi":
         sett_1 = st.sidebar.selectbox("Settimana", settimane, key="analisi_sett")
         periodo_selezionato = {"modalita": "analisi", "tipo": "settimanale", "anno": anno_1, "settimana": sett_1}
 else:
+    # Confronto a N periodi: la selezione è una lista `periodi` nell'ordine scelto (il primo è la base)
+    ultima_data = df["Data"].max()
     if periodo_tipo == "Annuale":
-        anno_1 = st.sidebar.selectbox("Anno 1", anni, key="confronto_anno1")
-        anno_2 = st.sidebar.selectbox("Anno 2", [a for a in anni if a != anno_1], key="confronto_anno2")
-        periodo_selezionato = {"modalita": "confronto", "tipo": "annuale", "anno1": anno_1, "anno2": anno_2}
+        scelti = st.sidebar.multiselect("Anni da confrontare", anni, default=anni[-2:], key="confronto_anni")
+        periodi = [{"anno": a} for a in scelti]
+        periodo_selezionato = {"modalita": "confronto", "tipo": "annuale", "periodi": periodi}
     elif periodo_tipo == "Mensile":
-        anno_1 = st.sidebar.selectbox("Anno 1", anni, key="confronto_mese_anno1")
-        mese_1 = st.sidebar.selectbox("Mese 1", mesi, key="confronto_mese1")
-        anno_2 = st.sidebar.selectbox("Anno 2", anni, key="confronto_mese_anno2")
-        mese_2 = st.sidebar.selectbox("Mese 2", mesi, key="confronto_mese2")
-        periodo_selezionato = {
-            "modalita": "confronto", "tipo": "mensile",
-            "anno1": anno_1, "mese1": mesi.index(mese_1) + 1,
-            "anno2": anno_2, "mese2": mesi.index(mese_2) + 1
-        }
+        opzioni = [(a, m) for a in anni for m in range(1, 13)]
+        scelti = st.sidebar.multiselect(
+            "Mesi da confrontare", opzioni,
+            default=[(a, ultima_data.month) for a in anni[-2:]],
+            format_func=lambda o: f"{calendar.month_name[o[1]]} {o[0]}", key="confronto_mesi"
+        )
+        periodi = [{"anno": a, "mese": m} for a, m in scelti]
+        periodo_selezionato = {"modalita": "confronto", "tipo": "mensile", "periodi": periodi}
     elif periodo_tipo == "Settimanale":
-        anno_1 = st.sidebar.selectbox("Anno 1", anni, key="confronto_sett_anno1")
-        sett_1 = st.sidebar.selectbox("Settimana 1", settimane, key="confronto_sett1")
-        anno_2 = st.sidebar.selectbox("Anno 2", anni, key="confronto_sett_anno2")
-        sett_2 = st.sidebar.selectbox("Settimana 2", settimane, key="confronto_sett2")
-        periodo_selezionato = {
-            "modalita": "confronto", "tipo": "settimanale",
-            "anno1": anno_1, "settimana1": sett_1,
-            "anno2": anno_2, "settimana2": sett_2
-        }
+        opzioni = [(a, w) for a in anni for w in settimane]
+        sett_ultima = min(int(ultima_data.isocalendar().week), sett_max)
+        scelti = st.sidebar.multiselect(
+            "Settimane da confrontare", opzioni,
+            default=[(a, sett_ultima) for a in anni[-2:]],
+            format_func=lambda o: f"Settimana {o[1]} {o[0]}", key="confronto_settimane"
+        )
+        periodi = [{"anno": a, "settimana": w} for a, w in scelti]
+        periodo_selezionato = {"modalita": "confronto", "tipo": "settimanale", "periodi": periodi}
+    if periodo_tipo != "Settimanale":
+        # Le settimane ISO sono già allineate per giorno della settimana
+        periodo_selezionato["allinea"] = st.sidebar.checkbox(
+            "Allinea per giorno della settimana", value=False, key="confronto_allinea",
+            help="Ogni periodo prende i giorni con lo stesso giorno della settimana del primo periodo "
+                 "scelto (spostamenti di 364/371 giorni): stesso mix di giorni Alti/Bassi."
+        )
+    if len(periodi) < 2:
+        st.sidebar.warning("Seleziona almeno due periodi da confrontare.")
 
 st.sidebar.markdown("---")
 giorno_sel = st.sidebar.selectbox("Tipo di giornata", ["Tutti", "Alti", "Bassi", "Confronto Alti/Bassi"])
@@ -417,224 +287,332 @@ if area_sel and area_sel != "Tutte":
 else:
     barche_disp = ["Tutte"] + sorted(df["Barca_Normalizzata"].dropna().unique().tolist())
 barca_sel = st.sidebar.selectbox("Barca", barche_disp, index=0)
+box_compatti = st.sidebar.checkbox(
+    "Box plot compatti", value=True,
+    help="Quartili e outlier calcolati sul server: grafici leggeri anche con molte stagioni."
+)
 st.sidebar.info("💡 **Consiglio:** I filtri si riflettono su tutti i grafici e le tabelle.")
 
-# ========== FUNZIONE FILTRO ==========
-def filtra_dataframe(df, periodo_sel, giorno_sel, tipo_cliente_sel, area_sel, barca_sel=None):
-    df_filtrato = df.copy()
-    # --- FILTRO PERIODO ---
-    if periodo_sel["modalita"] == "analisi":
-        if periodo_sel["tipo"] == "annuale":
-            df_filtrato = df_filtrato[df_filtrato["Anno"] == periodo_sel["anno"]]
-        elif periodo_sel["tipo"] == "mensile":
-            df_filtrato = df_filtrato[
-                (df_filtrato["Anno"] == periodo_sel["anno"]) &
-                (df_filtrato["Data"].dt.month == periodo_sel["mese"])
-            ]
-        elif periodo_sel["tipo"] == "settimanale":
-            settimana = periodo_sel["settimana"]
-            anno = periodo_sel["anno"]
-            df_filtrato = df_filtrato[
-                (df_filtrato["Anno"] == anno) &
-                (df_filtrato["Data"].dt.isocalendar().week == settimana)
-            ]
-    elif periodo_sel["modalita"] == "confronto":
-        if periodo_sel["tipo"] == "annuale":
-            anni = [periodo_sel["anno1"], periodo_sel["anno2"]]
-            df_filtrato = df_filtrato[df_filtrato["Anno"].isin(anni)]
-        elif periodo_sel["tipo"] == "mensile":
-            mask_1 = (df_filtrato["Anno"] == periodo_sel["anno1"]) & (df_filtrato["Data"].dt.month == periodo_sel["mese1"])
-            mask_2 = (df_filtrato["Anno"] == periodo_sel["anno2"]) & (df_filtrato["Data"].dt.month == periodo_sel["mese2"])
-            df_filtrato = df_filtrato[mask_1 | mask_2]
-        elif periodo_sel["tipo"] == "settimanale":
-            mask_1 = (df_filtrato["Anno"] == periodo_sel["anno1"]) & (df_filtrato["Data"].dt.isocalendar().week == periodo_sel["settimana1"])
-            mask_2 = (df_filtrato["Anno"] == periodo_sel["anno2"]) & (df_filtrato["Data"].dt.isocalendar().week == periodo_sel["settimana2"])
-            df_filtrato = df_filtrato[mask_1 | mask_2]
-    # --- FILTRO GIORNO ---
-    if giorno_sel == "Alti":
-        df_filtrato = df_filtrato[df_filtrato["TipoGiorno"] == "Alti"]
-    elif giorno_sel == "Bassi":
-        df_filtrato = df_filtrato[df_filtrato["TipoGiorno"] == "Bassi"]
-    elif giorno_sel == "Confronto Alti/Bassi":
-        df_filtrato = df_filtrato[df_filtrato["TipoGiorno"].isin(["Alti", "Bassi"])]
-    # --- FILTRO TIPO CLIENTE ---
-    if tipo_cliente_sel == "Privati":
-        df_filtrato = df_filtrato[df_filtrato["TipoCliente"] == "Privati"]
-    elif tipo_cliente_sel == "Gruppo":
-        df_filtrato = df_filtrato[df_filtrato["TipoCliente"] == "Gruppo"]
-    elif tipo_cliente_sel == "Confronto Privati/Gruppo":
-        df_filtrato = df_filtrato[df_filtrato["TipoCliente"].isin(["Privati", "Gruppo"])]
-    # --- FILTRO AREA ---
-    if area_sel and area_sel != "Tutte":
-        df_filtrato = df_filtrato[df_filtrato["Area"] == area_sel]
-    # --- FILTRO BARCA ---
-    if barca_sel and barca_sel != "Tutte":
-        df_filtrato = df_filtrato[df_filtrato["Barca_Normalizzata"] == barca_sel]
-    return df_filtrato
+def chiave_filtri(periodo_sel, giorno_sel, tipo_cliente_sel, area_sel, barca_sel, **extra):
+    # Chiave normalizzata della selezione: stesso filtro → stessa stringa, a prescindere dall'ordine
+    return json.dumps({
+        "periodo": periodo_sel, "giorno": giorno_sel, "cliente": tipo_cliente_sel,
+        "area": area_sel or "Tutte", "barca": barca_sel or "Tutte", **extra
+    }, sort_keys=True, default=str)
+
+CHIAVE_FILTRI = chiave_filtri(periodo_selezionato, giorno_sel, tipo_cliente_sel, area_sel, barca_sel,
+                              box_compatti=box_compatti)
+
+# ========== ROLLUP GERARCHICI (HOME > AREA > BARCA) ==========
+@st.cache_resource(max_entries=2, show_spinner=False)
+def rollup_gerarchici(versione, _df):
+    # Ricostruiti tutti insieme quando cambia `versione`, condivisi tra le sessioni
+    profilo.conta("cache.rollup_gerarchici.miss")
+    return registra_in_cache("rollup_gerarchici", versione, motore.kpi.rollup_gerarchici(_df), max_voci=2)
+
+with profilo.intervallo("rollup_gerarchici", righe=len(df), cache="rollup_gerarchici"):
+    ROLLUP = rollup_gerarchici(VERSIONE_DATI, df)
+
+# ========== CONTO ECONOMICO MENSILE PER BARCA (CUBO MARGINI) ==========
+@st.cache_data(show_spinner=False, max_entries=2)
+def cubo_margini(versione, _df, _df_spese):
+    profilo.conta("cache.cubo_margini.miss")
+    return registra_in_cache("cubo_margini", versione, motore.margini.cubo_margini(_df, _df_spese), max_voci=2)
+
+with profilo.intervallo("cubo_margini", righe=len(df), cache="cubo_margini"):
+    CUBO_MARGINI = cubo_margini(VERSIONE_DATI, df, df_spese)
 
 # Esempio uso: 
-df_kpi = filtra_dataframe(df, periodo_selezionato, giorno_sel, tipo_cliente_sel, area_sel, barca_sel)
+with profilo.intervallo("filtra_dataframe") as intervallo:
+    df_kpi = filtra_dataframe(df, periodo_selezionato, giorno_sel, tipo_cliente_sel, area_sel, barca_sel)
+    intervallo.righe = len(df_kpi)
+
+
+# ========== GRAFICI: BUDGET PAYLOAD E RENDERING ==========
+logger = logging.getLogger("bb_dashboard")
+if os.environ.get("BB_LOG_LEVEL"):
+    logging.basicConfig(level=os.environ["BB_LOG_LEVEL"].upper(), format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+SOGLIA_PAYLOAD_BYTE = 400_000   # oltre questa stima: WebGL + decimazione
+MAX_PUNTI_TRACCIA = 4_000       # punti massimi per traccia scatter dopo la decimazione
+MAX_BARRE_CON_TESTO = 150       # oltre: niente etichette text_auto sulle barre
+_CAMPI_ARRAY = ("x", "y", "text", "hovertext", "customdata")
+
+def stima_payload(fig):
+    # Stima economica dei byte JSON: per ogni array delle tracce misura un campione e proietta
+    totale = 5_000  # layout, template e struttura
+    for traccia in fig.data:
+        for campo in _CAMPI_ARRAY:
+            valori = traccia[campo]
+            if valori is None or isinstance(valori, str):
+                continue
+            n = len(valori)
+            if n == 0:
+                continue
+            campione = [v.item() if hasattr(v, "item") else v for v in list(valori[:50])]
+            totale += int(len(json.dumps(campione, default=str)) / len(campione) * n)
+    return totale
+
+def decima_estremi(x, y, max_punti):
+    """
+    Indici dei punti da tenere: i punti sono ordinati per x e divisi in max_punti/2 blocchi;
+    in ogni blocco si tengono minimo e massimo di y, così gli estremi restano visibili.
+    """
+    n = len(y)
+    if n <= max_punti:
+        return np.arange(n)
+    codici_x = pd.factorize(pd.Series(x), sort=True)[0] if x is not None else np.arange(n)
+    ordine = np.argsort(codici_x, kind="stable")
+    blocchi = np.arange(n) * (max_punti // 2) // n
+    y_ord = pd.Series(pd.to_numeric(pd.Series(np.asarray(y)[ordine]), errors="coerce").to_numpy())
+    per_blocco = y_ord.groupby(blocchi)
+    tenuti = np.unique(np.r_[per_blocco.idxmin().dropna().to_numpy(), per_blocco.idxmax().dropna().to_numpy()].astype(int))
+    return np.sort(ordine[tenuti])
+
+def alleggerisci_figura(fig, soglia_byte=SOGLIA_PAYLOAD_BYTE, max_punti=MAX_PUNTI_TRACCIA):
+    """
+    Applica il budget di payload: se la stima supera soglia_byte le tracce scatter passano a
+    WebGL (Scattergl) e vengono decimate preservando gli estremi; le etichette delle barre
+    vengono tolte quando le barre sono troppe. Ritorna (figura, stima iniziale, modificata).
+    """
+    stima = stima_payload(fig)
+    n_barre = sum(len(t.x) for t in fig.data if t.type == "bar" and t.x is not None)
+    modificata = False
+    if n_barre > MAX_BARRE_CON_TESTO:
+        fig.update_traces(texttemplate=None, text=None, selector=dict(type="bar"))
+        modificata = True
+    if stima <= soglia_byte:
+        return fig, stima, modificata
+
+    nuove_tracce = []
+    for traccia in fig.data:
+        if traccia.type in ("scatter", "scattergl") and traccia.y is not None and len(traccia.y) > max_punti:
+            dati = traccia.to_plotly_json()
+            dati.pop("type", None)
+            idx = decima_estremi(traccia.x, traccia.y, max_punti)
+            for campo in _CAMPI_ARRAY:
+                if dati.get(campo) is not None and not isinstance(dati[campo], str):
+                    dati[campo] = np.asarray(dati[campo])[idx]
+            colore = dati.get("marker", {}).get("color")
+            if colore is not None and not isinstance(colore, str):
+                dati["marker"]["color"] = np.asarray(colore)[idx]
+            nuove_tracce.append(go.Scattergl(**dati))
+            modificata = True
+        else:
+            nuove_tracce.append(traccia)
+    if modificata:
+        fig = go.Figure(data=nuove_tracce, layout=fig.layout)
+    return fig, stima, modificata
+
+@st.cache_resource
+def cache_figure():
+    return CacheLRU(int(os.environ.get("BB_CACHE_FIGURE_MB", "64")) * 1024 * 1024)
 
+def mostra_grafico(costruisci, chiave, extra=None):
+    """
+    Unico punto di uscita dei grafici Plotly: cache della figura serializzata per
+    (grafico, versione dati, filtri, extra), budget payload e log dei byte inviati.
+    costruisci è una funzione senza argomenti che ritorna la figura: se il grafico è in cache
+    pandas e Plotly Express non vengono eseguiti affatto, quindi extra deve contenere ogni
+    input della figura che non sia già nei filtri della sidebar.
+    """
+    cache = cache_figure()
+    chiave_cache = (chiave, VERSIONE_DATI, CHIAVE_FILTRI, json.dumps(extra, sort_keys=True, default=str))
+    fig_json = cache.get(chiave_cache)
+    da_cache = fig_json is not None
+    profilo.conta("cache.figure.hit" if da_cache else "cache.figure.miss")
+    if da_cache:
+        with profilo.intervallo(f"plotly:{chiave}:da_json"):
+            figura = pio.from_json(fig_json, skip_invalid=True)
+        stima, modificata = len(fig_json), False
+    else:
+        with profilo.intervallo(f"plotly:{chiave}:costruzione"):
+            figura = costruisci()
+        with profilo.intervallo(f"plotly:{chiave}:serializzazione"):
+            figura, stima, modificata = alleggerisci_figura(figura)
+            fig_json = figura.to_json()
+        cache.put(chiave_cache, fig_json)
+    with profilo.intervallo(f"plotly:{chiave}:invio"):
+        st.plotly_chart(figura, use_container_width=True, key=chiave)
+    profilo.conta("plotly.byte", len(fig_json))
+    logger.info("grafico %s: %d byte inviati (stima %d%s%s)", chiave, len(fig_json), stima,
+                ", alleggerito" if modificata else "", ", da cache" if da_cache else "")
+
+# ========== GRAFICI: BOX PLOT RIASSUNTIVI LATO SERVER ==========
+def riassunto_box(df, x, y, chiavi_extra=(), max_outlier=30):
+    """
+    Statistiche dei box calcolate lato server per ogni gruppo (chiavi_extra + x): quartili,
+    baffi a 1.5·IQR (come Plotly) e al massimo max_outlier outlier per box, i più estremi.
+    Ritorna (DataFrame con q1/mediana/q3/baffi/n per box, DataFrame degli outlier tenuti).
+    """
+    chiavi = list(chiavi_extra) + [x]
+    d = df[chiavi + [y]].dropna(subset=[y])
+    gruppi = d.groupby(chiavi, observed=True)[y]
+    box = gruppi.quantile([0.25, 0.5, 0.75]).unstack()
+    box.columns = ["q1", "mediana", "q3"]
+    box["n"] = gruppi.size()
+
+    # Baffi: valori estremi dentro [q1 - 1.5·IQR, q3 + 1.5·IQR]
+    d = d.merge(box[["q1", "mediana", "q3"]], left_on=chiavi, right_index=True, how="left")
+    iqr = d["q3"] - d["q1"]
+    dentro = d[y].between(d["q1"] - 1.5 * iqr, d["q3"] + 1.5 * iqr)
+    baffi = d[dentro].groupby(chiavi, observed=True)[y].agg(["min", "max"])
+    box["baffo_basso"] = baffi["min"]
+    box["baffo_alto"] = baffi["max"]
+
+    # Outlier: solo i max_outlier più lontani dalla mediana per ogni box
+    fuori = d[~dentro].assign(_distanza=(d[y] - d["mediana"]).abs())
+    rango = fuori.groupby(chiavi, observed=True)["_distanza"].rank(method="first", ascending=False)
+    fuori = fuori[rango <= max_outlier]
+    return box.reset_index(), fuori[chiavi + [y]]
+
+def box_riassuntivo(df, x, y, color=None, facet_col=None, category_orders=None,
+                    color_discrete_sequence=None, max_outlier=30):
+    """
+    Box plot con statistiche precalcolate (q1/mediana/q3/baffi) e outlier campionati:
+    il payload cresce col numero di box, non con le righe di df.
+    Stessa interfaccia essenziale di px.box (x, y, color, facet_col, category_orders).
+    """
+    category_orders = category_orders or {}
+    colori = color_discrete_sequence or px.colors.qualitative.Plotly
+    chiavi_extra = [c for c in (facet_col, color) if c and c != x]
+    box, outlier = riassunto_box(df, x, y, chiavi_extra, max_outlier=max_outlier)
+
+    def _ordine(col, valori):
+        presenti = pd.unique(valori)
+        ordine = [v for v in category_orders.get(col, []) if v in set(presenti)]
+        return ordine + sorted([v for v in presenti if v not in set(ordine)], key=str)
+
+    facce = _ordine(facet_col, box[facet_col]) if facet_col else [None]
+    serie_colore = _ordine(color, box[color]) if color else [None]
+    ordine_x = [str(v) for v in _ordine(x, box[x])]
+    fig = make_subplots(
+        rows=1, cols=len(facce), shared_yaxes=True,
+        subplot_titles=[f"{facet_col}={f}" for f in facce] if facet_col else None
+    )
+    for col_idx, faccia in enumerate(facce, start=1):
+        box_f = box if faccia is None else box[box[facet_col] == faccia]
+        out_f = outlier if faccia is None else outlier[outlier[facet_col] == faccia]
+        for i, valore_colore in enumerate(serie_colore):
+            b = box_f if valore_colore is None else box_f[box_f[color] == valore_colore]
+            o = out_f if valore_colore is None else out_f[out_f[color] == valore_colore]
+            if b.empty:
+                continue
+            nome = str(valore_colore) if valore_colore is not None else y
+            colore = colori[i % len(colori)]
+            fig.add_trace(go.Box(
+                x=b[x].astype(str), q1=b["q1"], median=b["mediana"], q3=b["q3"],
+                lowerfence=b["baffo_basso"], upperfence=b["baffo_alto"],
+                name=nome, legendgroup=nome, offsetgroup=nome, marker_color=colore,
+                showlegend=(col_idx == 1 and valore_colore is not None)
+            ), row=1, col=col_idx)
+            if not o.empty:
+                fig.add_trace(go.Scatter(
+                    x=o[x].astype(str), y=o[y], mode="markers", name=nome, legendgroup=nome,
+                    offsetgroup=nome, marker=dict(color=colore, size=5), showlegend=False
+                ), row=1, col=col_idx)
+    fig.update_xaxes(categoryorder="array", categoryarray=ordine_x, title_text=x)
+    fig.update_yaxes(title_text=y, col=1)
+    fig.update_layout(boxmode="group", scattermode="group")
+    return fig
+
+# ========== EXPORT CSV / PARQUET / EXCEL ==========
+# Streamlit tiene in memoria il file scaricato: oltre questa soglia si usa l'API (/esporta), che lo trasmette a blocchi
+MAX_RIGHE_DOWNLOAD = int(os.environ.get("BB_EXPORT_MAX_RIGHE", "500000"))
+
+def pulsanti_export(nome, tabella, chiave, posizioni=None, colonne=None):
+    """
+    Scelta del formato e download di `tabella` (righe `posizioni`, tutte se None). Il file viene
+    generato solo al clic, a blocchi di righe scritti su un file temporaneo; oltre
+    MAX_RIGHE_DOWNLOAD righe il pulsante è disattivato.
+    """
+    righe = len(tabella) if posizioni is None else len(posizioni)
+    c1, c2 = st.columns([2, 3])
+    formato = c1.radio(f"Formato {nome}", list(FORMATI_EXPORT), horizontal=True, key=f"formato_{chiave}",
+                       label_visibility="collapsed")
+    mime, estensione = FORMATI_EXPORT[formato]
+    if righe > MAX_RIGHE_DOWNLOAD:
+        aiuto = f"Oltre {MAX_RIGHE_DOWNLOAD:,} righe: restringere i filtri o scaricare dall'API (/esporta)"
+    elif formato == "xlsx" and righe > MAX_RIGHE_EXCEL:
+        aiuto = "Troppe righe per un foglio Excel: usare CSV o Parquet"
+    else:
+        aiuto = None
+    c2.download_button(
+        f"Scarica {nome} ({righe:,} righe)",
+        lambda: esporta_su_file(tabella, formato, posizioni, colonne, foglio=chiave[:31]),
+        file_name=f"{chiave}.{estensione}", mime=mime, key=f"scarica_{chiave}", on_click="ignore",
+        disabled=righe == 0 or aiuto is not None, help=aiuto
+    )
 
 # ========== FUNZIONI TAB PRINCIPALI ==========
 
 
 
-def tab_kpi(df_filtrato, periodo_selezionato, giorno_sel, tipo_cliente_sel, area=None, barca=None):
+def tab_kpi(df_filtrato, periodo_selezionato, giorno_sel, tipo_cliente_sel, area=None, barca=None, risultati=None):
     if df_filtrato.empty:
         st.warning("Nessun dato disponibile per il filtro selezionato.")
         return
 
+    breadcrumb(area, barca)
     label_area = f" – Area: {area}" if area and area != "Tutte" else ""
     label_barca = f" – Barca: {barca}" if barca and barca != "Tutte" else ""
     st.subheader(f"📊 KPI chiave{label_area}{label_barca}")
 
-    # Usa solo righe Totale per i KPI globali giornalieri
-    df_tot = df_filtrato[df_filtrato["TipoRiga"] == "Totale"].copy()
-
-    incasso_tot = df_tot["Incasso"].sum()
-    num_tour = df_tot.shape[0]
-    media_clienti = df_tot["Clienti"].mean()
-    efficienza = (
-        df_tot["Incasso"].sum() /
-        df_tot["Gasolio"].replace(0, np.nan).sum()
-        if df_tot["Gasolio"].sum() > 0 else np.nan
+    r = risultati if risultati is not None else calcola_kpi(
+        df_filtrato, periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca, rollup=ROLLUP
     )
     kpi1, kpi2, kpi3, kpi4 = st.columns(4)
-    kpi1.metric("Incasso totale", f"{incasso_tot:,.0f} €")
-    kpi2.metric("Num. tour", f"{num_tour:,}")
-    kpi3.metric("Media clienti/tour", f"{media_clienti:.1f}")
-    kpi4.metric("Efficienza (€ per litro)", f"{efficienza:.1f}" if not np.isnan(efficienza) else "n.d.")
-    
-
-df_kpi = filtra_dataframe(df, periodo_selezionato, giorno_sel, tipo_cliente_sel, area_sel, barca_sel)
-
-
-
-
-def tab_performance(df_filtrato, periodo_selezionato, giorno_sel, tipo_cliente_sel, area=None, barca=None):
-    if df_filtrato.empty:
+    kpi1.metric("Incasso totale", f"{r.incasso_tot:,.0f} €")
+    kpi2.metric("Num. tour", f"{r.num_tour:,}")
+    kpi3.metric("Media clienti/tour", f"{r.media_clienti:.1f}")
+    kpi4.metric("Efficienza (€ per litro)", f"{r.efficienza:.1f}" if not np.isnan(r.efficienza) else "n.d.")
+
+    if r.figli:
+        with st.expander("🔽 Dettaglio livello inferiore"):
+            figli = pd.DataFrame(
+                [(k.incasso_tot, k.num_tour, k.media_clienti, k.efficienza) for k in r.figli.values()],
+                index=list(r.figli), columns=["Incasso", "Tour", "Clienti/tour", "€ per litro"]
+            )
+            figli = figli[figli["Tour"] > 0]
+            st.dataframe(figli.style.format({
+                "Incasso": "{:,.0f} €", "Tour": "{:,}", "Clienti/tour": "{:.1f}", "€ per litro": "{:.1f}"
+            }, na_rep="n.d."), use_container_width=True)
+
+def tab_performance(df_filtrato, periodo_selezionato, giorno_sel, tipo_cliente_sel, area=None, barca=None, risultati=None):
+    r = risultati if risultati is not None else calcola_performance(
+        df_filtrato, periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca
+    )
+    if r is None:
         st.warning("Nessun dato disponibile per il filtro selezionato.")
         return
 
-    # Lavoro su una copia
-    dfw = df_filtrato.copy()
-
-    # --- Crea 'Periodo' PRIMA di fare i subset (solo se modalità confronto) ---
-    period_label_used = False
-    if periodo_selezionato.get("modalita") == "confronto":
-        period_label_used = True
-        if periodo_selezionato["tipo"] == "annuale":
-            dfw["Periodo"] = dfw["Anno"].astype(str)
-
-        elif periodo_selezionato["tipo"] == "mensile":
-            anno1, mese1 = periodo_selezionato["anno1"], periodo_selezionato["mese1"]
-            anno2, mese2 = periodo_selezionato["anno2"], periodo_selezionato["mese2"]
-            dfw["Periodo"] = "Altro"
-            mask1 = (dfw["Anno"] == anno1) & (dfw["Data"].dt.month == mese1)
-            mask2 = (dfw["Anno"] == anno2) & (dfw["Data"].dt.month == mese2)
-            dfw.loc[mask1, "Periodo"] = f"{calendar.month_name[mese1]} {anno1}"
-            dfw.loc[mask2, "Periodo"] = f"{calendar.month_name[mese2]} {anno2}"
-
-        elif periodo_selezionato["tipo"] == "settimanale":
-            anno1, sett1 = periodo_selezionato["anno1"], periodo_selezionato["settimana1"]
-            anno2, sett2 = periodo_selezionato["anno2"], periodo_selezionato["settimana2"]
-            weeks = dfw["Data"].dt.isocalendar().week
-            dfw["Periodo"] = "Altro"
-            dfw.loc[(dfw["Anno"] == anno1) & (weeks == sett1), "Periodo"] = f"Settimana {sett1} {anno1}"
-            dfw.loc[(dfw["Anno"] == anno2) & (weeks == sett2), "Periodo"] = f"Settimana {sett2} {anno2}"
-
-    # --- Ora i subset Totale/Dettaglio (dopo la creazione di 'Periodo') ---
-    df_dettaglio = dfw[dfw["TipoRiga"] == "Dettaglio"].copy()
-    df_tot = dfw[dfw["TipoRiga"] == "Totale"].copy()
-
-    # --- Scelta split ---
-    area_unique = dfw["Area"].nunique() if "Area" in dfw.columns else 0
-    barche_unique = dfw["Barca_Normalizzata"].nunique() if "Barca_Normalizzata" in dfw.columns else 0
-
-    if area and area != "Tutte":
-        focus_descr = f"**Area selezionata:** {area}"
-        if barche_unique > 1:
-            split_col = "Barca_Normalizzata"
-            titolo = f"Incasso per Barca in {area}"
-            caption = f"Confronto tra le barche operative nell’area {area}."
-        else:
-            split_col = "Durata"
-            titolo = f"Incasso per Tipologia di Tour ({barca or ''})"
-            caption = f"Analisi delle tipologie di tour svolte dalla barca {barca or 'selezionata'}."
-    else:
-        focus_descr = "**Nessuna area selezionata:** confronto tra aree"
-        if area_unique > 1:
-            split_col = "Area"
-            titolo = "Incasso per Area"
-            caption = "Confronto tra tutte le aree operative."
-        elif barche_unique > 1:
-            split_col = "Barca_Normalizzata"
-            titolo = "Incasso per Barca"
-            caption = "Confronto tra le barche di tutte le aree."
-        else:
-            split_col = "Durata"
-            titolo = "Incasso per Tipologia Tour"
-            caption = "Analisi delle diverse tipologie di tour nella flotta."
-
-    palette = palette_bertoldi
-
-    # --- Costruzione colonne di groupby ---
-    gb_cols = [split_col]
-    color_col = None
-
-    # Confronto Alti/Bassi → aggiungo TipoGiorno (e color se non già impostato)
-    if giorno_sel == "Confronto Alti/Bassi":
-        gb_cols.append("TipoGiorno")
-        color_col = "TipoGiorno"
-
-    # Confronto periodi → aggiungo Periodo (e color a Periodo se non già impostato da TipoGiorno)
-    if period_label_used:
-        gb_cols.append("Periodo")
-        if color_col is None:
-            color_col = "Periodo"
-
-    # --- Confronto Privati/Gruppo sui Dettagli ---
-    if tipo_cliente_sel == "Confronto Privati/Gruppo" and "TipoCliente" in df_dettaglio.columns:
-        gb_cols_clienti = gb_cols + ["TipoCliente"]
-        color_for_fig = "TipoCliente"  # colore sul tipo cliente
-        gdf = df_dettaglio.groupby(gb_cols_clienti, dropna=False)["Incasso"].agg(["sum", "mean"]).reset_index()
-        fig = px.bar(
-            gdf, x=split_col, y="sum", color=color_for_fig,
-            barmode="group", text_auto=True, color_discrete_sequence=palette,
-            labels={"sum": "Incasso Totale", split_col: split_col, "TipoCliente": "Cliente", "Periodo": "Periodo", "TipoGiorno": "TipoGiorno"}
-        )
-    else:
-        gdf = df_dettaglio.groupby(gb_cols, dropna=False)["Incasso"].agg(["sum", "mean"]).reset_index()
-        fig = px.bar(
-            gdf, x=split_col, y="sum", color=color_col,
-            barmode="group", text_auto=True, color_discrete_sequence=palette,
-            labels={"sum": "Incasso Totale", split_col: split_col, "Periodo": "Periodo", "TipoGiorno": "TipoGiorno"}
-        )
-
-    st.subheader(titolo)
-    st.caption(focus_descr + "  \n" + caption)
-    st.plotly_chart(fig, use_container_width=True)
+    gdf, split_col, color_col = r.gdf, r.split_col, r.color_col
+    labels = {"sum": "Incasso Totale", split_col: split_col, "Periodo": "Periodo", "TipoGiorno": "TipoGiorno"}
+    if color_col == "TipoCliente":
+        labels["TipoCliente"] = "Cliente"
+    st.subheader(r.titolo)
+    st.caption(r.focus_descr + "  \n" + r.caption)
+    mostra_grafico(lambda: px.bar(
+        gdf, x=split_col, y="sum", color=color_col,
+        barmode="group", text_auto=True, color_discrete_sequence=palette_bertoldi,
+        labels=labels
+    ), "performance_incasso")
 
     # --- Tabella di sintesi + Top 3 ---
     st.markdown("**Sintesi:**")
     st.dataframe(gdf.style.format({"sum": "{:,.0f} €", "mean": "{:,.0f} €"}))
+    pulsanti_export("sintesi", tabella_esportabile(gdf), "performance")
     top3 = gdf.sort_values("sum", ascending=False).head(3)
     st.markdown(f"**🏆 Top 3 per {split_col}:**")
     st.dataframe(top3.style.format({"sum": "{:,.0f} €", "mean": "{:,.0f} €"}))
 
-    # --- Delta confronto tra periodi (solo se il colore è Periodo e ci sono esattamente 2 periodi) ---
-    if period_label_used and color_col == "Periodo":
-        try:
-            pivot = gdf.pivot(index=split_col, columns="Periodo", values="sum")
-            if pivot.shape[1] == 2:
-                col1, col2 = pivot.columns
-                pivot["Delta €"] = pivot[col2] - pivot[col1]
-                pivot["Delta %"] = np.where(pivot[col1] > 0, 100 * (pivot[col2] - pivot[col1]) / pivot[col1], np.nan)
-                st.markdown("**Delta confronto tra periodi:**")
-                st.dataframe(pivot.style.format({"Delta €": "{:,.0f} €", "Delta %": "{:+.1f}%"}))
-        except KeyError:
-            pass
+    if r.pivot is not None:
+        pivot = r.pivot
+        st.markdown(f"**Delta confronto tra periodi (rispetto a {pivot.columns[0]}):**")
+        st.dataframe(pivot.style.format({
+            c: ("{:,.0f} €" if c.startswith("Delta €") else "{:+.1f}%" if c.startswith("Delta %") else "{:,.0f} €")
+            for c in pivot.columns
+        }))
 
     # --- Nota statistica ---
     st.info("""
@@ -646,47 +624,14 @@ Il test ANOVA verifica se le differenze di incasso medio tra gruppi (area/barca/
 Le tabelle e i grafici sono focalizzati **solo sull’area selezionata** (se presente).
 """)
 
-def tab_popolarita(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area=None, barca=None):
-    if df_kpi.empty:
+def tab_popolarita(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area=None, barca=None, risultati=None):
+    r = risultati if risultati is not None else calcola_popolarita(
+        df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca
+    )
+    if r is None:
         st.warning("Nessun dato disponibile per il filtro selezionato.")
         return
 
-    # ====== PREP E 'Periodo' ======
-    dfw = df_kpi.copy()
-    compare_periods = (periodo_selezionato.get("modalita") == "confronto")
-
-    if compare_periods:
-        if periodo_selezionato["tipo"] == "annuale":
-            dfw["Periodo"] = dfw["Anno"].astype(str)
-
-        elif periodo_selezionato["tipo"] == "mensile":
-            anno1, mese1 = periodo_selezionato["anno1"], periodo_selezionato["mese1"]
-            anno2, mese2 = periodo_selezionato["anno2"], periodo_selezionato["mese2"]
-            dfw["Periodo"] = "Altro"
-            m1 = (dfw["Anno"] == anno1) & (dfw["Data"].dt.month == mese1)
-            m2 = (dfw["Anno"] == anno2) & (dfw["Data"].dt.month == mese2)
-            dfw.loc[m1, "Periodo"] = f"{calendar.month_name[mese1]} {anno1}"
-            dfw.loc[m2, "Periodo"] = f"{calendar.month_name[mese2]} {anno2}"
-
-        elif periodo_selezionato["tipo"] == "settimanale":
-            anno1, sett1 = periodo_selezionato["anno1"], periodo_selezionato["settimana1"]
-            anno2, sett2 = periodo_selezionato["anno2"], periodo_selezionato["settimana2"]
-            iso_week = dfw["Data"].dt.isocalendar().week
-            dfw["Periodo"] = "Altro"
-            dfw.loc[(dfw["Anno"] == anno1) & (iso_week == sett1), "Periodo"] = f"Settimana {sett1} {anno1}"
-            dfw.loc[(dfw["Anno"] == anno2) & (iso_week == sett2), "Periodo"] = f"Settimana {sett2} {anno2}"
-
-    # ====== SCELTA righe (Dettaglio/Totale) in base ai clienti ======
-    if tipo_cliente_sel in ["Privati", "Gruppo", "Confronto Privati/Gruppo"]:
-        dfw = dfw[dfw["TipoRiga"] == "Dettaglio"]
-        if tipo_cliente_sel == "Privati":
-            dfw = dfw[dfw["TipoCliente"] == "Privati"]
-        elif tipo_cliente_sel == "Gruppo":
-            dfw = dfw[dfw["TipoCliente"] == "Gruppo"]
-        # Per "Confronto Privati/Gruppo" tengo entrambe le classi
-    else:
-        dfw = dfw[dfw["TipoRiga"] == "Totale"]
-
     # ====== TITOLO/CONTESTO ======
     context_msg = ""
     if area and area != "Tutte":
@@ -695,192 +640,50 @@ def tab_popolarita(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, ar
         context_msg += f" – Barca: {barca}"
     st.subheader(f"Top 5 Tour più richiesti{context_msg}")
 
-    palette = palette_bertoldi
-
-    # Helper: top-N per gruppo
-    def top_n_per_group(df_in, by_cols, sort_col, n=5):
-        return (df_in.sort_values(sort_col, ascending=False)
-                    .groupby(by_cols, group_keys=False)
-                    .head(n)
-                    .reset_index(drop=True))
-
-    # ====== SEZIONE GRAFICO PRINCIPALE (come prima) ======
-    # Provo a mantenere la tua logica a rami, ma senza ripetere troppo.
-    def plot_top5_base(df_src, gb_cols, group_for_top, color_col=None, facet_col=None, caption_msg=""):
-        gdf = df_src.groupby(gb_cols, dropna=False).size().reset_index(name="Conteggio")
-        if group_for_top:  # es. ["Periodo", "TipoCliente"] per top per ogni gruppo
-            top = top_n_per_group(gdf, group_for_top, "Conteggio", n=5)
-        else:
-            top = gdf.nlargest(5, "Conteggio")
-
-        if facet_col:
-            fig = px.bar(
-                top, x="Durata", y="Conteggio",
-                color=color_col, barmode="group", text_auto=True,
-                facet_col=facet_col, facet_col_wrap=2,
-                color_discrete_sequence=palette
-            )
-        else:
-            fig = px.bar(
-                top, x="Durata", y="Conteggio",
-                color=color_col, barmode="group", text_auto=True,
-                color_discrete_sequence=palette
-            )
-        st.plotly_chart(fig, use_container_width=True)
-        if caption_msg:
-            st.caption(caption_msg)
-
-    # Rami principali
-    if tipo_cliente_sel == "Confronto Privati/Gruppo" and "TipoCliente" in dfw.columns:
-        if area and area != "Tutte" and (barca in [None, "Tutte"]) and dfw["Barca_Normalizzata"].nunique() > 1:
-            gb_cols = ["Durata", "TipoCliente", "Barca_Normalizzata"]
-            if compare_periods: gb_cols.append("Periodo")
-            group_for_top = ["TipoCliente", "Barca_Normalizzata"] + (["Periodo"] if compare_periods else [])
-            plot_top5_base(
-                dfw, gb_cols, group_for_top,
-                color_col="Barca_Normalizzata",
-                facet_col=("Periodo" if compare_periods else "TipoCliente"),
-                caption_msg="Top 5 tour per barca e tipologia cliente" + (" con confronto periodi." if compare_periods else ".")
-            )
-        else:
-            gb_cols = ["Durata", "TipoCliente"]
-            if compare_periods: gb_cols.append("Periodo")
-            group_for_top = (["Periodo", "TipoCliente"] if compare_periods else ["TipoCliente"])
-            plot_top5_base(
-                dfw, gb_cols, group_for_top,
-                color_col="TipoCliente",
-                facet_col=("Periodo" if compare_periods else None),
-                caption_msg="Top 5 tour per tipologia cliente" + (" per ciascun periodo." if compare_periods else ".")
+    def _fig_top():
+        if r.facet_col:
+            return px.bar(
+                r.top, x="Durata", y="Conteggio",
+                color=r.color_col, barmode="group", text_auto=True,
+                facet_col=r.facet_col, facet_col_wrap=2,
+                color_discrete_sequence=palette_bertoldi
             )
-
-    elif area and area != "Tutte" and (barca in [None, "Tutte"]) and dfw["Barca_Normalizzata"].nunique() > 1:
-        gb_cols = ["Durata", "Barca_Normalizzata"]
-        if compare_periods: gb_cols.append("Periodo")
-        group_for_top = (["Barca_Normalizzata", "Periodo"] if compare_periods else ["Barca_Normalizzata"])
-        plot_top5_base(
-            dfw, gb_cols, group_for_top,
-            color_col="Barca_Normalizzata",
-            facet_col=("Periodo" if compare_periods else None),
-            caption_msg="Top 5 tour per ogni barca dell’area selezionata" + (" con confronto tra periodi." if compare_periods else ".")
-        )
-
-    elif giorno_sel == "Confronto Alti/Bassi" and "TipoGiorno" in dfw.columns:
-        gb_cols = ["Durata", "TipoGiorno"]
-        if compare_periods: gb_cols.append("Periodo")
-        group_for_top = (["Periodo", "TipoGiorno"] if compare_periods else ["TipoGiorno"])
-        plot_top5_base(
-            dfw, gb_cols, group_for_top,
-            color_col="TipoGiorno",
-            facet_col=("Periodo" if compare_periods else None),
-            caption_msg="Confronto top 5 tour tra giorni Alti/Bassi" + (" per ciascun periodo." if compare_periods else ".")
-        )
-
-    else:
-        gb_cols = ["Durata"]
-        if compare_periods: gb_cols.append("Periodo")
-        group_for_top = (["Periodo"] if compare_periods else None)
-        plot_top5_base(
-            dfw, gb_cols, group_for_top,
-            color_col=("Periodo" if compare_periods else None),
-            facet_col=None,
-            caption_msg="Top 5 tour più richiesti nel periodo/segmento selezionato" + (" con confronto tra periodi." if compare_periods else ".")
+        return px.bar(
+            r.top, x="Durata", y="Conteggio",
+            color=r.color_col, barmode="group", text_auto=True,
+            color_discrete_sequence=palette_bertoldi
         )
+    mostra_grafico(_fig_top, "popolarita_top5")
+    if r.caption_msg:
+        st.caption(r.caption_msg)
 
-    # ====== 1) I 5 PEGGIORI TOUR (meno richiesti) ======
     st.markdown("### ⬇️ I 5 tour meno richiesti")
-    base_counts = (dfw.groupby("Durata", dropna=False)
-                      .size()
-                      .reset_index(name="Conteggio"))
-    # Considero solo tour con almeno 1 occorrenza (per non riempire di zeri)
-    worst5 = base_counts[base_counts["Conteggio"] > 0].nsmallest(5, "Conteggio")
-    if worst5.empty:
+    if r.worst5.empty:
         st.info("Nessun tour con conteggio > 0 nel contesto selezionato.")
     else:
-        st.dataframe(worst5.rename(columns={"Conteggio": "Occorrenze"}), use_container_width=True)
+        st.dataframe(r.worst5.rename(columns={"Conteggio": "Occorrenze"}), use_container_width=True)
 
-    # ====== 2) & 3) Maggior incremento/decremento (normalizzato su #barche) ======
     st.markdown("### 🔁 Variazioni tra periodi (normalizzate per # barche)")
-    if not compare_periods:
+    if not r.compare_periods:
         st.info("Per vedere incrementi/decrementi attiva la modalità **Confronto** nella sidebar.")
         return
-
-    # Considero solo i due periodi target (escludo 'Altro' se presente)
-    periodi_validi = [p for p in dfw["Periodo"].dropna().unique().tolist() if p != "Altro"]
-    if len(periodi_validi) != 2:
-        st.info("Servono esattamente due periodi da confrontare.")
-        return
-    p1, p2 = periodi_validi[0], periodi_validi[1]
-
-    # Conteggi per (Durata, Periodo)
-    cnt = (dfw[dfw["Periodo"].isin([p1, p2])]
-              .groupby(["Durata", "Periodo"], dropna=False)
-              .size()
-              .reset_index(name="Conteggio"))
-
-    # # barche attive per periodo (nunique)
-    boats = (dfw[dfw["Periodo"].isin([p1, p2])]
-                .groupby("Periodo")["Barca_Normalizzata"]
-                .nunique()
-                .rename("Boats")
-                .reset_index())
-
-    # Join per normalizzare
-    cnt_norm = cnt.merge(boats, on="Periodo", how="left")
-    cnt_norm["NormConteggio"] = cnt_norm.apply(
-        lambda r: (r["Conteggio"] / r["Boats"]) if (pd.notnull(r["Boats"]) and r["Boats"] > 0) else np.nan,
-        axis=1
-    )
-
-    # Pivot per avere colonne p1/p2
-    piv = (cnt_norm.pivot(index="Durata", columns="Periodo", values="NormConteggio")
-                    .reset_index())
-    # Rinomina colonne per sicurezza (se i nomi periodo hanno spazi)
-    piv.columns.name = None
-
-    if p1 in piv.columns and p2 in piv.columns:
-        piv["Delta_norm"] = piv[p2].fillna(0) - piv[p1].fillna(0)
-        piv["Delta_%"] = np.where(piv[p1].fillna(0) > 0, 100 * piv["Delta_norm"] / piv[p1].fillna(0), np.nan)
-
-        # Top 5 incrementi
-        top_inc = piv.sort_values("Delta_norm", ascending=False).head(5)[["Durata", p1, p2, "Delta_norm", "Delta_%"]]
-        # Top 5 decrementi
-        top_dec = piv.sort_values("Delta_norm", ascending=True).head(5)[["Durata", p1, p2, "Delta_norm", "Delta_%"]]
-
+    if r.delta is None:
+        st.info(r.msg_delta)
+        if not r.periodi_ok:
+            return
+    else:
+        periodi = r.delta.periodi
+        if len(periodi) > 2:
+            st.caption(f"Δ calcolato tra {periodi[-1]} e {periodi[0]}; le colonne Norm mostrano tutti i periodi scelti.")
+        rinomina = {**{p: f"Norm {p}" for p in periodi}, "Delta_norm": "Δ norm", "Delta_%": "Δ %"}
+        formati = {**{f"Norm {p}": "{:.2f}" for p in periodi}, "Δ norm": "{:+.2f}", "Δ %": "{:+.1f}%"}
         col1, col2 = st.columns(2)
         with col1:
             st.markdown("**⬆️ Top 5 incremento (normalizzato)**")
-            st.dataframe(
-                top_inc.rename(columns={
-                    p1: f"Norm {p1}",
-                    p2: f"Norm {p2}",
-                    "Delta_norm": "Δ norm",
-                    "Delta_%": "Δ %"
-                }).style.format({
-                    f"Norm {p1}": "{:.2f}",
-                    f"Norm {p2}": "{:.2f}",
-                    "Δ norm": "{:+.2f}",
-                    "Δ %": "{:+.1f}%"
-                }),
-                use_container_width=True
-            )
+            st.dataframe(r.delta.top_inc.rename(columns=rinomina).style.format(formati), use_container_width=True)
         with col2:
             st.markdown("**⬇️ Top 5 decremento (normalizzato)**")
-            st.dataframe(
-                top_dec.rename(columns={
-                    p1: f"Norm {p1}",
-                    p2: f"Norm {p2}",
-                    "Delta_norm": "Δ norm",
-                    "Delta_%": "Δ %"
-                }).style.format({
-                    f"Norm {p1}": "{:.2f}",
-                    f"Norm {p2}": "{:.2f}",
-                    "Δ norm": "{:+.2f}",
-                    "Δ %": "{:+.1f}%"
-                }),
-                use_container_width=True
-            )
-    else:
-        st.info("Non è stato possibile calcolare il delta normalizzato: colonne dei periodi mancanti.")
+            st.dataframe(r.delta.top_dec.rename(columns=rinomina).style.format(formati), use_container_width=True)
 
     # Nota
     st.info("""
@@ -889,120 +692,77 @@ def tab_popolarita(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, ar
 - I “peggiori tour” sono quelli con **minori occorrenze** nel contesto filtrato corrente.
 """)
 
-def tab_stagionalita(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area=None, barca=None):
-    import calendar
-
-    if df_kpi.empty:
+def tab_stagionalita(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area=None, barca=None, risultati=None):
+    r = risultati if risultati is not None else calcola_stagionalita(
+        df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca
+    )
+    if r is None:
         st.warning("Nessun dato disponibile per il filtro selezionato.")
         return
-    
-    oggi = pd.Timestamp(datetime.now().date())
-    df_kpi = df_kpi[df_kpi["Data"] <= oggi].copy()
-
-    # --- FILTRO AGGIUNTIVO: GIORNO E CLIENTE (con distinzione TipoRiga) ---
-    grouping_label = None  # Nessun grouping extra di default
-
-    # Filtro giorno
-    if giorno_sel == "Alti":
-        df_kpi = df_kpi[df_kpi["TipoGiorno"] == "Alti"]
-    elif giorno_sel == "Bassi":
-        df_kpi = df_kpi[df_kpi["TipoGiorno"] == "Bassi"]
-    elif giorno_sel == "Confronto Alti/Bassi":
-        df_kpi = df_kpi[df_kpi["TipoGiorno"].isin(["Alti", "Bassi"])]
-        grouping_label = "TipoGiorno"
-
-    # Filtro cliente con distinzione TipoRiga
-    if tipo_cliente_sel == "Privati":
-        df_kpi = df_kpi[(df_kpi["TipoCliente"] == "Privati") & (df_kpi["TipoRiga"] == "Dettaglio")]
-    elif tipo_cliente_sel == "Gruppo":
-        df_kpi = df_kpi[(df_kpi["TipoCliente"] == "Gruppo") & (df_kpi["TipoRiga"] == "Dettaglio")]
-    elif tipo_cliente_sel == "Confronto Privati/Gruppo":
-        df_kpi = df_kpi[(df_kpi["TipoCliente"].isin(["Privati", "Gruppo"])) & (df_kpi["TipoRiga"] == "Dettaglio")]
-        grouping_label = "TipoCliente"
-    else:
-        # Tutti i dati, usiamo solo Totale per evitare sovrapposizioni
-        df_kpi = df_kpi[df_kpi["TipoRiga"] == "Totale"]
 
     st.subheader("📈 Trend temporali & Confronto storico")
-
-    # --- Impostazioni base ---
-    anni_disp = sorted(df_kpi["Data"].dt.year.dropna().unique())
-    if len(anni_disp) == 0:
+    if r.vuoto:
         st.warning("Nessun dato disponibile per il periodo selezionato.")
         return
-    anno_1 = anni_disp[0]
-    anno_2 = anni_disp[-1] if len(anni_disp) > 1 else anni_disp[0]
-    mesi = [calendar.month_name[m] for m in range(1,13)]
-
-    df_trend = df_kpi.copy()
-    df_trend["Anno"] = df_trend["Data"].dt.year
-    df_trend["Mese"] = df_trend["Data"].dt.month
-    df_trend["Settimana"] = df_trend["Data"].dt.isocalendar().week
-    df_trend["X"] = pd.Categorical(df_trend["Mese"].apply(lambda m: calendar.month_name[m]), categories=mesi, ordered=True)
-
-    # --- Raggruppamento dati ---
-    group_fields = ["Anno", "X"]
-    if grouping_label:
-        group_fields.append(grouping_label)
-
-    g = df_trend.groupby(group_fields, observed=True)["Incasso"].sum().reset_index()
-
-    # --- Serie tabellare pivotata ---
-    if grouping_label:
-        df_cmp = g.pivot_table(index="X", columns=[grouping_label, "Anno"], values="Incasso").fillna(0)
-    else:
-        g1 = g[g["Anno"] == anno_1].groupby("X")["Incasso"].sum()
-        g2 = g[g["Anno"] == anno_2].groupby("X")["Incasso"].sum()
-        g1 = g1.reindex(mesi)
-        g2 = g2.reindex(mesi)
-        df_cmp = pd.DataFrame({
-            f"Incasso {anno_1}": g1,
-            f"Incasso {anno_2}": g2
-        }).fillna(0)
+    grouping_label, anno_1, anno_2, mesi = r.grouping_label, r.anno_1, r.anno_2, r.mesi
+    df_trend, g, media_storica = r.df_trend, r.g, r.media_storica
 
-    st.dataframe(df_cmp)
+    st.dataframe(r.df_cmp)
+
+    if r.yoy is not None:
+        yoy = r.yoy
+        st.markdown(f"**Confronto YoY allineato per giorno della settimana (1 gennaio – ultimo dato {anno_2}):**")
+        st.dataframe(yoy.style.format({
+            c: ("{:+.1f}%" if c.startswith("Delta") else "{:,.0f} €") for c in yoy.columns
+        }, na_rep="–"))
+        st.caption("Ogni giorno della stagione più recente è confrontato con lo stesso giorno della settimana "
+                   "delle altre stagioni (spostamenti di 364/371 giorni), così il mix di giorni Alti/Bassi è lo stesso.")
 
     # --- Grafico trend ---
-    if grouping_label:
-        fig_cmp = px.line(
-            g, x="X", y="Incasso", color=grouping_label, line_dash="Anno", markers=True,
-            title=f"Trend incasso mensile: confronto {grouping_label.lower()} ({anno_1} vs {anno_2})",
-            color_discrete_sequence=palette_bertoldi
-        )
-    else:
-        fig_cmp = px.line(
-            g, x="X", y="Incasso", color="Anno", markers=True,
-            title=f"Confronto incasso per Mese ({anno_1} vs {anno_2})",
-            color_discrete_sequence=palette_bertoldi
-        )
-    st.plotly_chart(fig_cmp, use_container_width=True)
+    def _fig_trend():
+        if grouping_label:
+            fig_cmp = px.line(
+                g, x="X", y="Incasso", color=grouping_label, line_dash="Anno", markers=True,
+                title=f"Trend incasso mensile: confronto {grouping_label.lower()} ({anno_1} vs {anno_2})",
+                color_discrete_sequence=palette_bertoldi
+            )
+            for label in media_storica[grouping_label].unique():
+                ms = media_storica[media_storica[grouping_label] == label]
+                fig_cmp.add_scatter(x=ms["X"], y=ms["Media storica"], mode="lines+markers", name=f"Media storica {label}", line=dict(dash='dash'))
+        else:
+            fig_cmp = px.line(
+                g, x="X", y="Incasso", color="Anno", markers=True,
+                title=f"Confronto incasso per Mese ({anno_1} vs {anno_2})",
+                color_discrete_sequence=palette_bertoldi
+            )
+            fig_cmp.add_scatter(x=media_storica["X"], y=media_storica["Media storica"], mode="lines+markers",
+                                name="Media storica", line=dict(color="#00396B", dash='dash'))
+        return fig_cmp
+    mostra_grafico(_fig_trend, "stagionalita_trend")
 
     # --- Boxplot ---
-    if grouping_label:
-        fig_box = px.box(
-            df_trend, x="X", y="Incasso", color=grouping_label, points="all",
-            category_orders={"X": mesi},
-            color_discrete_sequence=palette_bertoldi
-        )
-    else:
-        fig_box = px.box(
-            df_trend, x="X", y="Incasso", points="all",
-            category_orders={"X": mesi},
-            color_discrete_sequence=palette_bertoldi
-        )
-    fig_box.update_layout(title="Distribuzione incasso per mese", xaxis_title="Mese")
-    st.plotly_chart(fig_box, use_container_width=True)
-
-    # --- Media storica ---
-    if grouping_label:
-        media_storica = g.groupby(["X", grouping_label])["Incasso"].mean().reset_index(name="Media storica")
-        for label in media_storica[grouping_label].unique():
-            ms = media_storica[media_storica[grouping_label] == label]
-            fig_cmp.add_scatter(x=ms["X"], y=ms["Media storica"], mode="lines+markers", name=f"Media storica {label}", line=dict(dash='dash'))
-    else:
-        media_storica = g.groupby("X")["Incasso"].mean().reindex(mesi).reset_index(name="Media storica")
-        fig_cmp.add_scatter(x=media_storica["X"], y=media_storica["Media storica"], mode="lines+markers",
-                            name="Media storica", line=dict(color="#00396B", dash='dash'))
+    def _fig_box():
+        if box_compatti:
+            fig_box = box_riassuntivo(
+                df_trend, x="X", y="Incasso", color=grouping_label,
+                category_orders={"X": mesi},
+                color_discrete_sequence=palette_bertoldi
+            )
+        elif grouping_label:
+            fig_box = px.box(
+                df_trend, x="X", y="Incasso", color=grouping_label, points="all",
+                category_orders={"X": mesi},
+                color_discrete_sequence=palette_bertoldi
+            )
+        else:
+            fig_box = px.box(
+                df_trend, x="X", y="Incasso", points="all",
+                category_orders={"X": mesi},
+                color_discrete_sequence=palette_bertoldi
+            )
+        fig_box.update_layout(title="Distribuzione incasso per mese", xaxis_title="Mese")
+        return fig_box
+    mostra_grafico(_fig_box, "stagionalita_box")
 
     st.info("""
 **Nota statistica**  
@@ -1010,148 +770,98 @@ Questa tab ti permette di confrontare rapidamente **stagionalità** e trend tra
 La **media storica** viene sempre visualizzata come linea tratteggiata.
 """)
 
-def tab_maltempo(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area=None, barca=None):
+def tab_maltempo(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area=None, barca=None, risultati=None):
 
     st.subheader("☔ Impatto Maltempo su Incassi")
-    if "Maltempo" not in df_kpi.columns or df_kpi["Maltempo"].isna().all():
+    r = risultati if risultati is not None else calcola_maltempo(
+        df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca
+    )
+    if r is None:
         st.warning("Nessun dato meteo disponibile per il periodo selezionato.")
         return
-
-    # --- FILTRO RIGHE IN BASE AL TIPO CLIENTE ---
-    # Solo righe Dettaglio se filtro Privati/Gruppo/Confronto
-    if tipo_cliente_sel in ["Privati", "Gruppo", "Confronto Privati/Gruppo"]:
-        df_kpi = df_kpi[df_kpi["TipoRiga"] == "Dettaglio"]
-    else:
-        df_kpi = df_kpi[df_kpi["TipoRiga"] == "Totale"]
-
-    df_tot = df_kpi[df_kpi["Maltempo"].notna()]
-
-    # --- LOGICA GRUPPI PER ANALISI ---
-    if tipo_cliente_sel == "Confronto Privati/Gruppo":
-        grouping = "TipoCliente"
-        grouping_label = "Privati / Gruppo"
-    elif giorno_sel == "Confronto Alti/Bassi":
-        grouping = "TipoGiorno"
-        grouping_label = "Giorni Alti / Bassi"
-    elif area and area != "Tutte":
-        grouping = "Barca_Normalizzata"
-        grouping_label = f"Barca ({area})"
-    elif area is None or area == "Tutte":
-        grouping = "Area"
-        grouping_label = "Area"
-    else:
-        grouping = None
-        grouping_label = None
+    df_tot, grouping, grouping_label = r.df_tot, r.grouping, r.grouping_label
+    sintesi = r.sintesi
 
     # --- BOXPLOT ---
     st.markdown(f"**Boxplot incasso giornaliero per Maltempo / {grouping_label}:**")
-    if grouping and grouping in df_tot.columns:
-        fig_box = px.box(df_tot, x="Maltempo", y="Incasso", color="Maltempo", points="all", 
-                         facet_col=grouping, color_discrete_sequence=palette_bertoldi,
-                         category_orders={"Maltempo": [False, True]})
-    else:
-        fig_box = px.box(df_tot, x="Maltempo", y="Incasso", color="Maltempo", points="all", 
-                         color_discrete_sequence=palette_bertoldi,
-                         category_orders={"Maltempo": [False, True]})
-    st.plotly_chart(fig_box, use_container_width=True)
+    def _fig_box():
+        if box_compatti:
+            return box_riassuntivo(df_tot, x="Maltempo", y="Incasso", color="Maltempo",
+                                   facet_col=grouping if grouping in df_tot.columns else None,
+                                   color_discrete_sequence=palette_bertoldi,
+                                   category_orders={"Maltempo": [False, True]})
+        if grouping and grouping in df_tot.columns:
+            return px.box(df_tot, x="Maltempo", y="Incasso", color="Maltempo", points="all",
+                          facet_col=grouping, color_discrete_sequence=palette_bertoldi,
+                          category_orders={"Maltempo": [False, True]})
+        return px.box(df_tot, x="Maltempo", y="Incasso", color="Maltempo", points="all",
+                      color_discrete_sequence=palette_bertoldi,
+                      category_orders={"Maltempo": [False, True]})
+    mostra_grafico(_fig_box, "maltempo_box")
 
     # --- TABELLA SINTESI ---
     st.markdown("**Tabella di sintesi impatto maltempo:**")
-    cols = [grouping, "Maltempo"] if grouping else ["Maltempo"]
-    sintesi = df_tot.groupby(cols).agg(
-        Incasso_medio=("Incasso", "mean"),
-        Incasso_totale=("Incasso", "sum"),
-        Tour=("Incasso", "count")
-    ).reset_index()
-
-    if grouping:
-        try:
-            sintesi = sintesi.pivot(index=grouping, columns="Maltempo", values=["Incasso_medio", "Incasso_totale", "Tour"])
-            sintesi.columns = [f"{m}_{'Maltempo' if b else 'Buono'}" for m, b in sintesi.columns]
-            sintesi = sintesi.fillna(0)
-            sintesi["Delta % Incasso medio"] = np.where(
-                sintesi.get("Incasso_medio_Buono", 0) > 0,
-                100*(sintesi.get("Incasso_medio_Maltempo", 0) - sintesi.get("Incasso_medio_Buono", 0))/sintesi.get("Incasso_medio_Buono", 1),
-                np.nan
-            )
-        except Exception as e:
-            st.warning(f"Errore nel calcolo della tabella di sintesi: {e}")
-            st.dataframe(sintesi.style.format("{:,.0f}"))
-        else:
-            st.dataframe(sintesi.style.format("{:,.0f}"))
-    else:
-        sintesi["Delta % Incasso medio"] = np.nan
-        st.dataframe(sintesi.style.format("{:,.0f}"))
+    if r.errore_sintesi:
+        st.warning(r.errore_sintesi)
+    st.dataframe(sintesi.style.format("{:,.0f}"))
 
     # --- BARPLOT DELTA % ---
     if grouping and "Delta % Incasso medio" in sintesi.columns:
-        delta_df = sintesi.reset_index()
-        fig_delta = px.bar(
-            delta_df, x=grouping, y="Delta % Incasso medio", color=grouping,
-            title="Delta percentuale incasso medio: Maltempo vs Buono",
-            color_discrete_sequence=palette_bertoldi, text_auto=".1f"
-        )
-        fig_delta.update_layout(yaxis_title="Delta %")
-        st.plotly_chart(fig_delta, use_container_width=True)
+        def _fig_delta():
+            fig_delta = px.bar(
+                sintesi.reset_index(), x=grouping, y="Delta % Incasso medio", color=grouping,
+                title="Delta percentuale incasso medio: Maltempo vs Buono",
+                color_discrete_sequence=palette_bertoldi, text_auto=".1f"
+            )
+            fig_delta.update_layout(yaxis_title="Delta %")
+            return fig_delta
+        mostra_grafico(_fig_delta, "maltempo_delta")
 
     # --- ISTOGRAMMA FREQUENZA MALTEMPO ---
-    freq_maltempo = df_tot.groupby(df_tot["Data"].dt.to_period("M"))["Maltempo"].mean().reset_index()
-    freq_maltempo["Data"] = freq_maltempo["Data"].astype(str)
-    fig_meteo = px.bar(
-        freq_maltempo, x="Data", y="Maltempo",
-        title="Frequenza giorni di maltempo (quota mensile)", color_discrete_sequence=palette_bertoldi
-    )
-    fig_meteo.update_yaxes(title="Quota giorni maltempo")
-    st.plotly_chart(fig_meteo, use_container_width=True)
+    def _fig_meteo():
+        freq_maltempo = df_tot.groupby(df_tot["Data"].dt.to_period("M"))["Maltempo"].mean().reset_index()
+        freq_maltempo["Data"] = freq_maltempo["Data"].astype(str)
+        fig_meteo = px.bar(
+            freq_maltempo, x="Data", y="Maltempo",
+            title="Frequenza giorni di maltempo (quota mensile)", color_discrete_sequence=palette_bertoldi
+        )
+        fig_meteo.update_yaxes(title="Quota giorni maltempo")
+        return fig_meteo
+    mostra_grafico(_fig_meteo, "maltempo_frequenza")
 
     # --- SCATTER PLOT INCASSI VS MALTEMPO ---
     st.markdown("**Distribuzione incassi giornalieri rispetto al meteo:**")
-    fig_scatter = px.scatter(
+    mostra_grafico(lambda: px.scatter(
         df_tot, x="Maltempo", y="Incasso", color=grouping if grouping in df_tot.columns else None,
         title="Incasso giornaliero: bel tempo vs maltempo", color_discrete_sequence=palette_bertoldi
-    )
-    st.plotly_chart(fig_scatter, use_container_width=True)
+    ), "maltempo_scatter")
 
     # --- BARCHE SENSIBILI AL MALTEMPO ---
-    if grouping == "Barca_Normalizzata":
-        df_sens = df_tot.groupby(["Barca_Normalizzata", "Maltempo"])["Incasso"].mean().unstack()
-        df_sens["Delta %"] = np.where(
-            df_sens.get(False, 0) > 0,
-            100*(df_sens.get(True, 0) - df_sens.get(False, 0))/df_sens.get(False, 1),
-            np.nan
-        )
-        sens_ord = df_sens.sort_values("Delta %")
+    if r.sens_ord is not None:
         st.markdown("**Barche più sensibili al maltempo (delta % incasso):**")
-        fig_sens = px.bar(
-            sens_ord.reset_index(), x="Barca_Normalizzata", y="Delta %",
+        mostra_grafico(lambda: px.bar(
+            r.sens_ord.reset_index(), x="Barca_Normalizzata", y="Delta %",
             color="Delta %", color_continuous_scale="rdbu", text="Delta %"
-        )
-        st.plotly_chart(fig_sens, use_container_width=True)
+        ), "maltempo_sensibilita")
 
     # --- TEST STATISTICO ---
     st.markdown("**Test statistico:**")
-    if grouping and grouping in df_tot.columns:
-        gruppi = df_tot[grouping].unique()
-        for g in gruppi:
-            buono = df_tot[(df_tot[grouping]==g) & (df_tot["Maltempo"]==False)]["Incasso"].dropna()
-            brutto = df_tot[(df_tot[grouping]==g) & (df_tot["Maltempo"]==True)]["Incasso"].dropna()
-            if len(buono)>1 and len(brutto)>1:
-                t_stat, p_val = ttest_ind(buono, brutto, equal_var=False)
-                st.markdown(
-                    f"- <b>{g}</b>: t = {t_stat:.2f}, p = {p_val:.4f} &rarr; "
-                    f"{'<span style=\"color:green\">differenza significativa</span>' if p_val<0.05 else '<span style=\"color:red\">nessuna differenza significativa</span>'}",
-                    unsafe_allow_html=True
-                )
-    else:
-        buono = df_tot[df_tot["Maltempo"]==False]["Incasso"].dropna()
-        brutto = df_tot[df_tot["Maltempo"]==True]["Incasso"].dropna()
-        if len(buono)>1 and len(brutto)>1:
-            t_stat, p_val = ttest_ind(buono, brutto, equal_var=False)
+    test = r.test
+    if not test.empty:
+        for g, riga in test.iterrows():
+            esito = (
+                "<span style='color:green'>differenza significativa</span>" if riga["p"] < 0.05
+                else "<span style='color:red'>nessuna differenza significativa</span>"
+            )
             st.markdown(
-                f"- <b>Tutti i dati</b>: t = {t_stat:.2f}, p = {p_val:.4f} &rarr; "
-                f"{'<span style=\"color:green\">differenza significativa</span>' if p_val<0.05 else '<span style=\"color:red\">nessuna differenza significativa</span>'}",
+                f"- <b>{g}</b>: t = {riga['t']:.2f}, p = {riga['p']:.4f} &rarr; {esito}",
                 unsafe_allow_html=True
             )
+        st.markdown("**Delta incasso medio maltempo vs bel tempo (IC bootstrap 95%):**")
+        st.dataframe(test.drop(columns=["gdl"]).style.format({
+            "Media buono": "{:,.0f} €", "Media maltempo": "{:,.0f} €", "Delta medio": "{:+,.0f} €",
+            "IC basso": "{:+,.0f} €", "IC alto": "{:+,.0f} €", "t": "{:.2f}", "p": "{:.4f}"
+        }))
 
     # --- SUGGERIMENTI OPERATIVI ---
     st.markdown("""
@@ -1168,201 +878,14 @@ def tab_maltempo(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area
 
 
 
-def tab_forecast(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area=None, barca=None):
+def tab_forecast(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area=None, barca=None, risultati=None):
 
     st.subheader("📈 Forecast Incassi & Clienti – Anno in corso, trend ponderato e breakdown")
 
-    oggi = pd.Timestamp(datetime.now().date())
-    anno_corrente = oggi.year
-
-    # --- Copia base e aggiungi colonne ---
-    df_base = df_kpi.copy()
-    df_base["Mese"] = df_base["Data"].dt.month
-    df_base["Anno"] = df_base["Data"].dt.year
-
-    # --- Filtra area/barca se richiesto ---
-    if area and area != "Tutte":
-        df_base = df_base[df_base["Area"] == area]
-    if barca and barca != "Tutte":
-        df_base = df_base[df_base["Barca_Normalizzata"] == barca]
-    if giorno_sel == "Alti":
-        df_base = df_base[df_base["TipoGiorno"] == "Alti"]
-    elif giorno_sel == "Bassi":
-        df_base = df_base[df_base["TipoGiorno"] == "Bassi"]
-    elif giorno_sel == "Confronto Alti/Bassi":
-        df_base = df_base[df_base["TipoGiorno"].isin(["Alti", "Bassi"])]
-
-    # --- Areelist per breakdown, mesi, stagione ---
-    aree = df_base["Area"].dropna().unique().tolist() if area in [None, "Tutte"] else [area]
-    mesi_bassa = [1, 2, 11, 12]
-    mesi_alta = [m for m in range(1, 13) if m not in mesi_bassa]
-
-    # --- Dati storici e anno corrente ---
-    df_storici = df_base[df_base["Anno"] < anno_corrente]
-    df_anno_corr = df_base[df_base["Anno"] == anno_corrente]
-
-    mesi = [calendar.month_name[m] for m in range(1, 13)]
-    forecast_rows = []
-    area_rows = []
-
-    # --- Fattore andamento rispetto a storico SOLO sulle righe Dettaglio ---
-    mesi_fino_oggi = list(range(1, oggi.month))
-    incasso_att = df_anno_corr[
-        (df_anno_corr["Mese"].isin(mesi_fino_oggi)) &
-        (df_anno_corr["TipoRiga"] == "Dettaglio")
-    ]["Incasso"].sum()
-    clienti_att = df_anno_corr[
-        (df_anno_corr["Mese"].isin(mesi_fino_oggi)) &
-        (df_anno_corr["TipoRiga"] == "Dettaglio")
-    ]["Clienti"].sum()
-    incasso_storico = df_storici[
-        (df_storici["Mese"].isin(mesi_fino_oggi)) &
-        (df_storici["TipoRiga"] == "Dettaglio")
-    ].groupby("Anno")["Incasso"].sum().mean()
-    clienti_storico = df_storici[
-        (df_storici["Mese"].isin(mesi_fino_oggi)) &
-        (df_storici["TipoRiga"] == "Dettaglio")
-    ].groupby("Anno")["Clienti"].sum().mean()
-    fattore_incasso = incasso_att / incasso_storico if incasso_storico > 0 else 1
-    fattore_clienti = clienti_att / clienti_storico if clienti_storico > 0 else 1
-
-    # --- STEP 1: calcola barche attive mese/area ---
-    n_barche_attive_area = {}
-    for a in aree:
-        n_barche_attive_area[a] = {}
-        # BASSA stagione (media storica)
-        for mese in mesi_bassa:
-            n_storico = df_storici[(df_storici["Area"] == a) & (df_storici["Mese"] == mese)].groupby("Anno")["Barca_Normalizzata"].nunique().mean()
-            n_barche_attive_area[a][mese] = int(round(n_storico)) if pd.notnull(n_storico) else 0
-        # ALTA stagione (max fino a oggi, storici e anno corrente)
-        max_barche_alta = 0
-        for mese in mesi_alta:
-            n_corr = df_anno_corr[(df_anno_corr["Area"] == a) & (df_anno_corr["Mese"] == mese) & (df_anno_corr["Data"] <= oggi)]["Barca_Normalizzata"].nunique()
-            n_storico = df_storici[(df_storici["Area"] == a) & (df_storici["Mese"] == mese)].groupby("Anno")["Barca_Normalizzata"].nunique().mean()
-            max_barche_alta = max(max_barche_alta, int(n_corr), int(round(n_storico)) if pd.notnull(n_storico) else 0)
-            n_barche_attive_area[a][mese] = max_barche_alta
-        for mese in range(min(mesi_alta), 11):  # marzo-ottobre
-            n_barche_attive_area[a][mese] = max_barche_alta
-
-    # --- STEP 2: previsione mese per mese ---
-    for mese in range(1, 13):
-        mese_nome = calendar.month_name[mese]
-        n_barche_totali = sum([n_barche_attive_area[a][mese] for a in aree])
-
-        # --- DATI REALI, PREVISIONALI O MISTI ---
-        if mese < oggi.month:
-            # Dato reale: sempre dalle righe Totale
-            incasso = df_base[(df_base["Anno"] == anno_corrente) & (df_base["Mese"] == mese) & (df_base["TipoRiga"] == "Totale")]["Incasso"].sum()
-            clienti = df_base[(df_base["Anno"] == anno_corrente) & (df_base["Mese"] == mese) & (df_base["TipoRiga"] == "Totale")]["Clienti"].sum()
-            tipo = "DATO REALE"
-            # Breakdown Privati/Gruppo SOLO Dettaglio!
-            priv = df_base[(df_base["Anno"] == anno_corrente) & (df_base["Mese"] == mese) & (df_base["TipoRiga"] == "Dettaglio") & (df_base["TipoCliente"] == "Privati")]
-            gruppo = df_base[(df_base["Anno"] == anno_corrente) & (df_base["Mese"] == mese) & (df_base["TipoRiga"] == "Dettaglio") & (df_base["TipoCliente"] == "Gruppo")]
-            incasso_priv = priv["Incasso"].sum()
-            clienti_priv = priv["Clienti"].sum()
-            incasso_gruppo = gruppo["Incasso"].sum()
-            clienti_gruppo = gruppo["Clienti"].sum()
-        elif mese == oggi.month:
-            # Parte reale + previsione giorni mancanti
-            giorni_del_mese = pd.Period(f"{anno_corrente}-{mese:02d}").days_in_month
-            giorni_passati = oggi.day
-            giorni_mancanti = giorni_del_mese - giorni_passati
-
-            # Reale
-            df_giorni_passati = df_anno_corr[(df_anno_corr["Mese"] == mese) & (df_anno_corr["Data"].dt.day <= oggi.day)]
-            incasso_reale = df_giorni_passati[df_giorni_passati["TipoRiga"] == "Totale"]["Incasso"].sum()
-            clienti_reale = df_giorni_passati[df_giorni_passati["TipoRiga"] == "Totale"]["Clienti"].sum()
-
-            priv_reale = df_giorni_passati[(df_giorni_passati["TipoRiga"] == "Dettaglio") & (df_giorni_passati["TipoCliente"] == "Privati")]
-            gruppo_reale = df_giorni_passati[(df_giorni_passati["TipoRiga"] == "Dettaglio") & (df_giorni_passati["TipoCliente"] == "Gruppo")]
-            incasso_priv_reale = priv_reale["Incasso"].sum()
-            clienti_priv_reale = priv_reale["Clienti"].sum()
-            incasso_gruppo_reale = gruppo_reale["Incasso"].sum()
-            clienti_gruppo_reale = gruppo_reale["Clienti"].sum()
-
-            # Previsione
-            storici_mese = df_storici[(df_storici["Mese"] == mese) & (df_storici["TipoRiga"] == "Dettaglio")]
-            media_incasso_anno = storici_mese.groupby("Anno")["Incasso"].sum().mean() if n_barche_totali > 0 else 0
-            media_clienti_anno = storici_mese.groupby("Anno")["Clienti"].sum().mean() if n_barche_totali > 0 else 0
-            media_incasso_giornaliero = media_incasso_anno / giorni_del_mese if giorni_del_mese else 0
-            media_clienti_giornaliero = media_clienti_anno / giorni_del_mese if giorni_del_mese else 0
-
-            incasso_previsto = media_incasso_giornaliero * giorni_mancanti * fattore_incasso * n_barche_totali / max(n_barche_totali, 1)
-            clienti_previsti = media_clienti_giornaliero * giorni_mancanti * fattore_clienti * n_barche_totali / max(n_barche_totali, 1)
-
-            # Proporzioni storiche breakdown
-            tot_storico = storici_mese["Incasso"].sum()
-            if tot_storico > 0:
-                incasso_priv_storico = storici_mese[storici_mese["TipoCliente"] == "Privati"]["Incasso"].sum()
-                incasso_gruppo_storico = storici_mese[storici_mese["TipoCliente"] == "Gruppo"]["Incasso"].sum()
-                p_priv = incasso_priv_storico / tot_storico
-                p_gruppo = incasso_gruppo_storico / tot_storico
-            else:
-                p_priv = 0.5
-                p_gruppo = 0.5
-
-            incasso_priv_prev = incasso_previsto * p_priv
-            incasso_gruppo_prev = incasso_previsto * p_gruppo
-            clienti_priv_prev = clienti_previsti * p_priv
-            clienti_gruppo_prev = clienti_previsti * p_gruppo
-
-            # Somma parte reale + previsionale
-            incasso = incasso_reale + incasso_previsto
-            clienti = clienti_reale + clienti_previsti
-            incasso_priv = incasso_priv_reale + incasso_priv_prev
-            incasso_gruppo = incasso_gruppo_reale + incasso_gruppo_prev
-            clienti_priv = clienti_priv_reale + clienti_priv_prev
-            clienti_gruppo = clienti_gruppo_reale + clienti_gruppo_prev
-
-            tipo = "PARTE REALE + PREVISIONE"
-
-
-        else:
-            # Solo previsione futura
-            storici_mese = df_storici[(df_storici["Mese"] == mese) & (df_storici["TipoRiga"] == "Dettaglio")]
-            media_incasso_anno = storici_mese.groupby("Anno")["Incasso"].sum().mean() if n_barche_totali > 0 else 0
-            media_clienti_anno = storici_mese.groupby("Anno")["Clienti"].sum().mean() if n_barche_totali > 0 else 0
-
-            incasso = media_incasso_anno * fattore_incasso * n_barche_totali / max(n_barche_totali, 1)
-            clienti = media_clienti_anno * fattore_clienti * n_barche_totali / max(n_barche_totali, 1)
-            tipo = "PREVISIONE"
-
-            tot_storico = storici_mese["Incasso"].sum()
-            if tot_storico > 0:
-                incasso_priv_storico = storici_mese[storici_mese["TipoCliente"] == "Privati"]["Incasso"].sum()
-                incasso_gruppo_storico = storici_mese[storici_mese["TipoCliente"] == "Gruppo"]["Incasso"].sum()
-                p_priv = incasso_priv_storico / tot_storico
-                p_gruppo = incasso_gruppo_storico / tot_storico
-            else:
-                p_priv = 0.5
-                p_gruppo = 0.5
-            incasso_priv = incasso * p_priv
-            incasso_gruppo = incasso * p_gruppo
-            clienti_priv = clienti * p_priv
-            clienti_gruppo = clienti * p_gruppo
-
-        forecast_rows.append({
-            "Mese": mese_nome,
-            "Barche attive stimate": n_barche_totali,
-            "Incasso previsto": incasso,
-            "Clienti previsti": clienti,
-            "Incasso privati": incasso_priv,
-            "Clienti privati": clienti_priv,
-            "Incasso gruppo": incasso_gruppo,
-            "Clienti gruppo": clienti_gruppo,
-            "Tipo dato": tipo
-        })
-
-        # Dettaglio area (opzionale: breakdown area)
-        for a in aree:
-            area_rows.append({
-                "Mese": mese_nome,
-                "Area": a,
-                "Barche attive stimate": n_barche_attive_area[a][mese],
-            })
-
-    forecast_df = pd.DataFrame(forecast_rows)
-    area_df = pd.DataFrame(area_rows)
+    r = risultati if risultati is not None else calcola_forecast(
+        df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca
+    )
+    oggi, aree, forecast_df, area_df = r.oggi, r.aree, r.forecast_df, r.area_df
 
     # === MAIN TABLE ===
     st.dataframe(
@@ -1376,25 +899,30 @@ def tab_forecast(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area
             "Barche attive stimate": "{:,.0f}"
         })
     )
+    pulsanti_export("forecast", forecast_df, "forecast")
 
     # === GRAFICI ===
     st.markdown("#### Incasso Previsto: Totale, Privati e Gruppo")
-    fig = px.bar(
-        forecast_df, x="Mese", y=["Incasso privati", "Incasso gruppo"], barmode="stack",
-        color_discrete_sequence=palette_bertoldi, text_auto=True,
-        labels={"value": "Incasso previsto (€)", "variable": "Segmento"}
-    )
-    fig.add_scatter(x=forecast_df["Mese"], y=forecast_df["Incasso previsto"], mode="lines+markers", name="Totale stimato", marker_color=accent)
-    st.plotly_chart(fig, use_container_width=True)
+    def _fig_incasso():
+        fig = px.bar(
+            forecast_df, x="Mese", y=["Incasso privati", "Incasso gruppo"], barmode="stack",
+            color_discrete_sequence=palette_bertoldi, text_auto=True,
+            labels={"value": "Incasso previsto (€)", "variable": "Segmento"}
+        )
+        fig.add_scatter(x=forecast_df["Mese"], y=forecast_df["Incasso previsto"], mode="lines+markers", name="Totale stimato", marker_color=accent)
+        return fig
+    mostra_grafico(_fig_incasso, "forecast_incasso", extra={"oggi": oggi})
 
     st.markdown("#### Clienti Previsti: Totale, Privati e Gruppo")
-    fig2 = px.bar(
-        forecast_df, x="Mese", y=["Clienti privati", "Clienti gruppo"], barmode="stack",
-        color_discrete_sequence=palette_bertoldi, text_auto=True,
-        labels={"value": "Clienti previsti", "variable": "Segmento"}
-    )
-    fig2.add_scatter(x=forecast_df["Mese"], y=forecast_df["Clienti previsti"], mode="lines+markers", name="Totale stimato", marker_color=accent)
-    st.plotly_chart(fig2, use_container_width=True)
+    def _fig_clienti():
+        fig2 = px.bar(
+            forecast_df, x="Mese", y=["Clienti privati", "Clienti gruppo"], barmode="stack",
+            color_discrete_sequence=palette_bertoldi, text_auto=True,
+            labels={"value": "Clienti previsti", "variable": "Segmento"}
+        )
+        fig2.add_scatter(x=forecast_df["Mese"], y=forecast_df["Clienti previsti"], mode="lines+markers", name="Totale stimato", marker_color=accent)
+        return fig2
+    mostra_grafico(_fig_clienti, "forecast_clienti", extra={"oggi": oggi})
 
     # === DETTAGLIO AREA (SOLO IN VISTA TOTALE) ===
     if area in [None, "Tutte"] and len(aree) > 1:
@@ -1412,41 +940,43 @@ def tab_forecast(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area
 """)
 
 
+# ========== SIMULATORE ==========
+MAX_VOCI_SIMULATORE = 8  # combinazioni di filtri tenute in cache
+
+# Chiave esplicita (versione dati, filtri): df_kpi non viene riletto per calcolarne l'hash
+@st.cache_data(show_spinner=False, max_entries=MAX_VOCI_SIMULATORE)
+def giorno_barca_simulatore(versione, filtri, _df_kpi):
+    profilo.conta("cache.giorno_barca_simulatore.miss")
+    return registra_in_cache("giorno_barca_simulatore", (versione, filtri),
+                             motore.simulatore.giorno_barca_simulatore(_df_kpi), max_voci=MAX_VOCI_SIMULATORE)
+
+@st.cache_data(show_spinner=False, max_entries=MAX_VOCI_SIMULATORE)
+def statistiche_simulatore(versione, filtri, _df_kpi):
+    profilo.conta("cache.statistiche_simulatore.miss")
+    return registra_in_cache("statistiche_simulatore", (versione, filtri),
+                             motore.simulatore.statistiche_simulatore(_df_kpi), max_voci=MAX_VOCI_SIMULATORE)
+
 def tab_simulatore(df_kpi):
 
     st.subheader("🔮 Simulatore What-If (storico con trend automatico)")
-    stagione_map = {
-        "Bassa (gen, feb, mar, nov, dic)":   [1, 2, 3, 11, 12],
-        "Alta (apr, mag, set, ott)":         [4, 5, 9, 10],
-        "Altissima (giu, lug, ago)":         [6, 7, 8],
-        "8 mesi (mar-ott)":                  [3, 4, 5, 6, 7, 8, 9, 10],
-        "12 mesi (anno intero)":             list(range(1,13)),
-    }
-    stagione_label = st.selectbox("Periodo di stagione", list(stagione_map.keys()), index=2)
-    mesi_scelti = stagione_map[stagione_label]
+    stagione_label = st.selectbox("Periodo di stagione", list(STAGIONI_SIMULATORE.keys()), index=2)
 
     aree_disponibili = ["Tutte"] + sorted(df_kpi["Area"].dropna().unique())
     area_sel = st.selectbox("Area da simulare", aree_disponibili, index=0)
-    df_det = df_kpi[df_kpi["TipoRiga"] == "Dettaglio"].copy()
 
     max_barche_global = 15
-    # --- Trova barche massime storiche e giorni attivi ---
-    max_barche_area = {}
-    giorni_barca_attivi = {}
-    for area in sorted(df_kpi["Area"].dropna().unique()):
-        df_area_mesi = df_det[(df_det["Area"] == area) & (df_det["Data"].dt.month.isin(mesi_scelti))]
-        if df_area_mesi.empty:
-            max_barche_area[area] = 0
-            giorni_barca_attivi[area] = 0
-            continue
-        by_day = df_area_mesi.groupby(df_area_mesi["Data"].dt.date)["Barca_Normalizzata"].nunique()
-        max_barche_area[area] = int(by_day.max())
-        giorni_barca_attivi[area] = int(df_area_mesi.groupby(["Data", "Barca_Normalizzata"]).ngroups)
+    # --- Statistiche storiche precalcolate (cache) ---
+    with profilo.intervallo("statistiche_simulatore", cache="statistiche_simulatore"):
+        stats, anno_min = statistiche_simulatore(VERSIONE_DATI, CHIAVE_FILTRI, df_kpi)
+    if stats.empty:
+        st.warning("Nessun dato disponibile per il filtro selezionato.")
+        return
+    stats_stagione = stats.xs(stagione_label, level="Stagione")
 
     # --- Input barche operative per ogni area ---
     barche_per_area = {}
     if area_sel == "Tutte":
-        for area in sorted(df_kpi["Area"].dropna().unique()):
+        for area in stats_stagione.index:
             barche_per_area[area] = st.number_input(
                 f"{area}: barche operative", min_value=1, max_value=max_barche_global, value=1, step=1
             )
@@ -1456,163 +986,218 @@ def tab_simulatore(df_kpi):
             f"{area}: barche operative", min_value=1, max_value=max_barche_global, value=1, step=1
         )
 
-    incasso_medio = {}
-    clienti_medio = {}
-    giorni_attivi_per_barca = {}
-
+    # --- Curve complete incasso/clienti vs numero di barche (tutte le aree) ---
     anno_corrente = pd.Timestamp.today().year
-    trend_incasso = {}
-    trend_clienti = {}
-
-    for area in barche_per_area:
-        df_area_mesi = df_det[(df_det["Area"] == area) & (df_det["Data"].dt.month.isin(mesi_scelti))]
-        if df_area_mesi.empty or max_barche_area[area] == 0:
-            incasso_medio[area] = 0
-            clienti_medio[area] = 0
-            giorni_attivi_per_barca[area] = 0
-            trend_incasso[area] = 1
-            trend_clienti[area] = 1
-            continue
-
-        giorno_barca = df_area_mesi.groupby([df_area_mesi["Data"].dt.date, "Barca_Normalizzata"])
-        incassi = giorno_barca["Incasso"].sum().values
-        clienti = giorno_barca["Clienti"].sum().values
-        n_giorni_barca = len(incassi)
-        incasso_medio[area] = np.mean(incassi) if n_giorni_barca > 0 else 0
-        clienti_medio[area] = np.mean(clienti) if n_giorni_barca > 0 else 0
-        giorni_attivi_per_barca[area] = n_giorni_barca / max(1, max_barche_area[area])
-
-        # --- Trend storico ---
-        df_area_mesi["Anno"] = pd.DatetimeIndex(df_area_mesi["Data"]).year
-        inc_per_anno = df_area_mesi.groupby("Anno")["Incasso"].mean().sort_index()
-        cli_per_anno = df_area_mesi.groupby("Anno")["Clienti"].mean().sort_index()
-        if len(inc_per_anno) > 1:
-            trend_incasso[area] = (inc_per_anno.iloc[-1] / inc_per_anno.iloc[0]) ** (1/(len(inc_per_anno)-1))
-        else:
-            trend_incasso[area] = 1
-        if len(cli_per_anno) > 1:
-            trend_clienti[area] = (cli_per_anno.iloc[-1] / cli_per_anno.iloc[0]) ** (1/(len(cli_per_anno)-1))
-        else:
-            trend_clienti[area] = 1
-
-    totale_incasso = 0
-    totale_clienti = 0
-    for area in barche_per_area:
-        n_barche = barche_per_area[area]
-        if giorni_attivi_per_barca[area] == 0: continue
-        # --- Applica il trend annuo dalla media storica all’anno corrente
-        n_anni = anno_corrente - (min(df_det["Data"].dt.year) if not df_det.empty else anno_corrente)
-        incasso_area = incasso_medio[area] * giorni_attivi_per_barca[area] * n_barche * (trend_incasso[area] ** n_anni)
-        clienti_area = clienti_medio[area] * giorni_attivi_per_barca[area] * n_barche * (trend_clienti[area] ** n_anni)
-        totale_incasso += incasso_area
-        totale_clienti += clienti_area
+    n_anni = anno_corrente - (anno_min if anno_min is not None else anno_corrente)
+    curve = simula_curve(stats_stagione, n_anni, max_barche_global)
+
+    scelta = pd.DataFrame(list(barche_per_area.items()), columns=["Area", "Barche"])
+    punti = curve.merge(scelta, on=["Area", "Barche"], how="inner")
+    totale_incasso = punti["Incasso"].sum()
+    totale_clienti = punti["Clienti"].sum()
 
     st.metric("Incasso stimato totale (trend attualizzato)", f"{totale_incasso:,.0f} €")
     st.metric("Clienti stimati totali (trend attualizzato)", f"{totale_clienti:,.0f}")
 
+    # --- Modalità Monte Carlo: bande di percentili P10/P50/P90 ---
+    modalita_sim = st.radio("Modalità simulazione", ["Deterministica", "Monte Carlo", "Ottimizzatore flotta"], horizontal=True)
+    if modalita_sim == "Monte Carlo":
+        col_sc, col_seed = st.columns(2)
+        n_scenari = col_sc.number_input("Scenari", min_value=1000, max_value=100000, value=20000, step=5000)
+        seed = col_seed.number_input("Seed", min_value=0, value=42, step=1)
+        bande, mc_incasso, _ = simula_monte_carlo(
+            giorno_barca_simulatore(VERSIONE_DATI, CHIAVE_FILTRI, df_kpi), stats_stagione, STAGIONI_SIMULATORE[stagione_label],
+            barche_per_area, n_anni, n_scenari=int(n_scenari), seed=int(seed)
+        )
+        st.markdown("#### Bande Monte Carlo (P10 / P50 / P90)")
+        st.dataframe(bande.style.format("{:,.0f}"))
+
+        def _fig_mc():
+            conteggi, bordi = np.histogram(mc_incasso, bins=40)
+            distribuzione = pd.DataFrame({"Incasso": (bordi[:-1] + bordi[1:]) / 2, "Scenari": conteggi})
+            fig_mc = px.bar(
+                distribuzione, x="Incasso", y="Scenari", color_discrete_sequence=palette_bertoldi,
+                labels={"Incasso": "Incasso totale simulato (€)"}
+            )
+            for p in (10, 50, 90):
+                fig_mc.add_vline(x=bande.at["Totale", f"Incasso P{p}"], line_dash="dash", line_color=accent,
+                                 annotation_text=f"P{p}")
+            return fig_mc
+        mostra_grafico(_fig_mc, "simulatore_monte_carlo", extra={
+            "stagione": stagione_label, "barche": barche_per_area, "n_anni": n_anni,
+            "scenari": n_scenari, "seed": seed
+        })
+
+    # --- Ottimizzatore: miglior allocazione di N barche tra le aree ---
+    if modalita_sim == "Ottimizzatore flotta":
+        st.markdown("#### Ottimizzatore allocazione flotta")
+        col_tot, col_obj = st.columns(2)
+        totale_barche = col_tot.number_input(
+            "Barche totali da allocare", min_value=1, max_value=max_barche_global, value=min(8, max_barche_global), step=1
+        )
+        obiettivo = col_obj.selectbox("Obiettivo", ["Incasso", "Clienti"])
+        minimi, massimi = {}, {}
+        colonne_aree = st.columns(len(stats_stagione.index))
+        for col, area in zip(colonne_aree, stats_stagione.index):
+            max_storico = int(stats_stagione.at[area, "max_barche"])
+            minimi[area] = col.number_input(
+                f"{area} min", min_value=0, max_value=max_barche_global, value=0, step=1, key=f"opt_min_{area}"
+            )
+            massimi[area] = col.number_input(
+                f"{area} max", min_value=0, max_value=max_barche_global, value=max(1, max_storico), step=1,
+                key=f"opt_max_{area}"
+            )
+
+        if sum(minimi.values()) > totale_barche or sum(massimi.values()) < totale_barche:
+            st.warning("Vincoli non compatibili con il numero di barche totali (somma minimi/massimi).")
+        else:
+            migliori, n_candidate = ottimizza_flotta(curve, int(totale_barche), minimi, massimi, obiettivo=obiettivo)
+            if migliori.empty:
+                st.warning("Nessuna allocazione ammissibile con i vincoli indicati.")
+            else:
+                best = migliori.iloc[0]
+                st.metric(f"{obiettivo} massimo stimato", f"{best[obiettivo]:,.0f}" + (" €" if obiettivo == "Incasso" else ""))
+                allocazione = best.drop(obiettivo).astype(int).rename("Barche").reset_index().rename(columns={"index": "Area"})
+                mostra_grafico(lambda: px.bar(
+                    allocazione, x="Area", y="Barche", text_auto=True, color="Area",
+                    color_discrete_sequence=palette_bertoldi, title="Allocazione ottimale"
+                ), "simulatore_ottimizzatore", extra={
+                    "stagione": stagione_label, "n_anni": n_anni, "totale": totale_barche, "obiettivo": obiettivo,
+                    "minimi": minimi, "massimi": massimi
+                })
+                st.markdown(f"**Migliori allocazioni** ({n_candidate:,} candidate valutate):")
+                st.dataframe(migliori.style.format({obiettivo: "{:,.0f}"}))
+
+    st.markdown("#### Curva incasso stimato vs numero di barche")
+    def _fig_curve():
+        fig_curve = px.line(
+            curve, x="Barche", y="Incasso", color="Area", markers=True,
+            color_discrete_sequence=palette_bertoldi,
+            labels={"Incasso": "Incasso stimato (€)", "Barche": "Barche operative"}
+        )
+        fig_curve.add_scatter(
+            x=punti["Barche"], y=punti["Incasso"], mode="markers", name="Scelta attuale",
+            marker=dict(color=accent, size=12, symbol="diamond")
+        )
+        return fig_curve
+    mostra_grafico(_fig_curve, "simulatore_curve", extra={
+        "stagione": stagione_label, "n_anni": n_anni, "max_barche": max_barche_global, "barche": barche_per_area
+    })
+
     st.caption("""
 **Nota:**  
 - La simulazione tiene conto della crescita/recessione storica (trend).
 - "Riva" compare solo se nei dati ci sono sue tratte reali nei mesi scelti.
 - Il calcolo è lineare rispetto al numero di barche inserite (più barche, più risultato).
+- Le statistiche storiche per stagione e area sono precalcolate: muovere i controlli non ricalcola lo storico.
+- In modalità Monte Carlo ogni scenario ricampiona i giorni-barca storici (incasso e clienti insieme); a parità di seed i risultati sono identici.
 """)
 
-def tab_suggerimenti(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area=None, barca=None):
+
+# ========== ANOMALIE GIORNALIERE PER BARCA (Z-SCORE ROBUSTO) ==========
+MAX_STATI_ANOMALIE = 4  # configurazioni (finestra, min_osservazioni) tenute in memoria
+
+@st.cache_resource
+def _stati_anomalie():
+    # Stati condivisi tra le sessioni, uno per configurazione in ordine LRU, ciascuno con il suo
+    # lock e legato alla versione dei dati: a ogni ricarica si rielaborano solo i giorni cambiati
+    return {"lock": threading.Lock(), "voci": OrderedDict()}
+
+def _registra_stati_anomalie(contenitore):
+    with contenitore["lock"]:
+        stati = {chiave: voce["stato"] for chiave, voce in contenitore["voci"].items()}
+    registra_in_cache("stati_anomalie", "stati", stati)
+
+def svuota_stati_anomalie():
+    contenitore = _stati_anomalie()
+    with contenitore["lock"]:
+        contenitore["voci"].clear()
+
+def anomalie_giornaliere(df, versione=None, finestra=28, min_osservazioni=10):
+    # versione: VERSIONE_DATI se df è il registro completo; None confronta sempre le impronte
+    contenitore = _stati_anomalie()
+    chiave = (finestra, min_osservazioni)
+    with contenitore["lock"]:  # solo per l'elenco delle voci: il calcolo avviene fuori
+        voce = contenitore["voci"].pop(chiave, None) or {"lock": threading.Lock(), "stato": None}
+        contenitore["voci"][chiave] = voce
+        scartate = len(contenitore["voci"]) > MAX_STATI_ANOMALIE
+        while len(contenitore["voci"]) > MAX_STATI_ANOMALIE:
+            contenitore["voci"].popitem(last=False)
+    stato = voce["stato"]
+    if stato is not None and versione is not None and stato["versione"] == versione:
+        if scartate:
+            _registra_stati_anomalie(contenitore)
+        return stato["risultati"]
+    with voce["lock"]:  # aggiorna_anomalie ricontrolla la versione: chi attendeva non ricalcola
+        stato = aggiorna_anomalie(voce["stato"], df, versione, finestra, min_osservazioni)
+        cambiato = stato is not voce["stato"]
+        voce["stato"] = stato
+    if cambiato or scartate:
+        _registra_stati_anomalie(contenitore)
+    return stato["risultati"]
+
+def tab_suggerimenti(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area=None, barca=None, df_storico=None, contesto=None):
     st.header("💡 Suggerimenti & Alert Automatici")
-    alert_list = []
-
-    df_tot = df_kpi[df_kpi["TipoRiga"] == "Totale"].copy()
-    df_tot["Mese"] = df_tot["Data"].dt.to_period("M").astype(str)
-    mesi_nome = df_tot["Data"].dt.month.apply(lambda m: calendar.month_name[m])
-    df_tot["MeseNome"] = mesi_nome
-
-    # 1. EFFICIENZA - Soglia dinamica
-    eff_mensile = (
-        df_tot.groupby(["Barca_Normalizzata", "Mese"])
-        .agg({"Incasso": "sum", "Gasolio": "sum"})
-        .reset_index()
-    )
-    eff_mensile["Efficienza"] = eff_mensile["Incasso"] / eff_mensile["Gasolio"].replace(0, np.nan)
-    eff_media_barca = eff_mensile.groupby("Barca_Normalizzata")["Efficienza"].mean().dropna()
-    soglia_efficienza = eff_media_barca.mean() * 0.8 if len(eff_media_barca) > 0 else 80
-    for b, e in eff_media_barca.items():
-        if e < soglia_efficienza:
-            alert_list.append(f"⚠️ <b>Barca {b}</b> con efficienza media mensile bassa: {e:.1f} €/litro (sotto soglia dinamica {soglia_efficienza:.1f} €/litro)")
-
-    # 2. TOP performer
-    top = df_tot.groupby("Barca_Normalizzata")["Incasso"].sum().sort_values(ascending=False)
-    if len(top) > 0:
-        alert_list.append(f"🏅 <b>Top performer:</b> {top.index[0]} ({top.iloc[0]:,.0f}€)")
-
-    # 3. TREND: confronto incasso ultimo mese vs mese precedente
-    if len(df_tot["Mese"].unique()) >= 2:
-        mesi_ordine = sorted(df_tot["Mese"].unique())
-        mese_attuale = mesi_ordine[-1]
-        mese_precedente = mesi_ordine[-2]
-        incasso_att = df_tot[df_tot["Mese"] == mese_attuale].groupby("Barca_Normalizzata")["Incasso"].sum()
-        incasso_prev = df_tot[df_tot["Mese"] == mese_precedente].groupby("Barca_Normalizzata")["Incasso"].sum()
-        for b in incasso_att.index:
-            if b in incasso_prev and incasso_att[b] < incasso_prev[b] * 0.8:
-                alert_list.append(f"📉 <b>Trend in calo:</b> {b} ha avuto un incasso inferiore del 20% rispetto al mese precedente.")
-
-    # 4. CONCENTRAZIONE: se >60% incasso viene da un solo tour
-    if "Durata" in df_kpi.columns:
-        tour_top = df_kpi.groupby("Durata")["Incasso"].sum().sort_values(ascending=False)
-        incasso_totale = df_kpi["Incasso"].sum()
-        if len(tour_top) > 0 and incasso_totale > 0 and tour_top.iloc[0] / incasso_totale > 0.6:
-            alert_list.append(f"💡 <b>Attenzione:</b> Il tour <b>{tour_top.index[0]}</b> rappresenta oltre il 60% dell’incasso totale (scarsa diversificazione).")
-
-    # 5. ANOMALIA STAGIONALE: incasso mese corrente inferiore media anni precedenti
-    if len(df_tot["Anno"].unique()) >= 2:
-        for mese in df_tot["MeseNome"].unique():
-            anni = df_tot["Anno"].unique()
-            for anno in anni:
-                incasso_corr = df_tot[(df_tot["MeseNome"] == mese) & (df_tot["Anno"] == anno)]["Incasso"].sum()
-                incassi_passati = df_tot[(df_tot["MeseNome"] == mese) & (df_tot["Anno"] != anno)] \
-                                    .groupby("Anno")["Incasso"].sum().values
-                if len(incassi_passati) >= 1:
-                    media_passati = np.mean(incassi_passati)
-                    if media_passati > 0 and incasso_corr < media_passati * 0.7:
-                        alert_list.append(f"📉 <b>{mese} {anno} sotto media:</b> incasso inferiore del 30% rispetto alla media dello stesso mese negli anni precedenti.")
-
-    # 6. SFRUTTAMENTO DELLA FLOTTA: barche usate meno della media
-    utilizzo_barche = df_tot.groupby("Barca_Normalizzata")["Data"].nunique()
-    giorni_totali = df_tot["Data"].nunique()
-    media_utilizzo = utilizzo_barche.mean()
-    for b, giorni in utilizzo_barche.items():
-        if giorni < 0.7 * media_utilizzo:
-            alert_list.append(f"⏳ <b>Barca {b}</b> sottoutilizzata: attiva solo {giorni} giorni rispetto a una media di {media_utilizzo:.0f} giorni.")
-
-    # 7. SENSIBILITÀ MALTEMPO: barche che “perdono di più” dei colleghi nei giorni di maltempo
-    if "Maltempo" in df_tot.columns and df_tot["Maltempo"].notna().any():
-        medie_meteo = df_tot.groupby(["Barca_Normalizzata", "Maltempo"])["Incasso"].mean().unstack()
-        if False in medie_meteo.columns and True in medie_meteo.columns:
-            medie_meteo["Delta"] = (medie_meteo[True] - medie_meteo[False]) / medie_meteo[False] * 100
-            media_flottante = medie_meteo["Delta"].mean()
-            for b, delta in medie_meteo["Delta"].items():
-                if delta < media_flottante - 15:
-                    alert_list.append(f"🌧️ <b>{b}</b> subisce un calo di incasso col maltempo superiore alla media flotta ({delta:.0f}% vs {media_flottante:.0f}%).")
-
-    # 8. BASSA PRENOTAZIONE GIORNI ALTI
-    incasso_alti = df_tot[df_tot["TipoGiorno"]=="Alti"]["Incasso"].sum()
-    incasso_bassi = df_tot[df_tot["TipoGiorno"]=="Bassi"]["Incasso"].sum()
-    if incasso_alti < incasso_bassi * 0.8:
-        alert_list.append(f"⚠️ <b>Bassa prenotazione nei giorni ad alta domanda:</b> Incasso giorni alti < 80% rispetto ai giorni bassi.")
+
+    with st.expander("⚙️ Soglie alert"):
+        c1, c2 = st.columns(2)
+        soglie = {
+            "efficienza_quota_media": c1.slider("Efficienza minima (quota della media flotta)", 0.5, 1.0, SOGLIE_ALERT["efficienza_quota_media"], 0.05),
+            "trend_calo": c1.slider("Trend: incasso minimo vs mese precedente", 0.5, 1.0, SOGLIE_ALERT["trend_calo"], 0.05),
+            "concentrazione_quota": c1.slider("Concentrazione: quota massima di un tour", 0.3, 0.9, SOGLIE_ALERT["concentrazione_quota"], 0.05),
+            "anomalia_stagionale": c1.slider("Stagionalità: incasso minimo vs media storica", 0.3, 1.0, SOGLIE_ALERT["anomalia_stagionale"], 0.05),
+            "sottoutilizzo_quota": c2.slider("Utilizzo minimo (quota della media giorni)", 0.3, 1.0, SOGLIE_ALERT["sottoutilizzo_quota"], 0.05),
+            "maltempo_margine": c2.slider("Maltempo: margine oltre la media flotta (punti %)", 5, 40, SOGLIE_ALERT["maltempo_margine"], 1),
+            "giorni_alti_quota": c2.slider("Giorni alti: incasso minimo vs giorni bassi", 0.5, 1.0, SOGLIE_ALERT["giorni_alti_quota"], 0.05),
+        }
+
+    alert_list = calcola_alert(df_kpi, soglie, ctx=contesto)
 
     # ALERT OUTPUT
     if alert_list:
         for alert in alert_list:
-            st.markdown(alert, unsafe_allow_html=True)
+            st.markdown(alert.messaggio, unsafe_allow_html=True)
     else:
         st.success("Nessun alert! Tutti i valori sono sopra le soglie.")
 
+    # --- GIORNI ANOMALI PER BARCA (z-score robusto rolling) ---
+    st.markdown("### 🔎 Giorni anomali per barca")
+    c1, c2 = st.columns(2)
+    finestra = c1.slider("Finestra (giorni di attività precedenti)", 7, 60, 28, 1)
+    soglia_z = c2.slider("Soglia |z| robusto", 2.0, 6.0, 3.5, 0.5)
+    if df_storico is not None:
+        anomalie = anomalie_giornaliere(df_storico, VERSIONE_DATI, finestra=finestra)
+    else:
+        anomalie = anomalie_giornaliere(df_kpi, finestra=finestra)
+    # Mostro solo barche e giorni del contesto filtrato
+    giorni_filtro = df_kpi["Data"].dt.normalize().unique()
+    anomalie = anomalie[
+        anomalie.index.get_level_values("Barca_Normalizzata").isin(df_kpi["Barca_Normalizzata"].unique())
+        & anomalie.index.get_level_values("Data").isin(giorni_filtro)
+    ]
+    colonne_z = [f"z_{m}" for m in METRICHE_ANOMALIE]
+    fuori_soglia = anomalie[(anomalie[colonne_z].abs() > soglia_z).any(axis=1)]
+    if fuori_soglia.empty:
+        st.info("Nessun giorno anomalo nel contesto selezionato.")
+    else:
+        st.markdown(f"**{len(fuori_soglia)} giorni anomali** (ultimi 50):")
+        st.dataframe(
+            fuori_soglia.sort_index(level="Data", ascending=False).head(50).style.format(
+                {"Incasso": "{:,.0f} €", "Clienti": "{:,.0f}", "Gasolio": "{:,.0f} €",
+                 **{c: "{:+.1f}" for c in colonne_z}}, na_rep="–"
+            ),
+            use_container_width=True
+        )
+
     st.caption("""
 **Nota:**  
 Gli alert automatici segnalano barche poco efficienti, best performer, trend di incasso in calo, scarsa diversificazione commerciale,
 anomalie stagionali, sfruttamento sotto media, alta sensibilità al maltempo e bassa prenotazione nei giorni ad alta domanda.
+I giorni anomali confrontano ogni giornata di una barca con la mediana delle sue giornate precedenti (z-score robusto su mediana/MAD).
 """)
 
-def tab_analisi_spese(df_spese, anno_sel=None, mese_sel=None, area_sel=None):
+
+def tab_analisi_spese(df_spese, periodo_selezionato, area=None, barca=None, cubo=None):
     st.subheader("💸 Analisi Spese Aziendali")
 
     # Controlli robusti
@@ -1623,21 +1208,49 @@ def tab_analisi_spese(df_spese, anno_sel=None, mese_sel=None, area_sel=None):
         st.error("Colonne fondamentali mancanti nelle spese!")
         return
 
-    # Filtro per anno/mese
-    if anno_sel:
-        df_spese = df_spese[df_spese["Data"].dt.year == int(anno_sel)]
-    if mese_sel:
-        df_spese = df_spese[df_spese["Data"].dt.month == int(mese_sel)]
-    if area_sel and area_sel != "Tutte":
-        df_spese = df_spese[df_spese["Destinazione"] == area_sel]
-
-
-    # Spese totali per macro-categoria
-    if "Tipo_Spesa" in df_spese.columns:
-        spese_fisse = df_spese[df_spese["Tipo_Spesa"].str.lower() == "fissi"]["Costo"].sum()
-        spese_var = df_spese[df_spese["Tipo_Spesa"].str.lower() == "variabili"]["Costo"].sum()
-        st.metric("Spese fisse", f"{spese_fisse:,.0f} €")
-        st.metric("Spese variabili", f"{spese_var:,.0f} €")
+    # --- CONTO ECONOMICO DAL CUBO (solo affettato dai filtri della sidebar) ---
+    cubo = cubo if cubo is not None else CUBO_MARGINI
+    chiave = st.radio(
+        "Ripartizione spese Azienda", list(CHIAVI_RIPARTIZIONE), horizontal=True, key="chiave_ripartizione",
+        help="Come distribuire sulle barche le spese intestate ad Azienda: " +
+             "; ".join(f"{k} = {v}" for k, v in CHIAVI_RIPARTIZIONE.items())
+    )
+    fetta = fetta_cubo(cubo, periodo_selezionato, area, barca)
+    if periodo_selezionato["tipo"] == "settimanale":
+        st.caption("Le spese sono mensili: per le settimane si usano i mesi che le contengono.")
+
+    totale = conto_economico(fetta, chiave).iloc[0]
+    k1, k2, k3, k4 = st.columns(4)
+    k1.metric("Ricavi", f"{totale['Ricavi']:,.0f} €")
+    k2.metric("Costi diretti", f"{totale[VOCI_COSTO].sum():,.0f} €")
+    k3.metric("Spese Azienda ripartite", f"{totale['Spese Azienda']:,.0f} €")
+    k4.metric("Margine netto", f"{totale['Margine netto']:,.0f} €")
+
+    formati = {c: "{:,.0f} €" for c in ["Ricavi", *VOCI_COSTO, "Spese Azienda", "Investimenti",
+                                          "Margine di contribuzione", "Margine netto"]}
+    livello = "Barca" if (area and area != "Tutte") or (barca and barca != "Tutte") else ["Area", "Barca"]
+    st.markdown(f"**Conto economico per {'barca' if livello == 'Barca' else 'area e barca'}** (spese Azienda {CHIAVI_RIPARTIZIONE[chiave]}):")
+    conto = conto_economico(fetta, chiave, livello)
+    st.dataframe(conto.style.format(formati), use_container_width=True)
+    pulsanti_export("conto economico", tabella_esportabile(conto), "conto_economico")
+
+    per_mese = conto_economico(fetta, chiave, "Mese")
+    if not per_mese.empty:
+        per_mese.index = [f"{calendar.month_abbr[m % 100]} {m // 100}" for m in per_mese.index]
+        mostra_grafico(lambda: px.bar(
+            per_mese.reset_index(names="Mese"), x="Mese", y=["Margine di contribuzione", "Margine netto"],
+            barmode="group", color_discrete_sequence=palette_bertoldi,
+            labels={"value": "€", "variable": "Margine"}
+        ), "spese_margine_mensile", extra={"chiave": chiave})
+    if fetta[VOCI_COSTO + ["Investimenti", f"Generali {chiave}"]].to_numpy().sum() == 0:
+        st.info("Nessuna spesa registrata nei mesi selezionati: il conto economico mostra solo i ricavi.")
+
+    # --- DETTAGLIO SPESE DEL PERIODO (barche della selezione; Azienda senza filtri area/barca) ---
+    barche_sel = None
+    if (area and area != "Tutte") or (barca and barca != "Tutte"):
+        barche_sel = fetta.index.get_level_values("Barca").unique()
+    posizioni = indice_spese(df_spese, periodo_selezionato, barche_sel)
+    df_registro, df_spese = df_spese, df_spese.take(posizioni)
 
     # Spese per categoria (top 10)
     if "Categoria" in df_spese.columns:
@@ -1657,124 +1270,302 @@ def tab_analisi_spese(df_spese, anno_sel=None, mese_sel=None, area_sel=None):
         spese_dest = df_spese.groupby("Destinazione")["Costo"].sum().sort_values(ascending=False).head(10)
         st.dataframe(spese_dest.to_frame("Totale").style.format({"Totale": "{:,.0f} €"}))
 
-    # Grafico di trend mensile
-    if "Data" in df_spese.columns:
-        df_spese["AnnoMese"] = df_spese["Data"].dt.to_period("M")
-        trend_mensile = df_spese.groupby("AnnoMese")["Costo"].sum()
-        st.line_chart(trend_mensile)
-
-    # Tabella completa filtrata (opzionale)
+    # Tabella completa filtrata: anteprima a video, export completo
     st.markdown("**Tabella Spese Filtrata**")
     st.dataframe(df_spese.head(50))
+    if len(df_spese) > 50:
+        st.caption(f"Prime 50 spese su {len(df_spese):,}: l'export contiene tutte quelle filtrate.")
+    pulsanti_export("spese", df_registro, "spese_filtrate", posizioni=posizioni)
+
+# ========== REPORT PDF IN BACKGROUND ==========
+class CodaReport:
+    """
+    Coda dei report PDF condivisa tra le sessioni: i job girano su un pool di thread dedicato,
+    i PDF finiti restano in una CacheLRU (limitata in byte) con chiave versione dati + filtri.
+    Una richiesta già in corso per la stessa chiave non crea un nuovo job. A fine job la voce
+    esce dalla coda: il risultato è il PDF in `artefatti`, gli errori restano (al più
+    `max_errori`) finché una sessione non li mostra.
+    """
+
+    def __init__(self, max_byte, max_job=2, max_errori=16):
+        self.artefatti = CacheLRU(max_byte)
+        self._pool = ThreadPoolExecutor(max_workers=max_job, thread_name_prefix="bb_report")
+        self._job = {}
+        self._errori = OrderedDict()
+        self.max_errori = max_errori
+        self._lock = threading.Lock()
+
+    def _chiudi(self, chiave, job, **esito):
+        # Toglie il job dalla coda (se è ancora quello registrato per la chiave); gli errori vanno in _errori
+        with self._lock:
+            job.update(esito)
+            if self._job.get(chiave) is job:
+                del self._job[chiave]
+            if job["stato"] == "errore":
+                self._errori.pop(chiave, None)
+                self._errori[chiave] = dict(job)
+                while len(self._errori) > self.max_errori:
+                    self._errori.popitem(last=False)
+
+    def richiedi(self, chiave, df_kpi):
+        with self._lock:
+            job = self._job.get(chiave)
+            if job is not None:
+                return dict(job)
+            self._errori.pop(chiave, None)
+            job = {"stato": "in coda", "quota": 0.0, "messaggio": "In attesa", "errore": None}
+            self._job[chiave] = job
+
+        def avanzamento(quota, messaggio):
+            with self._lock:
+                job.update(stato="in corso", quota=quota, messaggio=messaggio)
+
+        def esegui():
+            inizio = datetime.now()
+            try:
+                contenuto = costruisci_report_pdf(df_kpi, avanzamento)
+            except Exception as e:
+                errore = f"{type(e).__name__}: {e}"
+                self._chiudi(chiave, job, stato="errore", errore=errore)
+                logger.warning("report %s fallito: %s", chiave, errore)
+                return
+            self.artefatti.put(chiave, contenuto)
+            self._chiudi(chiave, job, stato="pronto", quota=1.0, messaggio="Report pronto")
+            logger.info("report %s pronto in %.1fs (%d byte)", chiave,
+                        (datetime.now() - inizio).total_seconds(), len(contenuto))
+
+        with self._lock:
+            stato = dict(job)
+        self._pool.submit(esegui)
+        return stato
+
+    def stato(self, chiave):
+        """Copia dello stato del job in coda o dell'ultimo errore per la chiave (None se nessuno)."""
+        with self._lock:
+            job = self._job.get(chiave) or self._errori.get(chiave)
+            return None if job is None else dict(job)
+
+    def dimentica(self, chiave):
+        with self._lock:
+            self._errori.pop(chiave, None)
+
+@st.cache_resource
+def coda_report():
+    return CodaReport(int(os.environ.get("BB_CACHE_REPORT_MB", "64")) * 1024 * 1024)
+
+@st.fragment(run_every=1.0)
+def _avanzamento_report(chiave):
+    # Aggiorna solo questo frammento ogni secondo; a job concluso (uscito dalla coda) rilancia l'app per il download
+    job = coda_report().stato(chiave)
+    if job is None or job["stato"] == "errore":
+        st.rerun()
+    st.progress(job["quota"], text=f"{job['messaggio']}…")
 
 def tab_pdf(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area=None, barca=None):
-    from fpdf import FPDF
-    import matplotlib.pyplot as plt
     st.header("📄 Report PDF – Esporta analisi")
-    if st.button("Crea e scarica report PDF"):
-        tmpdir = tempfile.mkdtemp()
-        pdf = FPDF()
-        pdf.set_auto_page_break(auto=True, margin=15)
-        pdf.add_page()
-        pdf.set_font("Arial", "B", 16)
-        pdf.cell(0, 10, "Report Analitico Tour Boat Taxi", ln=True, align="C")
-        pdf.set_font("Arial", "", 12)
-        df_tot = df_kpi[df_kpi["TipoRiga"] == "Totale"]
-        start_date = df_tot["Data"].min()
-        end_date = df_tot["Data"].max()
-        pdf.cell(0, 10, f"Periodo analisi: {start_date.strftime('%d/%m/%Y')} – {end_date.strftime('%d/%m/%Y')}", ln=True)
-        pdf.ln(5)
-        pdf.cell(0, 8, f"Incasso totale: {df_tot['Incasso'].sum():,.0f} €", ln=True)
-        pdf.cell(0, 8, f"Numero clienti: {df_tot['Clienti'].sum():,.0f}", ln=True)
-        pdf.cell(0, 8, f"Tour effettuati: {len(df_tot)}", ln=True)
-        try:
-            pdf.cell(0, 8, f"Efficienza €/litro: {(df_tot['Incasso'].sum()/df_tot['Gasolio'].sum()):.2f}", ln=True)
-        except:
-            pdf.cell(0, 8, f"Efficienza €/litro: —", ln=True)
-        pdf.ln(5)
-        fig, ax = plt.subplots(figsize=(5,3))
-        df_box = df_tot.copy()
-        if not df_box.empty:
-            df_box.boxplot(column="Incasso", by="TipoCliente", ax=ax)
-            plt.title("Boxplot Incasso per Cliente")
-            plt.suptitle("")
-            fig.tight_layout()
-            img_path = os.path.join(tmpdir, "boxplot.png")
-            fig.savefig(img_path)
-            pdf.image(img_path, w=100)
-            plt.close(fig)
-        df_box["Mese"] = df_box["Data"].dt.to_period("M").astype(str)
-        if not df_box.empty:
-            fig2, ax2 = plt.subplots(figsize=(5,3))
-            df_box.groupby("Mese")["Incasso"].sum().plot(ax=ax2)
-            ax2.set_title("Trend incasso mensile")
-            fig2.tight_layout()
-            img_path2 = os.path.join(tmpdir, "trend.png")
-            fig2.savefig(img_path2)
-            pdf.image(img_path2, w=100)
-            plt.close(fig2)
-        pdf.set_font("Arial", "B", 12)
-        pdf.cell(0, 10, "Statistiche principali:", ln=True)
-        pdf.set_font("Arial", "", 11)
-        pdf.cell(0, 8, "Vedi dashboard per ulteriori approfondimenti.", ln=True)
-        pdf_file = os.path.join(tmpdir, "report_analitico.pdf")
-        pdf.output(pdf_file)
-        with open(pdf_file, "rb") as f:
-            st.download_button("Scarica PDF", f, file_name="report_analitico.pdf", mime="application/pdf")
-        import shutil
-        shutil.rmtree(tmpdir)
-        
+    st.markdown("**Registro incassi filtrato**")
+    pulsanti_export("registro", df_kpi, "registro_filtrato", colonne=COLONNE_FATTI)
+    coda = coda_report()
+    chiave = f"{VERSIONE_DATI}|{chiave_filtri(periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca)}"
+
+    contenuto = coda.artefatti.get(chiave)
+    if contenuto is not None:
+        st.success("Report pronto per i filtri correnti.")
+        st.download_button("Scarica PDF", contenuto, file_name="report_analitico.pdf", mime="application/pdf")
+        return
+
+    job = coda.stato(chiave)
+    if job is not None and job["stato"] == "errore":
+        st.error(f"Generazione del report non riuscita: {job['errore']}")
+        coda.dimentica(chiave)
+        job = None
+    if job is None:
+        if st.button("Crea report PDF"):
+            coda.richiedi(chiave, df_kpi)
+            _avanzamento_report(chiave)
+        return
+    _avanzamento_report(chiave)
+
+
+# ========== CALCOLO PARALLELO DELLE TAB ==========
+@st.cache_resource
+def pool_calcolo():
+    # Pool di thread condiviso tra sessioni e rerun: pandas e numpy rilasciano il GIL nei groupby
+    return ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="bb_calcolo")
+
+def _calcola_forecast_globale(df, df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca):
+    df_forecast = filtra_forecast(df, df_kpi, giorno_sel, tipo_cliente_sel, area, barca)
+    return calcola_forecast(df_forecast, periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca)
+
+def avvia_calcoli_tab(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca, df=None):
+    """
+    Sottomette al pool i calcoli indipendenti di tutte le tab (nessuna chiamata st.*,
+    input non modificati). Ritorna {nome tab: Future}; il render legge i risultati in ordine.
+    """
+    pool = pool_calcolo()
+    filtri = (periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca)
+    # in_contesto: i thread del pool scrivono gli intervalli "calcolo:*" nella traccia del rerun
+    return {
+        "kpi": pool.submit(profilo.in_contesto("calcolo:kpi", calcola_kpi), df_kpi, *filtri, rollup=ROLLUP),
+        "performance": pool.submit(profilo.in_contesto("calcolo:performance", calcola_performance), df_kpi, *filtri),
+        "popolarita": pool.submit(profilo.in_contesto("calcolo:popolarita", calcola_popolarita), df_kpi, *filtri),
+        "stagionalita": pool.submit(profilo.in_contesto("calcolo:stagionalita", calcola_stagionalita), df_kpi, *filtri),
+        "maltempo": pool.submit(profilo.in_contesto("calcolo:maltempo", calcola_maltempo), df_kpi, *filtri),
+        "forecast": pool.submit(profilo.in_contesto("calcolo:forecast", _calcola_forecast_globale), df, df_kpi, *filtri),
+        "alert": pool.submit(profilo.in_contesto("calcolo:alert", contesto_alert), df_kpi),
+    }
+
+def calcoli_tab(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca, df=None):
+    """
+    Future dei calcoli delle tab, tenuti in session_state per (versione dati, filtri, giorno):
+    sottomessi di nuovo al pool solo quando la chiave cambia o un calcolo è fallito, così i
+    widget interni alle tab (slider del simulatore, soglie, PDF) non rifanno le aggregazioni.
+    """
+    chiave = (VERSIONE_DATI, CHIAVE_FILTRI, datetime.now().date())  # il forecast dipende da oggi
+    salvati = st.session_state.get("calcoli_tab")
+    if salvati is not None and salvati["chiave"] == chiave and not any(
+        f.done() and (f.cancelled() or f.exception() is not None) for f in salvati["futuri"].values()
+    ):
+        return salvati["futuri"]
+    profilo.conta("cache.calcoli_tab.miss")
+    futuri = avvia_calcoli_tab(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca, df=df)
+    st.session_state["calcoli_tab"] = {"chiave": chiave, "futuri": futuri}
+    return futuri
 
 def tab_tutti_i_tab(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca, df=None):
     """
     Visualizza tutte le tab principali, incluso il forecast.
+    Prima avvia in parallelo i calcoli di tutte le tab (o riprende quelli del rerun precedente
+    con gli stessi dati e filtri), poi disegna in ordine man mano che i risultati sono pronti.
     Args:
         df_kpi: DataFrame filtrato per i KPI (filtraggio principale)
         periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca: filtri correnti
         df: DataFrame globale non filtrato (necessario solo per Forecast)
     """
-    tab_kpi(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca)
+    with profilo.intervallo("calcoli_tab", cache="calcoli_tab"):
+        calcoli = calcoli_tab(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca, df=df)
+    filtri = (periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca)
+    righe = len(df_kpi)
+
+    # Gli intervalli "tab:*" comprendono l'attesa del calcolo nel pool e il rendering
+    with profilo.intervallo("tab:kpi", righe=righe):
+        tab_kpi(df_kpi, *filtri, risultati=calcoli["kpi"].result())
     tabs = st.tabs([
         "Performance", "Popolarità Tour", "Trend & Confronto Storico", "Maltempo",
         "Forecast", "Simulatore", "Suggerimenti", "Analisi Spese", "PDF Report"
     ])
 
-    with tabs[0]:
-        tab_performance(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca)
-    with tabs[1]:
-        tab_popolarita(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca)
-    with tabs[2]:
-        tab_stagionalita(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca)
-    with tabs[3]:
-        tab_maltempo(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca)
-    with tabs[4]:
-        # --- Forecast: parte sempre dal df globale ---
-        df_forecast = df.copy() if df is not None else df_kpi.copy()
-        if area and area != "Tutte":
-            df_forecast = df_forecast[df_forecast["Area"] == area]
-        if barca and barca != "Tutte":
-            df_forecast = df_forecast[df_forecast["Barca_Normalizzata"] == barca]
-        if giorno_sel == "Alti":
-            df_forecast = df_forecast[df_forecast["TipoGiorno"] == "Alti"]
-        elif giorno_sel == "Bassi":
-            df_forecast = df_forecast[df_forecast["TipoGiorno"] == "Bassi"]
-        elif giorno_sel == "Confronto Alti/Bassi":
-            df_forecast = df_forecast[df_forecast["TipoGiorno"].isin(["Alti", "Bassi"])]
-        # TipoCliente: solo sulle righe Dettaglio, quindi filtra dopo
-        if tipo_cliente_sel == "Privati":
-            df_forecast = df_forecast[df_forecast["TipoCliente"] == "Privati"]
-        elif tipo_cliente_sel == "Gruppo":
-            df_forecast = df_forecast[df_forecast["TipoCliente"] == "Gruppo"]
-        elif tipo_cliente_sel == "Confronto Privati/Gruppo":
-            df_forecast = df_forecast[df_forecast["TipoCliente"].isin(["Privati", "Gruppo"])]
-        tab_forecast(df_forecast, periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca)
-    with tabs[5]:
+    with tabs[0], profilo.intervallo("tab:performance", righe=righe):
+        tab_performance(df_kpi, *filtri, risultati=calcoli["performance"].result())
+    with tabs[1], profilo.intervallo("tab:popolarita", righe=righe):
+        tab_popolarita(df_kpi, *filtri, risultati=calcoli["popolarita"].result())
+    with tabs[2], profilo.intervallo("tab:stagionalita", righe=righe):
+        tab_stagionalita(df_kpi, *filtri, risultati=calcoli["stagionalita"].result())
+    with tabs[3], profilo.intervallo("tab:maltempo", righe=righe):
+        tab_maltempo(df_kpi, *filtri, risultati=calcoli["maltempo"].result())
+    with tabs[4], profilo.intervallo("tab:forecast"):
+        tab_forecast(None, *filtri, risultati=calcoli["forecast"].result())
+    with tabs[5], profilo.intervallo("tab:simulatore", righe=righe):
         tab_simulatore(df_kpi)
-    with tabs[6]:
-        tab_suggerimenti(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca)
-    with tabs[7]:
-        tab_analisi_spese(df_spese, anno_sel=2025, mese_sel=None, area_sel="Azienda")
-    with tabs[8]:
-        tab_pdf(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area, barca)
+    with tabs[6], profilo.intervallo("tab:suggerimenti", righe=righe):
+        tab_suggerimenti(df_kpi, *filtri, df_storico=df, contesto=calcoli["alert"].result())
+    with tabs[7], profilo.intervallo("tab:analisi_spese", righe=len(df_spese)):
+        tab_analisi_spese(df_spese, periodo_selezionato, area, barca, cubo=CUBO_MARGINI)
+    with tabs[8], profilo.intervallo("tab:pdf", righe=righe):
+        tab_pdf(df_kpi, *filtri)
+
+# ========== PROFILING (TEMPI PER RERUN) ==========
+FILE_PROFILO = os.environ.get("BB_PROFILO_JSONL", "")
+
+def pannello_profilo(traccia):
+    """
+    Pannello "Profiling" in sidebar: intervalli del rerun appena disegnato, contatori di cache
+    e righe. Con BB_PROFILO_JSONL=<file> (o l'opzione del pannello) ogni rerun è aggiunto
+    come riga JSON al file.
+    """
+    with st.sidebar.expander("⏱️ Profiling"):
+        mostra = st.checkbox("Mostra tempi del rerun", key="profiling_mostra")
+        registra = st.checkbox("Registra tracce JSONL", value=bool(FILE_PROFILO), key="profiling_jsonl",
+                               help="Una riga JSON per rerun in BB_PROFILO_JSONL (default profilo_dashboard.jsonl).")
+        cache = cache_figure()
+        if registra:
+            profilo.scrivi_jsonl(traccia, FILE_PROFILO or "profilo_dashboard.jsonl")
+        if not mostra:
+            return
+        dati = traccia.come_dict()
+        st.metric("Rerun", f"{dati['durata_ms']:,.0f} ms")
+        intervalli = pd.DataFrame(dati["intervalli"])
+        if not intervalli.empty:
+            intervalli["nome"] = ["  " * l + n for l, n in zip(intervalli["livello"], intervalli["nome"])]
+            st.dataframe(intervalli[["nome", "durata_ms", "righe", "cache", "thread"]],
+                         hide_index=True, use_container_width=True)
+        st.caption("Contatori")
+        st.dataframe(pd.Series(dati["contatori"], name="valore").sort_index(), use_container_width=True)
+        st.caption(f"Cache figure (processo): {cache.hit} hit, {cache.miss} miss, {cache.byte / 1024 ** 2:.1f} MB")
+
+# ========== MEMORIA PER SESSIONE E TETTO ==========
+def contabilizza_sessione(oggetti):
+    """Registra i byte degli oggetti della sessione e il picco di RSS del rerun; ritorna {nome: byte}."""
+    byte = {nome: dimensione_profonda(o) for nome, o in oggetti.items()}
+    rss_picco = campionatore_rss().chiudi(st.session_state.pop("gettone_rss", GETTONE_RSS))
+    contabilita_memoria().registra_sessione(st.session_state["id_sessione"], byte, rss_picco)
+    TRACCIA.meta.update(rss_picco_mb=round(rss_picco / 1024 ** 2, 1), byte_sessione=sum(byte.values()))
+    return byte
+
+def applica_tetto_memoria():
+    """
+    Se sessioni e cache insieme superano BB_MEMORIA_MAX_MB svuota le cache, dalla più economica
+    da ricostruire, finché i byte liberati coprono l'eccesso. I dati delle sessioni non sono toccati.
+    Il tetto è sulla memoria contabilizzata, non sull'RSS: l'allocatore non restituisce subito al
+    sistema la memoria liberata e un confronto con l'RSS svuoterebbe le cache a ogni rerun.
+    """
+    if not MEMORIA_MAX_MB:
+        return []
+    figure, report = cache_figure(), coda_report().artefatti
+    totali = contabilita_memoria().totali({"figure": figure.byte, "report_pdf": report.byte})
+    eccesso = totali["byte_sessioni"] + totali["byte_cache"] - MEMORIA_MAX_MB * 1024 ** 2
+    if eccesso <= 0:
+        return []
+    svuotate = contabilita_memoria().libera(eccesso, [
+        ("figure", figure.svuota), ("report_pdf", report.svuota), ("stati_anomalie", svuota_stati_anomalie),
+        ("statistiche_simulatore", statistiche_simulatore.clear),
+        ("giorno_barca_simulatore", giorno_barca_simulatore.clear),
+        ("cubo_margini", cubo_margini.clear), ("rollup_gerarchici", rollup_gerarchici.clear),
+        ("fatti_condivisi", fatti_condivisi.clear),
+    ], byte_esterni={"figure": figure.byte, "report_pdf": report.byte})
+    gc.collect()
+    logger.warning("memoria oltre %d MB di %.1f MB: svuotate %s", MEMORIA_MAX_MB, eccesso / 1024 ** 2, svuotate)
+    profilo.conta("memoria.cache_svuotate", len(svuotate))
+    return svuotate
+
+def pannello_memoria(byte_sessione):
+    with st.sidebar.expander("🧠 Memoria"):
+        mb = 1024 ** 2
+        st.caption(f"Questa sessione: {sum(byte_sessione.values()) / mb:,.1f} MB, "
+                   f"picco RSS del rerun {TRACCIA.meta['rss_picco_mb']:,.0f} MB")
+        st.dataframe(pd.Series({n: b / mb for n, b in byte_sessione.items()}, name="MB").round(2),
+                     use_container_width=True)
+        contabilita = contabilita_memoria()
+        figure, report = cache_figure(), coda_report().artefatti
+        totali = contabilita.totali({"figure": figure.byte, "report_pdf": report.byte})
+        tetto = f" (tetto {MEMORIA_MAX_MB:,} MB)" if MEMORIA_MAX_MB else ""
+        st.caption(f"Server: {totali['sessioni']} sessioni, {totali['byte_sessioni'] / mb:,.1f} MB nelle sessioni, "
+                   f"{totali['byte_cache'] / mb:,.1f} MB nelle cache{tetto}; RSS {totali['rss'] / mb:,.0f} MB "
+                   f"(picco {totali['rss_picco'] / mb:,.0f} MB)")
+        voci = pd.concat([
+            contabilita.cache(),
+            pd.DataFrame([(nome, str(chiave)[:80], byte) for nome, cache in (("figure", figure), ("report_pdf", report))
+                          for chiave, byte in cache.voci()], columns=["cache", "voce", "byte"]),
+        ], ignore_index=True)
+        if not voci.empty:
+            st.dataframe(voci.groupby("cache")["byte"].agg(["count", "sum"]).rename(columns={"count": "voci", "sum": "byte"}),
+                         use_container_width=True)
+            st.dataframe(voci, hide_index=True, use_container_width=True)
 
 tab_tutti_i_tab(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area_sel, barca_sel, df=df)
+# df è una vista di FATTI (contabilizzato come cache "fatti_condivisi"): nessun byte proprio della sessione
+BYTE_SESSIONE = contabilizza_sessione({"df_kpi": df_kpi, "df_spese": df_spese,
+                                       "session_state": {k: v for k, v in st.session_state.items() if k != "gettone_rss"}})
+applica_tetto_memoria()
+pannello_memoria(BYTE_SESSIONE)
+pannello_profilo(TRACCIA)
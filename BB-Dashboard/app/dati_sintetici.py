@@ -0,0 +1,204 @@
+"""
+Generatore di dati sintetici nel formato dei file reali, per provare la dashboard su scale diverse.
+
+    python dati_sintetici.py --uscita /tmp/bb_grande --anni 8 --barche 12 --tour-giorno 6
+
+Scrive un crmboats_taxi_<anno>.xlsx per anno (fogli GENNAIO…DICEMBRE più "< TOTALI >", riga
+Totale per barca e giorno seguita dalle tratte Dettaglio con il nome abbreviato, riga di totale
+mensile in fondo) e un "Bertoldi Boats.csv" con le spese. Le barche sono quelle del registro di
+motore.dati (al massimo 12): la scala cresce con gli anni e le tratte per giorno.
+"""
+import argparse
+import calendar
+import csv
+import os
+import sys
+from datetime import date
+
+import numpy as np
+from openpyxl import Workbook
+
+from motore.dati import ABBREV_TO_FULL, AREE_BARCHE
+
+MESI = ["GENNAIO", "FEBBRAIO", "MARZO", "APRILE", "MAGGIO", "GIUGNO",
+        "LUGLIO", "AGOSTO", "SETTEMBRE", "OTTOBRE", "NOVEMBRE", "DICEMBRE"]
+# Quota di giorni-barca attivi per mese (storico 2022-2025)
+ATTIVITA_MESE = [0.09, 0.11, 0.25, 0.52, 0.72, 0.81, 0.87, 0.64, 0.57, 0.40, 0.12, 0.07]
+# Durate delle tratte: (testo, minuti, frequenza)
+DURATE = [
+    ("30 minuti", 30, 0.66), ("45 minuti", 45, 0.02), ("1 ora", 60, 0.11), ("1 ora e 30 minuti", 90, 0.03),
+    ("2 ore", 120, 0.08), ("3 ore", 180, 0.02), ("4 ore", 240, 0.02), ("4 ore e 30 minuti", 270, 0.03),
+    ("6 ore e 30 minuti", 390, 0.02), ("8 ore", 480, 0.01),
+]
+_P_DURATE = np.array([d[2] for d in DURATE]) / sum(d[2] for d in DURATE)
+DIPENDENTI = ["Davide", "Longo", "Damiano", "Valentin", "Fabian", "Ciro", "Stefano", "Gianluca", "Riccardo", "Ivan"]
+# Spese: categoria → (frequenza, costo mediano, tipo spesa, intestata a una barca)
+CATEGORIE_SPESA = {
+    "Gestione": (0.30, 78, "Fissi", False), "Gasolio": (0.14, 1000, "Variabili", True),
+    "Cantiere": (0.11, 250, "Variabili", True), "Ufficio": (0.06, 80, "Fissi", False),
+    "Acquisto nuovo": (0.05, 485, "Variabili", True), "Cibo e bevande": (0.04, 350, "Variabili", False),
+    "Burocrazia": (0.04, 80, "Fissi", False), "Sito": (0.03, 105, "Fissi", False),
+    "Contabilità": (0.03, 940, "Fissi", False), "Pubblicità": (0.03, 500, "Variabili", False),
+    "Tasse": (0.03, 1500, "Fissi", False), "Meccanico": (0.02, 2200, "Variabili", True),
+    "Provvigioni": (0.02, 150, "Variabili", False), "Logistica": (0.02, 210, "Variabili", False),
+    "Banca": (0.02, 220, "Fissi", False), "Marketing": (0.02, 366, "Variabili", False),
+}
+FORNITORI = ["Amazon", "Anselmo", "Osculati", "Quadri Bevande srl", "Gesta srl", "Logistic Trans", "Domenegoni",
+             "Assicura sas", "Consorzio Salò", "dna marine", "Nexi Payments spa", "Saef", "Peruz"]
+PAGAMENTI = (["Bonifico", "Contante Extra", "Carta di credito/prepagata", "Contante"], [0.87, 0.1, 0.025, 0.005])
+
+
+def ordine_barche():
+    # Una barca per area a turno: anche le flotte piccole coprono tutte le aree
+    code = [list(barche) for barche in AREE_BARCHE.values()]
+    ordine = []
+    while any(code):
+        ordine += [c.pop(0) for c in code if c]
+    return ordine
+
+
+def testo_durata(minuti):
+    ore, minuti = divmod(int(minuti), 60)
+    parti = []
+    if ore:
+        parti.append("1 ora" if ore == 1 else f"{ore} ore")
+    if minuti:
+        parti.append(f"{minuti} minuti")
+    return " e ".join(parti) or "0 minuti"
+
+
+def testo_euro(valore):
+    valore = round(float(valore), 2)
+    return f"{valore:.0f}€" if valore == int(valore) else f"{valore:.2f}".rstrip("0").replace(".", ",") + "€"
+
+
+def righe_giorno_barca(rng, barca, giorno, tour_giorno, abbreviazioni):
+    """Riga Totale e righe Dettaglio (colonne B:I) di una barca in un giorno."""
+    n = 1 + rng.poisson(max(tour_giorno - 1, 0))
+    scelte = rng.choice(len(DURATE), size=n, p=_P_DURATE)
+    minuti = np.array([DURATE[i][1] for i in scelte])
+    navetta = minuti <= 45
+    clienti = np.where(navetta, 1 + rng.binomial(29, 0.35, n), 1 + rng.poisson(5, n))
+    incasso = np.where(navetta, clienti * rng.normal(13, 2, n), minuti / 60 * rng.uniform(120, 200, n))
+    incasso = np.round(np.maximum(incasso, 5) / 5) * 5
+    nome_dettaglio = abbreviazioni.get(barca, barca.replace("’", "'"))
+    dettagli = [
+        [None, "Lungo lago", DURATE[i][0], int(c), nome_dettaglio if rng.random() > 0.05 else barca,
+         None, testo_euro(v), None]
+        for i, c, v in zip(scelte, clienti, incasso)
+    ]
+    gasolio = testo_euro(rng.uniform(60, 250)) if rng.random() < 0.5 else None
+    totale = [giorno.strftime("%d/%m/%y"), n, testo_durata(minuti.sum()), int(clienti.sum()), barca,
+              str(rng.choice(DIPENDENTI)), testo_euro(incasso.sum()), gasolio]
+    return [totale] + dettagli, (n, int(minuti.sum()), int(clienti.sum()), float(incasso.sum()))
+
+
+def scrivi_registro(percorso, anno, barche, tour_giorno, rng, fino_a):
+    abbreviazioni = {v: k for k, v in ABBREV_TO_FULL.items()}
+    wb = Workbook(write_only=True)
+    riepilogo = []
+    righe_scritte = 0
+    for mese, nome_mese in enumerate(MESI, start=1):
+        ws = wb.create_sheet(nome_mese)
+        ws.append([])
+        ws.append([None, f"{nome_mese} {anno}"])
+        ws.append([])
+        ws.append([None, "DATA", "TRATTE", "DURATA TOTALE", "CLIENTI", "BARCA", "DIPENDENTE", "INCASSO", "GASOLIO"])
+        somme = np.zeros(4)
+        for giorno in (date(anno, mese, g) for g in range(1, calendar.monthrange(anno, mese)[1] + 1)):
+            if giorno > fino_a:
+                break
+            attivita = min(1.0, ATTIVITA_MESE[mese - 1] * (1.2 if giorno.weekday() >= 5 else 1.0))
+            attive = [b for b in barche if rng.random() < attivita]
+            for k, barca in enumerate(attive):
+                righe, totali = righe_giorno_barca(rng, barca, giorno, tour_giorno, abbreviazioni)
+                if k:
+                    righe[0][0] = None  # la data compare solo sulla prima riga del giorno
+                for riga in righe:
+                    ws.append([None] + riga)
+                righe_scritte += len(righe)
+                somme += totali
+        ws.append([])
+        ws.append([])
+        ws.append([None, None, int(somme[0]), testo_durata(somme[1]), int(somme[2]), None, None, testo_euro(somme[3])])
+        riepilogo.append([nome_mese, int(somme[0]), int(somme[2]), testo_euro(somme[3])])
+    ws = wb.create_sheet("< TOTALI >")
+    ws.append([None, "MESE", "TRATTE", "CLIENTI", "INCASSO"])
+    for riga in riepilogo:
+        ws.append([None] + riga)
+    wb.save(percorso)
+    return righe_scritte
+
+
+def scrivi_spese(percorso, anni, barche, rng, fino_a):
+    categorie = list(CATEGORIE_SPESA)
+    frequenze = np.array([CATEGORIE_SPESA[c][0] for c in categorie])
+    righe = 0
+    with open(percorso, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        writer.writerow(["DATA", "DESCRIZIONE", "COSTO", "TIPO SPESA", "FORNITORE", "CATEGORIA",
+                         "DESTINAZIONE", "METODO PAGAMENTO", "PAGATO", "AZIONI"])
+        for anno in anni:
+            for mese in range(1, 13):
+                for _ in range(rng.poisson(30 + 6 * len(barche))):
+                    giorno = date(anno, mese, int(rng.integers(1, 29)))
+                    if giorno > fino_a:
+                        continue
+                    categoria = categorie[rng.choice(len(categorie), p=frequenze / frequenze.sum())]
+                    _, mediana, tipo, di_barca = CATEGORIE_SPESA[categoria]
+                    costo = mediana * np.exp(rng.normal(0, 0.8))
+                    destinazione = str(rng.choice(barche)).replace("’", "'") if di_barca else "Azienda"
+                    importo = f"{costo:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".") + " €"
+                    writer.writerow([
+                        giorno.strftime("%d/%m/%Y"), f"FATTURA {rng.integers(1, 10**6):06d}", importo, tipo,
+                        str(rng.choice(FORNITORI)), categoria, destinazione,
+                        str(rng.choice(PAGAMENTI[0], p=PAGAMENTI[1])), "", "\xa0\xa0\xa0",
+                    ])
+                    righe += 1
+    return righe
+
+
+def genera_dataset(cartella, anni=4, barche=12, tour_giorno=3.3, seed=0, anno_finale=None, fino_a=None):
+    """
+    Scrive registri e spese sintetici in `cartella`: `anni` anni fino ad `anno_finale` (default
+    l'anno corrente, con giorni fino a oggi), le prime `barche` barche del registro, in media
+    `tour_giorno` tratte per barca attiva. Ritorna un dizionario con parametri e righe scritte.
+    """
+    elenco = ordine_barche()
+    if not 1 <= barche <= len(elenco):
+        raise ValueError(f"barche deve essere tra 1 e {len(elenco)} (registro di motore.dati)")
+    fino_a = fino_a or date.today()
+    anno_finale = anno_finale or fino_a.year
+    elenco_anni = list(range(anno_finale - anni + 1, anno_finale + 1))
+    rng = np.random.default_rng(seed)
+    os.makedirs(cartella, exist_ok=True)
+    righe_registro = sum(
+        scrivi_registro(os.path.join(cartella, f"crmboats_taxi_{anno}.xlsx"), anno, elenco[:barche],
+                        tour_giorno, rng, fino_a)
+        for anno in elenco_anni
+    )
+    righe_spese = scrivi_spese(os.path.join(cartella, "Bertoldi Boats.csv"), elenco_anni, elenco[:barche], rng, fino_a)
+    return {"anni": elenco_anni, "barche": barche, "tour_giorno": tour_giorno, "seed": seed,
+            "righe_registro": righe_registro, "righe_spese": righe_spese}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Registri crmboats_taxi e spese sintetici a scala configurabile.")
+    parser.add_argument("--uscita", required=True, help="cartella di destinazione")
+    parser.add_argument("--anni", type=int, default=4)
+    parser.add_argument("--anno-finale", type=int, default=None, help="ultimo anno (default anno corrente)")
+    parser.add_argument("--barche", type=int, default=12)
+    parser.add_argument("--tour-giorno", type=float, default=3.3, help="tratte medie per barca attiva al giorno")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    try:
+        esito = genera_dataset(args.uscita, args.anni, args.barche, args.tour_giorno, args.seed, args.anno_finale)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"{esito['righe_registro']} righe registro ({esito['anni'][0]}-{esito['anni'][-1]}, "
+          f"{esito['barche']} barche), {esito['righe_spese']} spese in {args.uscita}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,26 @@
+"""
+Motore di calcolo della dashboard Bertoldi Boats, utilizzabile senza Streamlit.
+
+Le funzioni ritornano DataFrame o dataclass; la dashboard le avvolge con la cache di
+Streamlit e ne disegna i risultati. Esempio:
+
+    import motore
+    df = motore.carica_dati("../data")
+    periodo = {"modalita": "analisi", "tipo": "annuale", "anno": 2025}
+    df_kpi = motore.filtra_dataframe(df, periodo, "Tutti", "Tutti", "Tutte")
+    motore.calcola_kpi(df_kpi)
+"""
+from . import alert, anomalie, dati, esporta, filtri, forecast, kpi, maltempo, margini, memoria, performance, popolarita, profilo, simulatore, stagionalita
+from .alert import SOGLIE_ALERT, Alert, calcola_alert, contesto_alert
+from .anomalie import METRICHE_ANOMALIE, aggiorna_anomalie, calcola_anomalie, serie_giornaliera_barche
+from .dati import EsitoMeteo, FattiCondivisi, aggiorna_meteo, carica_dati, carica_fatti, carica_spese, classifica_spese, firma_sorgenti, versione_dati
+from .esporta import COLONNE_FATTI, FORMATI_EXPORT, esporta_a_pezzi, tabella_esportabile
+from .filtri import assegna_periodo, etichette_confronto, filtra_dataframe, indice_allineamento, indice_filtro, periodo_da_testo
+from .forecast import RisultatoForecast, calcola_forecast, filtra_forecast
+from .kpi import Kpi, calcola_kpi, rollup_gerarchici
+from .maltempo import RisultatoMaltempo, bootstrap_delta_meteo, calcola_maltempo, welch_per_gruppo
+from .margini import conto_economico, cubo_margini, fetta_cubo, indice_spese
+from .performance import RisultatoPerformance, calcola_performance
+from .popolarita import DeltaPopolarita, RisultatoPopolarita, calcola_popolarita
+from .simulatore import ottimizza_flotta, simula_curve, simula_monte_carlo, statistiche_simulatore
+from .stagionalita import RisultatoStagionalita, calcola_stagionalita
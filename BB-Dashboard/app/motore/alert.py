@@ -0,0 +1,208 @@
+"""Motore alert: regole su un unico aggregato del contesto filtrato, con soglie configurabili."""
+import calendar
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+SOGLIE_ALERT = {
+    "efficienza_quota_media": 0.8,     # efficienza sotto l'80% della media flotta
+    "efficienza_default": 80,          # €/litro se non c'è una media calcolabile
+    "trend_calo": 0.8,                 # ultimo mese < 80% del mese precedente
+    "concentrazione_quota": 0.6,       # un solo tour > 60% dell'incasso
+    "anomalia_stagionale": 0.7,        # mese < 70% della media dello stesso mese negli altri anni
+    "sottoutilizzo_quota": 0.7,        # giorni attivi < 70% della media flotta
+    "maltempo_margine": 15,            # punti % di calo oltre la media flotta
+    "giorni_alti_quota": 0.8,          # incasso giorni alti < 80% dei giorni bassi
+}
+
+def aggregato_alert(df_kpi):
+    """
+    Aggregato condiviso da tutte le regole di alert: un solo groupby per
+    (TipoRiga, Barca, Data, Durata) con somme e conteggi, più mese e anno.
+    """
+    agg = (
+        df_kpi.groupby(["TipoRiga", "Barca_Normalizzata", "Data", "Durata"], dropna=False, sort=False)
+        .agg(
+            Incasso=("Incasso", "sum"),
+            Incasso_n=("Incasso", "count"),
+            Gasolio=("Gasolio", "sum"),
+            TipoGiorno=("TipoGiorno", "first"),
+            Maltempo=("Maltempo", "first"),
+        )
+        .reset_index()
+    )
+    agg["Anno"] = agg["Data"].dt.year
+    agg["MeseNum"] = agg["Data"].dt.month
+    return agg
+
+@dataclass
+class Alert:
+    famiglia: str
+    icona: str
+    oggetto: Any
+    valore: Any
+    soglia: Any
+    messaggio: str                    # HTML già formattato, icona inclusa
+
+def _alert(famiglia, icona, messaggio, oggetto=None, valore=None, soglia=None):
+    return Alert(famiglia=famiglia, icona=icona, oggetto=oggetto, valore=valore, soglia=soglia,
+                 messaggio=f"{icona} {messaggio}")
+
+def _regola_efficienza(ctx, soglie):
+    mensile = ctx["mensile"]
+    eff = mensile["Incasso"] / mensile["Gasolio"].replace(0, np.nan)
+    eff_media_barca = eff.groupby(mensile["Barca_Normalizzata"]).mean().dropna()
+    soglia = eff_media_barca.mean() * soglie["efficienza_quota_media"] if len(eff_media_barca) > 0 else soglie["efficienza_default"]
+    sotto = eff_media_barca[eff_media_barca < soglia]
+    return [
+        _alert("efficienza", "⚠️",
+               f"<b>Barca {b}</b> con efficienza media mensile bassa: {e:.1f} €/litro (sotto soglia dinamica {soglia:.1f} €/litro)",
+               oggetto=b, valore=e, soglia=soglia)
+        for b, e in sotto.items()
+    ]
+
+def _regola_top_performer(ctx, soglie):
+    top = ctx["per_barca"]["Incasso"].sort_values(ascending=False)
+    if len(top) == 0:
+        return []
+    return [_alert("top_performer", "🏅", f"<b>Top performer:</b> {top.index[0]} ({top.iloc[0]:,.0f}€)",
+                   oggetto=top.index[0], valore=top.iloc[0])]
+
+def _regola_trend(ctx, soglie):
+    mensile = ctx["mensile"]
+    chiave_mese = mensile["Anno"] * 12 + mensile["MeseNum"]
+    mesi_ordine = np.sort(chiave_mese.unique())
+    if len(mesi_ordine) < 2:
+        return []
+    incasso = mensile.assign(Chiave=chiave_mese).set_index(["Chiave", "Barca_Normalizzata"])["Incasso"]
+    att = incasso.xs(mesi_ordine[-1], level="Chiave")
+    prev = incasso.xs(mesi_ordine[-2], level="Chiave")
+    confronto = pd.concat([att.rename("att"), prev.rename("prev")], axis=1, join="inner")
+    in_calo = confronto[confronto["att"] < confronto["prev"] * soglie["trend_calo"]]
+    calo_pct = (1 - soglie["trend_calo"]) * 100
+    return [
+        _alert("trend", "📉",
+               f"<b>Trend in calo:</b> {b} ha avuto un incasso inferiore del {calo_pct:.0f}% rispetto al mese precedente.",
+               oggetto=b, valore=r["att"], soglia=r["prev"] * soglie["trend_calo"])
+        for b, r in in_calo.iterrows()
+    ]
+
+def _regola_concentrazione(ctx, soglie):
+    tour_top = ctx["per_durata"].sort_values(ascending=False)
+    incasso_totale = ctx["incasso_totale"]
+    if len(tour_top) == 0 or incasso_totale <= 0:
+        return []
+    quota = tour_top.iloc[0] / incasso_totale
+    if quota <= soglie["concentrazione_quota"]:
+        return []
+    return [_alert("concentrazione", "💡",
+                   f"<b>Attenzione:</b> Il tour <b>{tour_top.index[0]}</b> rappresenta oltre il "
+                   f"{soglie['concentrazione_quota'] * 100:.0f}% dell’incasso totale (scarsa diversificazione).",
+                   oggetto=tour_top.index[0], valore=quota, soglia=soglie["concentrazione_quota"])]
+
+def _regola_anomalia_stagionale(ctx, soglie):
+    # Matrice mese × anno: ogni cella è confrontata con la media dello stesso mese negli altri anni
+    piv = ctx["mensile"].groupby(["MeseNum", "Anno"])["Incasso"].sum().unstack("Anno")
+    if piv.shape[1] < 2:
+        return []
+    presenti = piv.notna()
+    n_altri = presenti.sum(axis=1).to_numpy()[:, None] - presenti.to_numpy()
+    corrente = piv.fillna(0).to_numpy()
+    media_altri = np.divide(
+        piv.sum(axis=1).to_numpy()[:, None] - corrente, n_altri,
+        out=np.full(corrente.shape, np.nan), where=n_altri > 0
+    )
+    anomalie = (n_altri >= 1) & (media_altri > 0) & (corrente < media_altri * soglie["anomalia_stagionale"])
+    calo_pct = (1 - soglie["anomalia_stagionale"]) * 100
+    righe, colonne = np.nonzero(anomalie)
+    return [
+        _alert("anomalia_stagionale", "📉",
+               f"<b>{calendar.month_name[piv.index[i]]} {piv.columns[j]} sotto media:</b> incasso inferiore del "
+               f"{calo_pct:.0f}% rispetto alla media dello stesso mese negli anni precedenti.",
+               oggetto=f"{calendar.month_name[piv.index[i]]} {piv.columns[j]}",
+               valore=corrente[i, j], soglia=media_altri[i, j] * soglie["anomalia_stagionale"])
+        for i, j in zip(righe, colonne)
+    ]
+
+def _regola_sottoutilizzo(ctx, soglie):
+    utilizzo = ctx["per_barca"]["Giorni"]
+    media_utilizzo = utilizzo.mean()
+    sotto = utilizzo[utilizzo < soglie["sottoutilizzo_quota"] * media_utilizzo]
+    return [
+        _alert("sottoutilizzo", "⏳",
+               f"<b>Barca {b}</b> sottoutilizzata: attiva solo {giorni} giorni rispetto a una media di {media_utilizzo:.0f} giorni.",
+               oggetto=b, valore=giorni, soglia=soglie["sottoutilizzo_quota"] * media_utilizzo)
+        for b, giorni in sotto.items()
+    ]
+
+def _regola_maltempo(ctx, soglie):
+    tot = ctx["tot"]
+    if tot["Maltempo"].isna().all():
+        return []
+    g = tot.groupby(["Barca_Normalizzata", "Maltempo"])[["Incasso", "Incasso_n"]].sum()
+    medie_meteo = (g["Incasso"] / g["Incasso_n"]).unstack()
+    if not (False in medie_meteo.columns and True in medie_meteo.columns):
+        return []
+    delta = (medie_meteo[True] - medie_meteo[False]) / medie_meteo[False] * 100
+    media_flottante = delta.mean()
+    sensibili = delta[delta < media_flottante - soglie["maltempo_margine"]]
+    return [
+        _alert("maltempo", "🌧️",
+               f"<b>{b}</b> subisce un calo di incasso col maltempo superiore alla media flotta ({d:.0f}% vs {media_flottante:.0f}%).",
+               oggetto=b, valore=d, soglia=media_flottante - soglie["maltempo_margine"])
+        for b, d in sensibili.items()
+    ]
+
+def _regola_giorni_alti(ctx, soglie):
+    per_giorno = ctx["tot"].groupby("TipoGiorno")["Incasso"].sum()
+    incasso_alti = per_giorno.get("Alti", 0)
+    incasso_bassi = per_giorno.get("Bassi", 0)
+    if incasso_alti >= incasso_bassi * soglie["giorni_alti_quota"]:
+        return []
+    return [_alert("giorni_alti", "⚠️",
+                   f"<b>Bassa prenotazione nei giorni ad alta domanda:</b> Incasso giorni alti < "
+                   f"{soglie['giorni_alti_quota'] * 100:.0f}% rispetto ai giorni bassi.",
+                   valore=incasso_alti, soglia=incasso_bassi * soglie["giorni_alti_quota"])]
+
+
+# Regole dichiarative: (famiglia, funzione). L'ordine è quello di visualizzazione.
+REGOLE_ALERT = [
+    ("efficienza", _regola_efficienza),
+    ("top_performer", _regola_top_performer),
+    ("trend", _regola_trend),
+    ("concentrazione", _regola_concentrazione),
+    ("anomalia_stagionale", _regola_anomalia_stagionale),
+    ("sottoutilizzo", _regola_sottoutilizzo),
+    ("maltempo", _regola_maltempo),
+    ("giorni_alti", _regola_giorni_alti),
+]
+
+def contesto_alert(df_kpi):
+    # Parte pesante degli alert, indipendente dalle soglie: aggregato e tabelle derivate
+    agg = aggregato_alert(df_kpi)
+    tot = agg[agg["TipoRiga"] == "Totale"]
+    return {
+        "tot": tot,
+        "mensile": tot.groupby(["Barca_Normalizzata", "Anno", "MeseNum"])[["Incasso", "Gasolio"]].sum().reset_index(),
+        "per_barca": tot.groupby("Barca_Normalizzata").agg(Incasso=("Incasso", "sum"), Giorni=("Data", "nunique")),
+        "per_durata": agg.groupby("Durata")["Incasso"].sum(),
+        "incasso_totale": agg["Incasso"].sum(),
+    }
+
+def calcola_alert(df_kpi, soglie=None, famiglie=None, ctx=None):
+    """
+    Valuta tutte le regole di alert partendo da un unico aggregato.
+    soglie: override parziale di SOGLIE_ALERT; famiglie: sottoinsieme di regole da valutare;
+    ctx: contesto già calcolato con contesto_alert (evita di ripassare su df_kpi).
+    Ritorna una lista di Alert (famiglia, icona, oggetto, valore, soglia, messaggio).
+    """
+    soglie = {**SOGLIE_ALERT, **(soglie or {})}
+    if ctx is None:
+        ctx = contesto_alert(df_kpi)
+    alert = []
+    for famiglia, regola in REGOLE_ALERT:
+        if famiglie is None or famiglia in famiglie:
+            alert.extend(regola(ctx, soglie))
+    return alert
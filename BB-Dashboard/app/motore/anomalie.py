@@ -0,0 +1,98 @@
+"""Giorni anomali per barca: z-score robusti rolling (mediana/MAD), anche incrementali."""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+METRICHE_ANOMALIE = ["Incasso", "Clienti", "Gasolio"]
+
+def serie_giornaliera_barche(df):
+    # Una riga per (barca, giorno) dalle righe Totale; NaN se la metrica manca in tutto il giorno
+    df_tot = df[df["TipoRiga"] == "Totale"]
+    return (
+        df_tot.groupby(["Barca_Normalizzata", df_tot["Data"].dt.normalize().rename("Data")])[METRICHE_ANOMALIE]
+        .sum(min_count=1)
+        .sort_index()
+    )
+
+def _z_robusti(valori, inizio_gruppo, finestra, min_osservazioni, blocco=20000):
+    # Z-score robusto di ogni riga rispetto alle `finestra` osservazioni precedenti della stessa
+    # barca: (x - mediana) / (1.4826 · MAD). Tutte le barche insieme, a blocchi di righe.
+    n, k = valori.shape
+    z = np.full((n, k), np.nan)
+    passi = np.arange(1, finestra + 1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)  # finestre vuote → NaN
+        for start in range(0, n, blocco):
+            righe = np.arange(start, min(start + blocco, n))
+            idx = righe[:, None] - passi[None, :]
+            valido = idx >= inizio_gruppo[righe][:, None]
+            fin = valori[np.where(valido, idx, 0)]
+            fin[~valido] = np.nan
+            mediana = np.nanmedian(fin, axis=1)
+            mad = 1.4826 * np.nanmedian(np.abs(fin - mediana[:, None, :]), axis=1)
+            n_oss = (~np.isnan(fin)).sum(axis=1)
+            ok = (mad > 0) & (n_oss >= min_osservazioni)
+            z[righe] = np.where(ok, (valori[righe] - mediana) / np.where(ok, mad, 1), np.nan)
+    return z
+
+def calcola_anomalie(serie, finestra=28, min_osservazioni=10):
+    """
+    Z-score robusti rolling (mediana/MAD) per incasso, clienti e gasolio di ogni barca,
+    calcolati in un solo passaggio vettoriale su tutte le barche.
+    serie: output di serie_giornaliera_barche. Ritorna le stesse righe con le colonne z_<metrica>.
+    """
+    if serie.empty:
+        return serie.assign(**{f"z_{m}": pd.Series(dtype=float) for m in METRICHE_ANOMALIE})
+    codici = pd.factorize(serie.index.get_level_values("Barca_Normalizzata"))[0]
+    nuovo_gruppo = np.r_[True, codici[1:] != codici[:-1]]
+    inizio_gruppo = np.maximum.accumulate(np.where(nuovo_gruppo, np.arange(len(codici)), 0))
+    z = _z_robusti(serie[METRICHE_ANOMALIE].to_numpy(dtype=float), inizio_gruppo, finestra, min_osservazioni)
+    risultato = serie.copy()
+    for i, m in enumerate(METRICHE_ANOMALIE):
+        risultato[f"z_{m}"] = z[:, i]
+    return risultato
+
+def impronte_giornaliere(df):
+    # Impronta di ogni (barca, giorno): somma degli hash delle sue righe Totale, indipendente dall'ordine
+    df_tot = df[df["TipoRiga"] == "Totale"]
+    hash_righe = pd.util.hash_pandas_object(df_tot[["Barca_Normalizzata", "Data", *METRICHE_ANOMALIE]], index=False)
+    return hash_righe.groupby([df_tot["Barca_Normalizzata"], df_tot["Data"].dt.normalize().rename("Data")]).sum().sort_index()
+
+def aggiorna_anomalie(stato, df, versione=None, finestra=28, min_osservazioni=10):
+    """
+    Aggiornamento incrementale dal registro `df`. Con la stessa `versione` dello stato non
+    ricalcola nulla; altrimenti confronta le impronte dei giorni con quelle già elaborate e, per
+    ogni barca, riaggrega e ricalcola solo dal primo giorno nuovo, modificato o rimosso in poi,
+    con le `finestra` osservazioni precedenti come contesto.
+    Ritorna il nuovo stato: {"versione", "impronte", "risultati"}.
+    """
+    if stato and versione is not None and stato["versione"] == versione:
+        return stato
+    impronte = impronte_giornaliere(df)
+    if not stato:
+        return {"versione": versione, "impronte": impronte,
+                "risultati": calcola_anomalie(serie_giornaliera_barche(df), finestra, min_osservazioni)}
+
+    # Giorni nuovi o modificati (impronta diversa) e giorni spariti dal registro
+    # (impronta 0 = giorno assente; il confronto resta in uint64 senza passare dai float)
+    tutte = stato["impronte"].index.union(impronte.index)
+    diverse = stato["impronte"].reindex(tutte, fill_value=0).to_numpy() != impronte.reindex(tutte, fill_value=0).to_numpy()
+    if not diverse.any():
+        return {**stato, "versione": versione}
+    cambiati = tutte[diverse].to_frame(index=False)
+    da_data = cambiati.groupby("Barca_Normalizzata")["Data"].min()
+
+    # Riaggrego solo le righe delle barche toccate a partire dal loro primo giorno cambiato
+    soglia = df["Barca_Normalizzata"].map(da_data)
+    serie_nuova = serie_giornaliera_barche(df[df["Data"].dt.normalize() >= soglia])
+
+    precedenti = stato["risultati"]
+    soglia_prec = precedenti.index.get_level_values("Barca_Normalizzata").map(da_data)
+    da_rifare = np.asarray(precedenti.index.get_level_values("Data") >= soglia_prec, dtype=bool)  # NaT → False
+    tenuti = precedenti[~da_rifare]
+    coda = (tenuti[tenuti.index.get_level_values("Barca_Normalizzata").isin(da_data.index)][METRICHE_ANOMALIE]
+            .groupby(level="Barca_Normalizzata").tail(finestra))
+    contesto = pd.concat([coda, serie_nuova]).sort_index()
+    nuove = calcola_anomalie(contesto, finestra, min_osservazioni).loc[serie_nuova.index]
+    return {"versione": versione, "impronte": impronte, "risultati": pd.concat([tenuti, nuove]).sort_index()}
@@ -0,0 +1,50 @@
+"""Cache LRU in memoria limitata in byte, condivisa tra thread."""
+import threading
+from collections import OrderedDict
+
+class CacheLRU:
+    """
+    Cache LRU limitata in byte, thread-safe: valori str/bytes, ingombro = len(valore).
+    Usata per i grafici serializzati e i report PDF della dashboard e per le risposte dell'API.
+    """
+
+    def __init__(self, max_byte):
+        self.max_byte = max_byte
+        self.byte = 0
+        self.hit = 0
+        self.miss = 0
+        self._voci = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chiave):
+        with self._lock:
+            valore = self._voci.get(chiave)
+            if valore is None:
+                self.miss += 1
+                return None
+            self._voci.move_to_end(chiave)
+            self.hit += 1
+            return valore
+
+    def put(self, chiave, valore):
+        if len(valore) > self.max_byte:
+            return
+        with self._lock:
+            vecchio = self._voci.pop(chiave, None)
+            if vecchio is not None:
+                self.byte -= len(vecchio)
+            self._voci[chiave] = valore
+            self.byte += len(valore)
+            while self.byte > self.max_byte:
+                _, rimosso = self._voci.popitem(last=False)
+                self.byte -= len(rimosso)
+
+    def voci(self):
+        # (chiave, byte) dalla meno recente alla più recente
+        with self._lock:
+            return [(chiave, len(valore)) for chiave, valore in self._voci.items()]
+
+    def svuota(self):
+        with self._lock:
+            self._voci.clear()
+            self.byte = 0
@@ -0,0 +1,271 @@
+"""Caricamento dei dati: registro incassi, meteo, spese e impronta di versione."""
+import glob
+import hashlib
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from . import profilo
+
+# Registro barche: abbreviazioni usate nelle righe Dettaglio, nomi completi e aree
+ABBREV_TO_FULL = {
+    "Bel": "Beluga", "Lib": "Libera", "Ghi": "Ghibli", "Mag": "Magia", "Kia": "Kiar di Luna",
+    "Bec": "Become", "Ete": "Eternity", "Col": "Columbus", "Can": "Candido", "Vir": "Virgilio", "Riv": "Riva"
+}
+FULL_NAMES = set([
+    "Beluga", "Libera", "Ghibli", "Magia", "Kiar di Luna", "Become",
+    "Eternity", "L’Aurora", "L'Aurora", "Columbus", "Candido", "Virgilio", "Riva"
+])
+AREE_BARCHE = {
+    "Sirmione": ["Beluga", "Libera", "Ghibli", "Magia", "Kiar di Luna", "Become"],
+    "Desenzano": ["Eternity", "L’Aurora"],
+    "BSD": ["Columbus"],
+    "Exclusive": ["Candido", "Virgilio"],
+    "Riva": ["Riva"]
+}
+
+def carica_dati(cartella="."):
+    """Fatti giornalieri dai file crmboats_taxi*.xlsx: righe Totale/Dettaglio normalizzate per barca e area."""
+    files = sorted(glob.glob(os.path.join(cartella, "crmboats_taxi*.xlsx")))
+    dfs = []
+    for file in files:
+        with profilo.intervallo(f"excel:{os.path.basename(file)}") as intervallo:
+            xls = pd.ExcelFile(file)
+            intervallo.righe = 0
+            for nome_foglio in xls.sheet_names:
+                nome_clean = str(nome_foglio).strip().lower().replace("<", "").replace(">", "")
+                if any(x in nome_clean for x in ["totale", "totali", "sintesi", "legenda"]):
+                    continue
+                tmp = pd.read_excel(xls, sheet_name=nome_foglio, skiprows=2, usecols="B:I")
+                if tmp.shape[0] > 0:
+                    tmp = tmp.iloc[:-1]  # Escludi ultima riga (totale mensile)
+                col_data = tmp.columns[0]
+                tmp = tmp.rename(columns={col_data: "Data"})
+                tmp["MeseFoglio"] = nome_foglio
+                tmp["AnnoFile"] = os.path.basename(file)
+                dfs.append(tmp)
+                intervallo.righe += len(tmp)
+    if not dfs:
+        return pd.DataFrame()
+
+    df = pd.concat(dfs, ignore_index=True)
+    df["Data"] = pd.to_datetime(df["Data"], errors="coerce", dayfirst=True).ffill()
+
+    col_durata = df.columns[2]
+    col_clienti = df.columns[3]
+    col_barca = df.columns[4]
+    col_dip = df.columns[5]
+    col_incasso = df.columns[6]
+    col_gasolio = df.columns[7]
+
+    dipendente = df[col_dip]
+    df["TipoRiga"] = np.where(dipendente.notna() & (dipendente.astype(str).str.strip() != ""), "Totale", "Dettaglio")
+    df["Incasso"] = pd.to_numeric(df[col_incasso].replace({r"[€]": ""}, regex=True).str.replace(",", "."), errors="coerce")
+    df["Gasolio"] = pd.to_numeric(df[col_gasolio].replace({r"[€]": ""}, regex=True).str.replace(",", "."), errors="coerce")
+    df["Clienti"] = pd.to_numeric(df[col_clienti], errors="coerce")
+    df["Durata"] = df[col_durata]
+    df["Dipendente"] = df[col_dip]
+
+    # --- Normalizzazione barche: abbreviazioni SOLO su Dettaglio ---
+    nomi_completi = {full.lower(): "L’Aurora" if "aurora" in full.lower() else full for full in FULL_NAMES}
+    nomi_dettaglio = {**nomi_completi, **{abbr.lower(): full for abbr, full in ABBREV_TO_FULL.items()}}
+    barca = df[col_barca]
+    chiave = (
+        barca.where(barca.notna()).astype(str).str.strip()
+        .str.replace("’", "'", regex=False).str.replace("‘", "'", regex=False).str.lower()
+        .where(barca.notna())
+    )
+    df["Barca_Normalizzata"] = np.where(
+        df["TipoRiga"] == "Dettaglio", chiave.map(nomi_dettaglio), chiave.map(nomi_completi)
+    )
+
+    # Assegna area
+    df["Area"] = df["Barca_Normalizzata"].map({b: area for area, elenco in AREE_BARCHE.items() for b in elenco})
+    df = df.dropna(subset=["Barca_Normalizzata", "Area"])
+
+    # Colonne derivate
+    df["Anno"] = df["Data"].dt.year
+    oggi = pd.Timestamp(datetime.now().date())
+    df = df[df["Data"] <= oggi]
+    df["TipoGiorno"] = np.where(df["Data"].dt.weekday >= 5, "Alti", "Bassi")
+    dettaglio = (df["TipoRiga"] == "Dettaglio") & df["Clienti"].notna()
+    df["TipoCliente"] = np.select(
+        [dettaglio & (df["Clienti"] <= 5), dettaglio & (df["Clienti"] > 5)], ["Privati", "Gruppo"], default=None
+    )
+
+    return df
+
+@dataclass
+class EsitoMeteo:
+    """Esito del download meteo: giorni scaricati e messaggi di errore per anno."""
+    giorni: int = 0
+    errori: list = field(default_factory=list)
+
+def aggiorna_meteo(df, start_date, end_date):
+    """
+    Aggiunge a df precipitazioni, vento e flag Maltempo (archivio Open-Meteo, blocchi annuali).
+    Ritorna (df, EsitoMeteo); senza dati meteo la colonna Maltempo è NaN.
+    """
+    import requests
+    lat, lon = 45.492, 10.608  # Sirmione
+    anni = list(range(start_date.year, end_date.year + 1))
+    meteo_dfs = []
+    esito = EsitoMeteo()
+    for anno in anni:
+        inizio = max(start_date, pd.Timestamp(f"{anno}-01-01"))
+        fine = min(end_date, pd.Timestamp(f"{anno}-12-31"))
+        url = (
+            f"https://archive-api.open-meteo.com/v1/archive?"
+            f"latitude={lat}&longitude={lon}"
+            f"&start_date={inizio.strftime('%Y-%m-%d')}&end_date={fine.strftime('%Y-%m-%d')}"
+            f"&daily=precipitation_sum,weathercode,windspeed_10m_max"
+            f"&timezone=Europe%2FBerlin"
+        )
+        with profilo.intervallo(f"meteo_http:{anno}") as intervallo:
+            try:
+                r = requests.get(url, timeout=10)
+                r.raise_for_status()
+                resp_json = r.json()
+                if "daily" in resp_json and resp_json["daily"]:
+                    data = resp_json["daily"]
+                    meteo_df = pd.DataFrame(data)
+                    meteo_df["Data"] = pd.to_datetime(meteo_df["time"])
+                    meteo_df["Maltempo"] = (meteo_df["precipitation_sum"] > 3) | (meteo_df["windspeed_10m_max"] > 40)
+                    meteo_dfs.append(meteo_df)
+                    intervallo.righe = len(meteo_df)
+            except Exception as e:
+                esito.errori.append(f"Errore caricamento meteo per il {anno}: {e}")
+                profilo.conta("meteo.errori")
+
+    if not meteo_dfs:
+        if "Maltempo" not in df.columns:
+            df["Maltempo"] = np.nan
+        return df, esito
+
+    meteo_df_tot = pd.concat(meteo_dfs, ignore_index=True)
+    # Merge: normalizza data per evitare problemi di orario
+    df["DataNorm"] = pd.to_datetime(df["Data"]).dt.normalize()
+    meteo_df_tot["DataNorm"] = meteo_df_tot["Data"].dt.normalize()
+    df = pd.merge(
+        df, 
+        meteo_df_tot[["DataNorm", "precipitation_sum", "windspeed_10m_max", "Maltempo"]],
+        left_on="DataNorm", right_on="DataNorm", how="left"
+    )
+    df.drop(columns=["DataNorm"], inplace=True)
+    esito.giorni = len(meteo_df_tot)
+    return df, esito
+
+PERCORSI_SORGENTI = ("crmboats_taxi*.xlsx", "Bertoldi Boats.csv")
+
+def firma_sorgenti(percorsi=PERCORSI_SORGENTI, cartella="."):
+    # (nome, dimensione, mtime) dei file sorgente: cambia se un file viene aggiunto, sostituito o modificato
+    firma = []
+    for pattern in percorsi:
+        for f in sorted(glob.glob(os.path.join(cartella, pattern))):
+            info = os.stat(f)
+            firma.append((os.path.basename(f), info.st_size, int(info.st_mtime)))
+    return tuple(firma)
+
+def versione_dati(df, percorsi=PERCORSI_SORGENTI, cartella="."):
+    # Impronta dei dati caricati: file sorgente (nome, dimensione, mtime) + righe e copertura meteo
+    firma = list(firma_sorgenti(percorsi, cartella))
+    firma.append((len(df), int(df["Maltempo"].notna().sum())))
+    return hashlib.sha1(repr(firma).encode("utf-8")).hexdigest()[:12]
+
+def sola_lettura(df):
+    """
+    Copia di df con un array non scrivibile per colonna (senza consolidare i blocchi):
+    le operazioni pandas ne producono di nuovi, una scrittura sui valori solleva ValueError.
+    """
+    colonne = {}
+    for c in df.columns:
+        serie = df[c]
+        valori = serie.to_numpy(copy=True) if isinstance(serie.dtype, np.dtype) else serie.array.copy()
+        if isinstance(valori, np.ndarray):
+            valori.flags.writeable = False
+        colonne[c] = valori
+    return pd.DataFrame(colonne, index=df.index, copy=False)
+
+@dataclass(frozen=True)
+class FattiCondivisi:
+    """
+    Registro arricchito col meteo, immutabile, identificato da `versione` (versione_dati):
+    caricato una volta per processo e letto da tutte le sessioni attraverso viste.
+    """
+    df: pd.DataFrame
+    versione: str
+    esito: EsitoMeteo
+    creato: float
+
+    def vista(self):
+        # Nessuna copia dei dati: le colonne aggiunte restano nella vista, i valori sono in sola lettura
+        return self.df.copy(deep=False)
+
+def carica_fatti(cartella=".", meteo=True):
+    """carica_dati + aggiorna_meteo in un FattiCondivisi (senza meteo: colonna Maltempo NaN)."""
+    df = carica_dati(cartella)
+    esito = EsitoMeteo()
+    if meteo and not df.empty:
+        df, esito = aggiorna_meteo(df, df["Data"].min(), df["Data"].max())
+    elif "Maltempo" not in df.columns:
+        df["Maltempo"] = np.nan
+    return FattiCondivisi(sola_lettura(df), versione_dati(df, cartella=cartella), esito, time.time())
+
+def carica_spese(path="Bertoldi Boats.csv"):
+    """Registro spese dal CSV con colonne rinominate, date e costi numerici (errori di lettura propagati)."""
+    df_spese = pd.read_csv(path)
+
+    colonne_originali = df_spese.columns.str.strip().str.upper()
+    mapping = {}
+    if "DATA" in colonne_originali:
+        mapping[df_spese.columns[colonne_originali.get_loc("DATA")]] = "Data"
+    if "COSTO" in colonne_originali:
+        mapping[df_spese.columns[colonne_originali.get_loc("COSTO")]] = "Costo"
+    if "TIPO SPESA" in colonne_originali:
+        mapping[df_spese.columns[colonne_originali.get_loc("TIPO SPESA")]] = "Tipo_Spesa"
+    if "FORNITORE" in colonne_originali:
+        mapping[df_spese.columns[colonne_originali.get_loc("FORNITORE")]] = "Fornitore"
+    if "CATEGORIA" in colonne_originali:
+        mapping[df_spese.columns[colonne_originali.get_loc("CATEGORIA")]] = "Categoria"
+    if "DESTINAZIONE" in colonne_originali:
+        mapping[df_spese.columns[colonne_originali.get_loc("DESTINAZIONE")]] = "Destinazione"
+    if "METODO PAGAMENTO" in colonne_originali:
+        mapping[df_spese.columns[colonne_originali.get_loc("METODO PAGAMENTO")]] = "Metodo_Pagamento"
+    df_spese = df_spese.rename(columns=mapping)
+
+    if "Data" in df_spese.columns:
+        df_spese["Data"] = pd.to_datetime(df_spese["Data"], dayfirst=True, errors="coerce")
+    if "Costo" in df_spese.columns:
+        df_spese["Costo"] = (
+            df_spese["Costo"]
+            .astype(str)
+            .str.replace("€", "")
+            .str.replace(".", "")
+            .str.replace(",", ".")
+            .str.strip()
+        )
+        df_spese["Costo"] = pd.to_numeric(df_spese["Costo"], errors="coerce")
+    return df_spese
+
+def classifica_spese(df):
+    df.columns = [c.strip().capitalize() for c in df.columns]
+
+    vuota = pd.Series("", index=df.index)
+    cat = df["Categoria"].fillna("").astype(str).str.lower() if "Categoria" in df.columns else vuota
+    tipo = df["Tipo_spesa"].fillna("").astype(str).str.lower() if "Tipo_spesa" in df.columns else vuota
+
+    def contiene(*parole):
+        return np.logical_or.reduce([cat.str.contains(p, regex=False) for p in parole])
+
+    # Stesso ordine di precedenza delle regole: la prima condizione vera assegna la macro categoria
+    df["MACRO_CATEGORIA"] = np.select(
+        [contiene("acquisto nuovo"), contiene("provvigioni"), contiene("gasolio"), contiene("stipendi", "f24"),
+         (tipo == "fissi") & ~contiene("tasse"), tipo == "variabili"],
+        ["Acquisto nuovo", "Provvigioni", "Gasolio", "Stipendi", "Spese fisse", "Spese variabili"],
+        default="Altro"
+    )
+    return df
@@ -0,0 +1,153 @@
+"""
+Export di tabelle in CSV, Parquet ed Excel, generato a blocchi di righe.
+
+Le righe da esportare si passano come posizioni (ad es. quelle di `indice_filtro`): ogni
+blocco viene estratto, scritto e rilasciato prima del successivo, così anche più stagioni
+di registro non vengono copiate per intero in memoria prima della scrittura.
+"""
+import io
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+FORMATI_EXPORT = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+}
+# Colonne pulite del registro incassi (senza le colonne grezze "Unnamed" degli Excel)
+COLONNE_FATTI = [
+    "Data", "Anno", "Area", "Barca_Normalizzata", "TipoRiga", "TipoGiorno", "TipoCliente", "Durata",
+    "Clienti", "Incasso", "Gasolio", "Dipendente", "Maltempo", "precipitation_sum", "windspeed_10m_max",
+]
+RIGHE_PER_PEZZO = 20_000
+MAX_RIGHE_EXCEL = 1_048_575  # limite di righe di un foglio, esclusa l'intestazione
+
+def _blocchi(df, posizioni, colonne, righe_per_pezzo):
+    indici_colonne = df.columns.get_indexer(colonne)
+    for inizio in range(0, len(posizioni), righe_per_pezzo):
+        yield df.iloc[posizioni[inizio:inizio + righe_per_pezzo], indici_colonne]
+
+def _svuota(buffer):
+    pezzo = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return pezzo
+
+def _csv(blocchi, colonne):
+    buffer = io.StringIO()
+    pd.DataFrame(columns=colonne).to_csv(buffer, index=False)
+    yield _svuota(buffer).encode("utf-8")
+    for blocco in blocchi:
+        blocco.to_csv(buffer, index=False, header=False)
+        yield _svuota(buffer).encode("utf-8")
+
+def schema_arrow(df, colonne):
+    """Schema Arrow fisso per l'export: object con soli booleani → bool, altri object → stringa."""
+    import pyarrow as pa
+
+    campi = []
+    for c in colonne:
+        serie = df[c]
+        if serie.dtype == object:
+            valori = serie.dropna()
+            tipo = pa.bool_() if len(valori) and valori.map(type).eq(bool).all() else pa.string()
+        elif pd.api.types.is_datetime64_any_dtype(serie.dtype):
+            tipo = pa.timestamp("us")
+        else:
+            tipo = pa.from_numpy_dtype(serie.dtype)
+        campi.append(pa.field(str(c), tipo))
+    return pa.schema(campi)
+
+def tabella_arrow(blocco, schema):
+    # Converte un blocco nello schema dato (i tipi misti dei fogli Excel diventano stringhe)
+    import pyarrow as pa
+
+    colonne = {}
+    for campo, c in zip(schema, blocco.columns):
+        serie = blocco[c]
+        if pa.types.is_string(campo.type) and serie.dtype == object:
+            serie = serie.map(lambda v: None if pd.isna(v) else str(v))
+        elif pa.types.is_boolean(campo.type) and serie.dtype == object:
+            serie = serie.astype("boolean")
+        colonne[campo.name] = pa.array(serie, type=campo.type, from_pandas=True)
+    return pa.table(colonne, schema=schema)
+
+def _parquet(blocchi, schema):
+    import pyarrow.parquet as pq
+
+    buffer = io.BytesIO()
+    writer = pq.ParquetWriter(buffer, schema)
+    try:
+        for blocco in blocchi:
+            writer.write_table(tabella_arrow(blocco, schema))
+            yield _svuota(buffer)
+    finally:
+        writer.close()
+    yield buffer.getvalue()
+
+def _cella(v):
+    if v is None or v is pd.NaT or (isinstance(v, float) and np.isnan(v)):
+        return None
+    return v.item() if isinstance(v, np.generic) else v
+
+def _xlsx(blocchi, colonne, foglio):
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(foglio)
+    ws.append([str(c) for c in colonne])
+    for blocco in blocchi:
+        for riga in blocco.itertuples(index=False, name=None):
+            ws.append([_cella(v) for v in riga])
+    # Lo zip dell'xlsx si chiude solo a fine scrittura: il file passa da disco, non dalla RAM
+    with tempfile.TemporaryFile() as f:
+        wb.save(f)
+        f.seek(0)
+        while pezzo := f.read(1 << 20):
+            yield pezzo
+
+def esporta_a_pezzi(df, formato, posizioni=None, colonne=None, righe_per_pezzo=RIGHE_PER_PEZZO, foglio="Dati"):
+    """
+    Genera i byte del file `formato` ("csv", "parquet", "xlsx") con le righe `posizioni` di df
+    (tutte se None) e le `colonne` presenti in df (tutte se None), un blocco di righe alla volta.
+    """
+    if formato not in FORMATI_EXPORT:
+        raise ValueError(f"formato non supportato: {formato!r} (usare {', '.join(FORMATI_EXPORT)})")
+    colonne = list(df.columns) if colonne is None else [c for c in colonne if c in df.columns]
+    posizioni = np.arange(len(df)) if posizioni is None else np.asarray(posizioni)
+    if formato == "xlsx" and len(posizioni) > MAX_RIGHE_EXCEL:
+        raise ValueError(f"{len(posizioni)} righe superano il limite di un foglio Excel: usare CSV o Parquet")
+    blocchi = _blocchi(df, posizioni, colonne, righe_per_pezzo)
+    if formato == "csv":
+        return _csv(blocchi, colonne)
+    if formato == "parquet":
+        return _parquet(blocchi, schema_arrow(df, colonne))
+    return _xlsx(blocchi, colonne, foglio)
+
+def esporta_su_file(df, formato, posizioni=None, colonne=None, foglio="Dati"):
+    """
+    Scrive il file su un file temporaneo un blocco alla volta e lo ritorna riavvolto (per i
+    download della dashboard): i pezzi non vengono mai riuniti in memoria. Il file è senza
+    buffer (io.RawIOBase, letto da Streamlit in una sola lettura) e sparisce alla chiusura.
+    """
+    f = tempfile.TemporaryFile(buffering=0)
+    try:
+        for pezzo in esporta_a_pezzi(df, formato, posizioni, colonne, foglio=foglio):
+            f.write(pezzo)
+    except BaseException:
+        f.close()
+        raise
+    f.seek(0)
+    return f
+
+def tabella_esportabile(tabella):
+    # Tabelle aggregate: l'indice (anche multiplo) diventa colonne, intestazioni in testo
+    if isinstance(tabella, pd.Series):
+        tabella = tabella.to_frame()
+    if not isinstance(tabella.index, pd.RangeIndex) or any(n is not None for n in tabella.index.names):
+        tabella = tabella.reset_index()
+    if isinstance(tabella.columns, pd.MultiIndex):
+        tabella.columns = [" ".join(str(p) for p in c if str(p)) for c in tabella.columns]
+    return tabella.rename(columns=str)
@@ -0,0 +1,181 @@
+"""
+Selezione dei periodi e filtri di contesto: chiavi calendario, confronto tra periodi
+(anche allineato per giorno della settimana) e filtro del registro incassi.
+"""
+import calendar
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+@lru_cache(maxsize=16)
+def indice_allineamento(anno_min, anno_max):
+    """
+    Indice precalcolato: per ogni giorno tra il 1/1 di anno_min e il 31/12 di anno_max, la data
+    corrispondente in ogni stagione con lo stesso giorno della settimana (la più vicina, entro ±3
+    giorni, alla stessa data di calendario; 29/2 → 28/2). Righe = giorni, colonne = anni.
+    Gli spostamenti risultanti sono multipli di 7 giorni (364/371 tra stagioni consecutive).
+    Memorizzato per processo: il DataFrame ritornato è condiviso e non va modificato.
+    """
+    giorni = pd.date_range(f"{anno_min}-01-01", f"{anno_max}-12-31", freq="D")
+    anni = np.arange(anno_min, anno_max + 1)
+    mese = np.repeat(giorni.month.to_numpy()[:, None], len(anni), axis=1)
+    giorno = np.repeat(giorni.day.to_numpy()[:, None], len(anni), axis=1)
+    anno = np.broadcast_to(anni, mese.shape)
+    bisestile = (anno % 4 == 0) & ((anno % 100 != 0) | (anno % 400 == 0))
+    giorno = np.where((mese == 2) & (giorno == 29) & ~bisestile, 28, giorno)
+    stessa_data = pd.to_datetime(pd.DataFrame({
+        "year": anno.ravel(), "month": mese.ravel(), "day": giorno.ravel()
+    })).to_numpy().reshape(mese.shape)
+    giorno_sett = np.repeat(giorni.dayofweek.to_numpy()[:, None], len(anni), axis=1)
+    giorno_sett_stessa = pd.DatetimeIndex(stessa_data.ravel()).dayofweek.to_numpy().reshape(mese.shape)
+    scarto = (giorno_sett - giorno_sett_stessa + 3) % 7 - 3
+    allineate = stessa_data + scarto.astype("timedelta64[D]")
+    return pd.DataFrame(allineate, index=giorni, columns=anni)
+
+def allinea_date(date, anno, indice):
+    # Lookup per posizione: data → data con lo stesso giorno della settimana nella stagione `anno`
+    date = pd.DatetimeIndex(date).normalize()
+    posizioni = (date - indice.index[0]).days.to_numpy()
+    fuori = (posizioni < 0) | (posizioni >= len(indice)) | (anno not in indice.columns)
+    if fuori.all():
+        return pd.DatetimeIndex(np.full(len(date), np.datetime64("NaT"), dtype="datetime64[ns]"))
+    colonna = indice[anno].to_numpy()
+    return pd.DatetimeIndex(np.where(fuori, np.datetime64("NaT"), colonna[np.clip(posizioni, 0, len(indice) - 1)]))
+
+def serie_yoy_allineata(serie_giornaliera, date, anni, indice):
+    """
+    Serie allineata per giorno della settimana: per ogni data dell'intervallo `date` (stagione
+    base) il valore di `serie_giornaliera` nella data corrispondente di ogni stagione in `anni`.
+    Giorni senza attività valgono 0. Ritorna DataFrame con indice `date` e una colonna per anno.
+    """
+    return pd.DataFrame({
+        anno: serie_giornaliera.reindex(allinea_date(date, anno, indice), fill_value=0).to_numpy()
+        for anno in anni
+    }, index=pd.DatetimeIndex(date))
+
+def chiave_calendario(df, tipo, anno_base=None):
+    """
+    Chiave intera del periodo di ogni riga: anno, anno*100 + mese, anno*100 + settimana ISO.
+    Con anno_base (confronto allineato) mese e anno sono quelli della data corrispondente nella
+    stagione base, riportati alla stagione della riga: ogni periodo ha lo stesso mix di giorni.
+    """
+    anno = df["Anno"].to_numpy(dtype=np.int64)
+    if anno_base is not None and tipo in ("annuale", "mensile"):
+        estremi = [anno_base] + ([int(anno.min()), int(anno.max())] if len(anno) else [])
+        corrispondenti = allinea_date(df["Data"], anno_base, indice_allineamento(min(estremi), max(estremi)))
+        anno = anno + corrispondenti.year.to_numpy(dtype=np.int64) - anno_base
+        if tipo == "mensile":
+            return anno * 100 + corrispondenti.month.to_numpy(dtype=np.int64)
+        return anno
+    if tipo == "mensile":
+        return anno * 100 + df["Data"].dt.month.to_numpy(dtype=np.int64)
+    if tipo == "settimanale":
+        return anno * 100 + df["Data"].dt.isocalendar().week.to_numpy(dtype=np.int64)
+    return anno
+
+def anno_base_allineamento(periodo_sel):
+    # Stagione base del confronto allineato (primo periodo scelto), None se non richiesto
+    if periodo_sel.get("allinea") and periodo_sel.get("periodi"):
+        return int(periodo_sel["periodi"][0]["anno"])
+    return None
+
+def chiave_periodo(periodo, tipo):
+    # Stessa chiave di chiave_calendario per un periodo della selezione
+    if tipo == "mensile":
+        return periodo["anno"] * 100 + periodo["mese"]
+    if tipo == "settimanale":
+        return periodo["anno"] * 100 + periodo["settimana"]
+    return periodo["anno"]
+
+def etichetta_periodo(periodo, tipo):
+    if tipo == "mensile":
+        return f"{calendar.month_name[periodo['mese']]} {periodo['anno']}"
+    if tipo == "settimanale":
+        return f"Settimana {periodo['settimana']} {periodo['anno']}"
+    return str(periodo["anno"])
+
+def etichette_confronto(periodo_sel):
+    # Etichette dei periodi in confronto, nell'ordine della selezione
+    return [etichetta_periodo(p, periodo_sel["tipo"]) for p in periodo_sel.get("periodi", [])]
+
+def assegna_periodo(df, periodo_sel):
+    """
+    Colonna 'Periodo' per tutte le righe con un solo lookup vettoriale della chiave
+    calendario sulle chiavi dei periodi scelti; le righe fuori selezione sono "Altro".
+    """
+    tipo = periodo_sel["tipo"]
+    chiavi = pd.Index([chiave_periodo(p, tipo) for p in periodo_sel["periodi"]])
+    posizioni = chiavi.get_indexer(chiave_calendario(df, tipo, anno_base_allineamento(periodo_sel)))
+    etichette = np.array(etichette_confronto(periodo_sel) + ["Altro"], dtype=object)
+    return pd.Series(etichette[posizioni], index=df.index, name="Periodo")
+
+def periodo_da_testo(testo, allinea=False):
+    """
+    Selezione del periodo da testo, nello stesso formato della sidebar: "2025" (anno),
+    "2025-07" (mese), "2025-W28" (settimana ISO). Più periodi separati da virgola sono un
+    confronto, nell'ordine dato (il primo è la base). ValueError se il testo non è valido.
+    """
+    periodi, tipi = [], set()
+    for parte in [p.strip() for p in str(testo).split(",") if p.strip()]:
+        if m := re.fullmatch(r"(\d{4})", parte):
+            tipi.add("annuale")
+            periodi.append({"anno": int(m[1])})
+        elif (m := re.fullmatch(r"(\d{4})-(\d{1,2})", parte)) and 1 <= int(m[2]) <= 12:
+            tipi.add("mensile")
+            periodi.append({"anno": int(m[1]), "mese": int(m[2])})
+        elif (m := re.fullmatch(r"(\d{4})-[Ww](\d{1,2})", parte)) and 1 <= int(m[2]) <= 53:
+            tipi.add("settimanale")
+            periodi.append({"anno": int(m[1]), "settimana": int(m[2])})
+        else:
+            raise ValueError(f"periodo non valido: {parte!r} (usare AAAA, AAAA-MM o AAAA-Wss)")
+    if not periodi:
+        raise ValueError("periodo mancante")
+    if len(tipi) > 1:
+        raise ValueError("i periodi a confronto devono essere dello stesso tipo")
+    tipo = tipi.pop()
+    if len(periodi) == 1:
+        return {"modalita": "analisi", "tipo": tipo, **periodi[0]}
+    periodo_sel = {"modalita": "confronto", "tipo": tipo, "periodi": periodi}
+    if tipo != "settimanale":
+        periodo_sel["allinea"] = bool(allinea)
+    return periodo_sel
+
+def indice_filtro(df, periodo_sel, giorno_sel, tipo_cliente_sel, area_sel, barca_sel=None):
+    """Posizioni (array di interi) delle righe di df che passano i filtri della sidebar."""
+    maschera = np.ones(len(df), dtype=bool)
+    # --- FILTRO PERIODO ---
+    if periodo_sel["modalita"] == "analisi":
+        if periodo_sel["tipo"] == "annuale":
+            maschera &= (df["Anno"] == periodo_sel["anno"]).to_numpy()
+        elif periodo_sel["tipo"] == "mensile":
+            maschera &= ((df["Anno"] == periodo_sel["anno"]) &
+                         (df["Data"].dt.month == periodo_sel["mese"])).to_numpy()
+        elif periodo_sel["tipo"] == "settimanale":
+            maschera &= ((df["Anno"] == periodo_sel["anno"]) &
+                         (df["Data"].dt.isocalendar().week == periodo_sel["settimana"])).to_numpy(dtype=bool, na_value=False)
+    elif periodo_sel["modalita"] == "confronto":
+        chiavi = [chiave_periodo(p, periodo_sel["tipo"]) for p in periodo_sel["periodi"]]
+        chiavi_righe = chiave_calendario(df, periodo_sel["tipo"], anno_base_allineamento(periodo_sel))
+        maschera &= np.isin(chiavi_righe, chiavi)
+    # --- FILTRO GIORNO ---
+    if giorno_sel in ("Alti", "Bassi"):
+        maschera &= (df["TipoGiorno"] == giorno_sel).to_numpy()
+    elif giorno_sel == "Confronto Alti/Bassi":
+        maschera &= df["TipoGiorno"].isin(["Alti", "Bassi"]).to_numpy()
+    # --- FILTRO TIPO CLIENTE ---
+    if tipo_cliente_sel in ("Privati", "Gruppo"):
+        maschera &= (df["TipoCliente"] == tipo_cliente_sel).to_numpy()
+    elif tipo_cliente_sel == "Confronto Privati/Gruppo":
+        maschera &= df["TipoCliente"].isin(["Privati", "Gruppo"]).to_numpy()
+    # --- FILTRO AREA ---
+    if area_sel and area_sel != "Tutte":
+        maschera &= (df["Area"] == area_sel).to_numpy()
+    # --- FILTRO BARCA ---
+    if barca_sel and barca_sel != "Tutte":
+        maschera &= (df["Barca_Normalizzata"] == barca_sel).to_numpy()
+    return np.flatnonzero(maschera)
+
+def filtra_dataframe(df, periodo_sel, giorno_sel, tipo_cliente_sel, area_sel, barca_sel=None):
+    return df.take(indice_filtro(df, periodo_sel, giorno_sel, tipo_cliente_sel, area_sel, barca_sel))
@@ -0,0 +1,230 @@
+"""Forecast di incassi e clienti dell'anno in corso, con breakdown per area."""
+import calendar
+from dataclasses import dataclass
+from datetime import datetime
+
+import pandas as pd
+
+@dataclass
+class RisultatoForecast:
+    oggi: pd.Timestamp
+    aree: list
+    forecast_df: pd.DataFrame         # una riga per mese: reale, forecast e breakdown clienti
+    area_df: pd.DataFrame             # forecast per (mese, area) con le barche attive stimate
+
+def filtra_forecast(df, df_kpi, giorno_sel, tipo_cliente_sel, area, barca):
+    # Il forecast parte sempre dal df globale (tutti gli anni), con i soli filtri di contesto
+    df_forecast = df if df is not None else df_kpi
+    if area and area != "Tutte":
+        df_forecast = df_forecast[df_forecast["Area"] == area]
+    if barca and barca != "Tutte":
+        df_forecast = df_forecast[df_forecast["Barca_Normalizzata"] == barca]
+    if giorno_sel == "Alti":
+        df_forecast = df_forecast[df_forecast["TipoGiorno"] == "Alti"]
+    elif giorno_sel == "Bassi":
+        df_forecast = df_forecast[df_forecast["TipoGiorno"] == "Bassi"]
+    elif giorno_sel == "Confronto Alti/Bassi":
+        df_forecast = df_forecast[df_forecast["TipoGiorno"].isin(["Alti", "Bassi"])]
+    # TipoCliente: solo sulle righe Dettaglio, quindi filtra dopo
+    if tipo_cliente_sel == "Privati":
+        df_forecast = df_forecast[df_forecast["TipoCliente"] == "Privati"]
+    elif tipo_cliente_sel == "Gruppo":
+        df_forecast = df_forecast[df_forecast["TipoCliente"] == "Gruppo"]
+    elif tipo_cliente_sel == "Confronto Privati/Gruppo":
+        df_forecast = df_forecast[df_forecast["TipoCliente"].isin(["Privati", "Gruppo"])]
+    return df_forecast
+
+def calcola_forecast(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area=None, barca=None):
+    """Forecast mensile dell'anno in corso (totale e per area) da df già filtrato con filtra_forecast."""
+    oggi = pd.Timestamp(datetime.now().date())
+    anno_corrente = oggi.year
+
+    # --- Copia base e aggiungi colonne ---
+    df_base = df_kpi.copy()
+    df_base["Mese"] = df_base["Data"].dt.month
+    df_base["Anno"] = df_base["Data"].dt.year
+
+    # --- Filtra area/barca se richiesto ---
+    if area and area != "Tutte":
+        df_base = df_base[df_base["Area"] == area]
+    if barca and barca != "Tutte":
+        df_base = df_base[df_base["Barca_Normalizzata"] == barca]
+    if giorno_sel == "Alti":
+        df_base = df_base[df_base["TipoGiorno"] == "Alti"]
+    elif giorno_sel == "Bassi":
+        df_base = df_base[df_base["TipoGiorno"] == "Bassi"]
+    elif giorno_sel == "Confronto Alti/Bassi":
+        df_base = df_base[df_base["TipoGiorno"].isin(["Alti", "Bassi"])]
+
+    # --- Areelist per breakdown, mesi, stagione ---
+    aree = df_base["Area"].dropna().unique().tolist() if area in [None, "Tutte"] else [area]
+    mesi_bassa = [1, 2, 11, 12]
+    mesi_alta = [m for m in range(1, 13) if m not in mesi_bassa]
+
+    # --- Dati storici e anno corrente ---
+    df_storici = df_base[df_base["Anno"] < anno_corrente]
+    df_anno_corr = df_base[df_base["Anno"] == anno_corrente]
+
+    forecast_rows = []
+    area_rows = []
+
+    # --- Fattore andamento rispetto a storico SOLO sulle righe Dettaglio ---
+    mesi_fino_oggi = list(range(1, oggi.month))
+    incasso_att = df_anno_corr[
+        (df_anno_corr["Mese"].isin(mesi_fino_oggi)) &
+        (df_anno_corr["TipoRiga"] == "Dettaglio")
+    ]["Incasso"].sum()
+    clienti_att = df_anno_corr[
+        (df_anno_corr["Mese"].isin(mesi_fino_oggi)) &
+        (df_anno_corr["TipoRiga"] == "Dettaglio")
+    ]["Clienti"].sum()
+    incasso_storico = df_storici[
+        (df_storici["Mese"].isin(mesi_fino_oggi)) &
+        (df_storici["TipoRiga"] == "Dettaglio")
+    ].groupby("Anno")["Incasso"].sum().mean()
+    clienti_storico = df_storici[
+        (df_storici["Mese"].isin(mesi_fino_oggi)) &
+        (df_storici["TipoRiga"] == "Dettaglio")
+    ].groupby("Anno")["Clienti"].sum().mean()
+    fattore_incasso = incasso_att / incasso_storico if incasso_storico > 0 else 1
+    fattore_clienti = clienti_att / clienti_storico if clienti_storico > 0 else 1
+
+    # --- STEP 1: calcola barche attive mese/area ---
+    n_barche_attive_area = {}
+    for a in aree:
+        n_barche_attive_area[a] = {}
+        # BASSA stagione (media storica)
+        for mese in mesi_bassa:
+            n_storico = df_storici[(df_storici["Area"] == a) & (df_storici["Mese"] == mese)].groupby("Anno")["Barca_Normalizzata"].nunique().mean()
+            n_barche_attive_area[a][mese] = int(round(n_storico)) if pd.notnull(n_storico) else 0
+        # ALTA stagione (max fino a oggi, storici e anno corrente)
+        max_barche_alta = 0
+        for mese in mesi_alta:
+            n_corr = df_anno_corr[(df_anno_corr["Area"] == a) & (df_anno_corr["Mese"] == mese) & (df_anno_corr["Data"] <= oggi)]["Barca_Normalizzata"].nunique()
+            n_storico = df_storici[(df_storici["Area"] == a) & (df_storici["Mese"] == mese)].groupby("Anno")["Barca_Normalizzata"].nunique().mean()
+            max_barche_alta = max(max_barche_alta, int(n_corr), int(round(n_storico)) if pd.notnull(n_storico) else 0)
+            n_barche_attive_area[a][mese] = max_barche_alta
+        for mese in range(min(mesi_alta), 11):  # marzo-ottobre
+            n_barche_attive_area[a][mese] = max_barche_alta
+
+    # --- STEP 2: previsione mese per mese ---
+    for mese in range(1, 13):
+        mese_nome = calendar.month_name[mese]
+        n_barche_totali = sum([n_barche_attive_area[a][mese] for a in aree])
+
+        # --- DATI REALI, PREVISIONALI O MISTI ---
+        if mese < oggi.month:
+            # Dato reale: sempre dalle righe Totale
+            incasso = df_base[(df_base["Anno"] == anno_corrente) & (df_base["Mese"] == mese) & (df_base["TipoRiga"] == "Totale")]["Incasso"].sum()
+            clienti = df_base[(df_base["Anno"] == anno_corrente) & (df_base["Mese"] == mese) & (df_base["TipoRiga"] == "Totale")]["Clienti"].sum()
+            tipo = "DATO REALE"
+            # Breakdown Privati/Gruppo SOLO Dettaglio!
+            priv = df_base[(df_base["Anno"] == anno_corrente) & (df_base["Mese"] == mese) & (df_base["TipoRiga"] == "Dettaglio") & (df_base["TipoCliente"] == "Privati")]
+            gruppo = df_base[(df_base["Anno"] == anno_corrente) & (df_base["Mese"] == mese) & (df_base["TipoRiga"] == "Dettaglio") & (df_base["TipoCliente"] == "Gruppo")]
+            incasso_priv = priv["Incasso"].sum()
+            clienti_priv = priv["Clienti"].sum()
+            incasso_gruppo = gruppo["Incasso"].sum()
+            clienti_gruppo = gruppo["Clienti"].sum()
+        elif mese == oggi.month:
+            # Parte reale + previsione giorni mancanti
+            giorni_del_mese = pd.Period(f"{anno_corrente}-{mese:02d}").days_in_month
+            giorni_passati = oggi.day
+            giorni_mancanti = giorni_del_mese - giorni_passati
+
+            # Reale
+            df_giorni_passati = df_anno_corr[(df_anno_corr["Mese"] == mese) & (df_anno_corr["Data"].dt.day <= oggi.day)]
+            incasso_reale = df_giorni_passati[df_giorni_passati["TipoRiga"] == "Totale"]["Incasso"].sum()
+            clienti_reale = df_giorni_passati[df_giorni_passati["TipoRiga"] == "Totale"]["Clienti"].sum()
+
+            priv_reale = df_giorni_passati[(df_giorni_passati["TipoRiga"] == "Dettaglio") & (df_giorni_passati["TipoCliente"] == "Privati")]
+            gruppo_reale = df_giorni_passati[(df_giorni_passati["TipoRiga"] == "Dettaglio") & (df_giorni_passati["TipoCliente"] == "Gruppo")]
+            incasso_priv_reale = priv_reale["Incasso"].sum()
+            clienti_priv_reale = priv_reale["Clienti"].sum()
+            incasso_gruppo_reale = gruppo_reale["Incasso"].sum()
+            clienti_gruppo_reale = gruppo_reale["Clienti"].sum()
+
+            # Previsione
+            storici_mese = df_storici[(df_storici["Mese"] == mese) & (df_storici["TipoRiga"] == "Dettaglio")]
+            media_incasso_anno = storici_mese.groupby("Anno")["Incasso"].sum().mean() if n_barche_totali > 0 else 0
+            media_clienti_anno = storici_mese.groupby("Anno")["Clienti"].sum().mean() if n_barche_totali > 0 else 0
+            media_incasso_giornaliero = media_incasso_anno / giorni_del_mese if giorni_del_mese else 0
+            media_clienti_giornaliero = media_clienti_anno / giorni_del_mese if giorni_del_mese else 0
+
+            incasso_previsto = media_incasso_giornaliero * giorni_mancanti * fattore_incasso * n_barche_totali / max(n_barche_totali, 1)
+            clienti_previsti = media_clienti_giornaliero * giorni_mancanti * fattore_clienti * n_barche_totali / max(n_barche_totali, 1)
+
+            # Proporzioni storiche breakdown
+            tot_storico = storici_mese["Incasso"].sum()
+            if tot_storico > 0:
+                incasso_priv_storico = storici_mese[storici_mese["TipoCliente"] == "Privati"]["Incasso"].sum()
+                incasso_gruppo_storico = storici_mese[storici_mese["TipoCliente"] == "Gruppo"]["Incasso"].sum()
+                p_priv = incasso_priv_storico / tot_storico
+                p_gruppo = incasso_gruppo_storico / tot_storico
+            else:
+                p_priv = 0.5
+                p_gruppo = 0.5
+
+            incasso_priv_prev = incasso_previsto * p_priv
+            incasso_gruppo_prev = incasso_previsto * p_gruppo
+            clienti_priv_prev = clienti_previsti * p_priv
+            clienti_gruppo_prev = clienti_previsti * p_gruppo
+
+            # Somma parte reale + previsionale
+            incasso = incasso_reale + incasso_previsto
+            clienti = clienti_reale + clienti_previsti
+            incasso_priv = incasso_priv_reale + incasso_priv_prev
+            incasso_gruppo = incasso_gruppo_reale + incasso_gruppo_prev
+            clienti_priv = clienti_priv_reale + clienti_priv_prev
+            clienti_gruppo = clienti_gruppo_reale + clienti_gruppo_prev
+
+            tipo = "PARTE REALE + PREVISIONE"
+
+
+        else:
+            # Solo previsione futura
+            storici_mese = df_storici[(df_storici["Mese"] == mese) & (df_storici["TipoRiga"] == "Dettaglio")]
+            media_incasso_anno = storici_mese.groupby("Anno")["Incasso"].sum().mean() if n_barche_totali > 0 else 0
+            media_clienti_anno = storici_mese.groupby("Anno")["Clienti"].sum().mean() if n_barche_totali > 0 else 0
+
+            incasso = media_incasso_anno * fattore_incasso * n_barche_totali / max(n_barche_totali, 1)
+            clienti = media_clienti_anno * fattore_clienti * n_barche_totali / max(n_barche_totali, 1)
+            tipo = "PREVISIONE"
+
+            tot_storico = storici_mese["Incasso"].sum()
+            if tot_storico > 0:
+                incasso_priv_storico = storici_mese[storici_mese["TipoCliente"] == "Privati"]["Incasso"].sum()
+                incasso_gruppo_storico = storici_mese[storici_mese["TipoCliente"] == "Gruppo"]["Incasso"].sum()
+                p_priv = incasso_priv_storico / tot_storico
+                p_gruppo = incasso_gruppo_storico / tot_storico
+            else:
+                p_priv = 0.5
+                p_gruppo = 0.5
+            incasso_priv = incasso * p_priv
+            incasso_gruppo = incasso * p_gruppo
+            clienti_priv = clienti * p_priv
+            clienti_gruppo = clienti * p_gruppo
+
+        forecast_rows.append({
+            "Mese": mese_nome,
+            "Barche attive stimate": n_barche_totali,
+            "Incasso previsto": incasso,
+            "Clienti previsti": clienti,
+            "Incasso privati": incasso_priv,
+            "Clienti privati": clienti_priv,
+            "Incasso gruppo": incasso_gruppo,
+            "Clienti gruppo": clienti_gruppo,
+            "Tipo dato": tipo
+        })
+
+        # Dettaglio area (opzionale: breakdown area)
+        for a in aree:
+            area_rows.append({
+                "Mese": mese_nome,
+                "Area": a,
+                "Barche attive stimate": n_barche_attive_area[a][mese],
+            })
+
+    return RisultatoForecast(
+        oggi=oggi, aree=aree,
+        forecast_df=pd.DataFrame(forecast_rows), area_df=pd.DataFrame(area_rows),
+    )
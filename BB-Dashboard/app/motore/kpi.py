@@ -0,0 +1,137 @@
+"""KPI dell'intestazione e rollup gerarchici Home > Area > Barca delle righe Totale."""
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from .filtri import anno_base_allineamento, chiave_periodo
+
+GRANE_ROLLUP = ("giorno", "settimana", "mese")
+_METRICHE_ROLLUP = ["Incasso", "Tour", "Clienti", "ClientiN", "Gasolio"]
+
+def rollup_gerarchici(df):
+    """
+    Rollup materializzati delle righe Totale per ogni nodo della gerarchia Home > Area > Barca
+    e per grana giorno / settimana ISO / mese, calcolati tutti insieme.
+    Ritorna {"nodi": {(grana, nodo): DataFrame}, "figli": {nodo: [nodi]}, "area_barca": {barca: area}};
+    nodo = ("Home",), ("Home", area) o ("Home", area, barca). Ogni DataFrame è indicizzato per
+    (Periodo, TipoGiorno) con somme e conteggi: drill-down e drill-up sono lookup su dizionario.
+    """
+    tot = df[df["TipoRiga"] == "Totale"]
+    giorno = (
+        tot.groupby(["Area", "Barca_Normalizzata", "TipoGiorno", tot["Data"].dt.normalize().rename("Giorno")])
+        .agg(Incasso=("Incasso", "sum"), Tour=("Incasso", "size"), Clienti=("Clienti", "sum"),
+             ClientiN=("Clienti", "count"), Gasolio=("Gasolio", "sum"))
+        .reset_index()
+    )
+    anno = giorno["Giorno"].dt.year
+    giorno["giorno"] = giorno["Giorno"]
+    giorno["settimana"] = anno * 100 + giorno["Giorno"].dt.isocalendar().week.astype(int)
+    giorno["mese"] = anno * 100 + giorno["Giorno"].dt.month
+
+    nodi = {}
+    livelli = [([], lambda k: ("Home",)),
+               (["Area"], lambda k: ("Home", k[0])),
+               (["Area", "Barca_Normalizzata"], lambda k: ("Home", k[0], k[1]))]
+    for grana in GRANE_ROLLUP:
+        for chiavi, nodo in livelli:
+            agg = giorno.groupby(chiavi + [grana, "TipoGiorno"])[_METRICHE_ROLLUP].sum()
+            agg.index = agg.index.set_names("Periodo", level=grana)
+            if not chiavi:
+                nodi[(grana, nodo(()))] = agg
+                continue
+            for k, parte in agg.groupby(level=chiavi if len(chiavi) > 1 else chiavi[0]):
+                k = k if isinstance(k, tuple) else (k,)
+                nodi[(grana, nodo(k))] = parte.droplevel(chiavi)
+
+    area_barca = giorno.drop_duplicates("Barca_Normalizzata").set_index("Barca_Normalizzata")["Area"].to_dict()
+    figli = {("Home",): [("Home", a) for a in sorted(giorno["Area"].unique())]}
+    for barca, area in sorted(area_barca.items()):
+        figli.setdefault(("Home", area), []).append(("Home", area, barca))
+    return {"nodi": nodi, "figli": figli, "area_barca": area_barca}
+
+def nodo_rollup(rollup, area=None, barca=None):
+    # Nodo della gerarchia per i filtri area/barca (la barca implica la sua area)
+    if barca and barca != "Tutte":
+        area_barca = rollup["area_barca"].get(barca)
+        if area_barca is None or (area and area != "Tutte" and area != area_barca):
+            return None
+        return ("Home", area_barca, barca)
+    if area and area != "Tutte":
+        return ("Home", area)
+    return ("Home",)
+
+def genitore_rollup(nodo):
+    return nodo[:-1] if len(nodo) > 1 else None
+
+def righe_rollup(rollup, nodo, periodo_sel, giorno_sel):
+    """
+    Righe del rollup del nodo per periodo e tipo di giornata, senza ripassare sui dati grezzi.
+    None se la selezione non è servibile dai rollup (confronto allineato per giorno della settimana).
+    """
+    if nodo is None or anno_base_allineamento(periodo_sel) is not None:
+        return None
+    tipo = periodo_sel["tipo"]
+    grana = "settimana" if tipo == "settimanale" else "mese"
+    tabella = rollup["nodi"].get((grana, nodo))
+    if tabella is None:
+        return pd.DataFrame(columns=_METRICHE_ROLLUP)
+    if periodo_sel["modalita"] == "analisi":
+        periodi = [{k: v for k, v in periodo_sel.items() if k in ("anno", "mese", "settimana")}]
+    else:
+        periodi = periodo_sel["periodi"]
+    chiavi = tabella.index.get_level_values("Periodo")
+    if tipo == "annuale":
+        maschera = np.isin(chiavi // 100, [int(p["anno"]) for p in periodi])
+    else:
+        maschera = np.isin(chiavi, [chiave_periodo(p, tipo) for p in periodi])
+    if giorno_sel in ("Alti", "Bassi"):
+        maschera &= tabella.index.get_level_values("TipoGiorno") == giorno_sel
+    return tabella[maschera]
+
+@dataclass
+class Kpi:
+    """KPI dell'intestazione; figli: {nome nodo: Kpi} del livello inferiore (solo dai rollup)."""
+    incasso_tot: float
+    num_tour: int
+    media_clienti: float
+    efficienza: float
+    figli: dict = field(default_factory=dict)
+
+def kpi_da_righe(righe):
+    # Stesse formule di calcola_kpi, partendo dalle somme del rollup
+    somme = righe[_METRICHE_ROLLUP].sum()
+    return Kpi(
+        incasso_tot=somme["Incasso"],
+        num_tour=int(somme["Tour"]),
+        media_clienti=somme["Clienti"] / somme["ClientiN"] if somme["ClientiN"] > 0 else np.nan,
+        efficienza=somme["Incasso"] / somme["Gasolio"] if somme["Gasolio"] > 0 else np.nan,
+    )
+
+def calcola_kpi(df_filtrato, periodo_selezionato=None, giorno_sel=None, tipo_cliente_sel=None, area=None, barca=None, rollup=None):
+    """
+    KPI dell'intestazione. Con i rollup gerarchici e senza filtro sul tipo cliente (che vale solo
+    sulle righe Dettaglio) i valori escono dal nodo Home/Area/Barca; altrimenti dalle righe Totale.
+    """
+    if rollup is not None and periodo_selezionato is not None and tipo_cliente_sel == "Tutti":
+        nodo = nodo_rollup(rollup, area, barca)
+        righe = righe_rollup(rollup, nodo, periodo_selezionato, giorno_sel)
+        if righe is not None:
+            kpi = kpi_da_righe(righe)
+            kpi.figli = {
+                figlio[-1]: kpi_da_righe(righe_rollup(rollup, figlio, periodo_selezionato, giorno_sel))
+                for figlio in rollup["figli"].get(nodo, [])
+            }
+            return kpi
+    # Usa solo righe Totale per i KPI globali giornalieri
+    df_tot = df_filtrato[df_filtrato["TipoRiga"] == "Totale"]
+    return Kpi(
+        incasso_tot=df_tot["Incasso"].sum(),
+        num_tour=df_tot.shape[0],
+        media_clienti=df_tot["Clienti"].mean(),
+        efficienza=(
+            df_tot["Incasso"].sum() /
+            df_tot["Gasolio"].replace(0, np.nan).sum()
+            if df_tot["Gasolio"].sum() > 0 else np.nan
+        ),
+    )
@@ -0,0 +1,165 @@
+"""Impatto del maltempo: sintesi, sensibilità per barca, Welch t-test e bootstrap."""
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+@dataclass
+class RisultatoMaltempo:
+    df_tot: pd.DataFrame                  # righe con Maltempo noto usate per grafici e test
+    grouping: Optional[str]
+    grouping_label: Optional[str]
+    sintesi: Optional[pd.DataFrame]
+    errore_sintesi: Optional[str]
+    sens_ord: Optional[pd.DataFrame]      # delta % bel tempo/maltempo per barca, ordinato
+    test: pd.DataFrame                    # Welch + intervalli bootstrap per gruppo
+
+def _meteo_per_gruppo(df_tot, grouping, valore="Incasso"):
+    # Righe utili ai test: valore e Maltempo noti, gruppo costante se non c'è grouping
+    d = df_tot[df_tot["Maltempo"].notna() & df_tot[valore].notna()]
+    gruppo = d[grouping] if grouping else pd.Series("Tutti i dati", index=d.index)
+    return gruppo, d["Maltempo"].astype(bool), d[valore].astype(float)
+
+def welch_per_gruppo(df_tot, grouping=None, valore="Incasso"):
+    """
+    Welch t-test bel tempo vs maltempo per tutti i gruppi insieme: statistiche sufficienti
+    (n, media, varianza) da un solo groupby, poi t, gradi di libertà e p in forma vettoriale.
+    Stesso risultato di ttest_ind(buono, brutto, equal_var=False) gruppo per gruppo.
+    """
+    from scipy.stats import t as student_t  # import differito: scipy pesa sull'avvio del motore
+
+    gruppo, maltempo, valori = _meteo_per_gruppo(df_tot, grouping, valore)
+    stats = valori.groupby([gruppo, maltempo]).agg(["count", "mean", "var"]).unstack()
+    # Gruppi con un solo tipo di meteo nel periodo: la colonna mancante diventa NaN (conteggio 0)
+    colonne = pd.MultiIndex.from_product([["count", "mean", "var"], [False, True]])
+    stats = stats.reindex(index=pd.unique(gruppo.dropna()), columns=colonne)
+    n1, n2 = stats[("count", False)].fillna(0), stats[("count", True)].fillna(0)
+    m1, m2 = stats[("mean", False)], stats[("mean", True)]
+    e1, e2 = stats[("var", False)] / n1, stats[("var", True)] / n2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t_stat = (m1 - m2) / np.sqrt(e1 + e2)
+        gdl = (e1 + e2) ** 2 / (e1 ** 2 / (n1 - 1) + e2 ** 2 / (n2 - 1))
+    p_val = 2 * student_t.sf(np.abs(t_stat), gdl)
+    risultato = pd.DataFrame({
+        "n buono": n1.astype(int), "n maltempo": n2.astype(int),
+        "Media buono": m1, "Media maltempo": m2, "Delta medio": m2 - m1,
+        "t": t_stat, "gdl": gdl, "p": p_val,
+    })
+    risultato.index.name = grouping or "Gruppo"
+    return risultato[(risultato["n buono"] > 1) & (risultato["n maltempo"] > 1)]
+
+def bootstrap_delta_meteo(df_tot, grouping=None, valore="Incasso", n_boot=2000, livello=0.95,
+                          seed=42, max_celle=4_000_000):
+    """
+    Intervalli di confidenza bootstrap (percentile) della differenza di media maltempo - bel tempo
+    per ogni gruppo. Tutti i gruppi sono ricampionati insieme: le righe sono ordinate in segmenti
+    contigui (gruppo, meteo), gli indici sono estratti dentro ogni segmento e le medie escono da
+    un unico np.add.reduceat, a blocchi di repliche per limitare la memoria.
+    """
+    gruppo, maltempo, valori = _meteo_per_gruppo(df_tot, grouping, valore)
+    ordinato = pd.DataFrame({"g": gruppo, "m": maltempo, "v": valori}).dropna(subset=["g"]).sort_values(["g", "m"], kind="stable")
+    # Solo i gruppi con giorni di bel tempo e di maltempo: gli altri non hanno una differenza da stimare
+    ordinato = ordinato[ordinato.groupby("g")["m"].transform("nunique") == 2]
+    if ordinato.empty:
+        return pd.DataFrame(columns=["IC basso", "IC alto"])
+    segmenti = ordinato.groupby(["g", "m"], sort=False).size()
+    dimensioni = segmenti.to_numpy()
+    inizi = np.r_[0, np.cumsum(dimensioni)[:-1]]
+    seg_colonna = np.repeat(np.arange(len(dimensioni)), dimensioni)
+    v = ordinato["v"].to_numpy()
+
+    rng = np.random.default_rng(seed)
+    blocco = max(1, max_celle // len(v))
+    medie = np.empty((n_boot, len(dimensioni)))
+    for start in range(0, n_boot, blocco):
+        c = min(blocco, n_boot - start)
+        idx = inizi[seg_colonna] + (rng.random((c, len(v))) * dimensioni[seg_colonna]).astype(np.int64)
+        medie[start:start + c] = np.add.reduceat(v[idx], inizi, axis=1) / dimensioni
+
+    posizione = {k: i for i, k in enumerate(segmenti.index)}
+    alpha = (1 - livello) / 2 * 100
+    righe = {}
+    for g in segmenti.index.get_level_values("g").unique():
+        if (g, False) not in posizione or (g, True) not in posizione:
+            continue
+        delta = medie[:, posizione[(g, True)]] - medie[:, posizione[(g, False)]]
+        righe[g] = np.percentile(delta, [alpha, 100 - alpha])
+    return pd.DataFrame.from_dict(righe, orient="index", columns=["IC basso", "IC alto"])
+
+def calcola_maltempo(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area=None, barca=None):
+    """Impatto del maltempo su incasso e clienti; None senza dati meteo."""
+    if "Maltempo" not in df_kpi.columns or df_kpi["Maltempo"].isna().all():
+        return None
+
+    # --- FILTRO RIGHE IN BASE AL TIPO CLIENTE ---
+    # Solo righe Dettaglio se filtro Privati/Gruppo/Confronto
+    if tipo_cliente_sel in ["Privati", "Gruppo", "Confronto Privati/Gruppo"]:
+        df_kpi = df_kpi[df_kpi["TipoRiga"] == "Dettaglio"]
+    else:
+        df_kpi = df_kpi[df_kpi["TipoRiga"] == "Totale"]
+
+    df_tot = df_kpi[df_kpi["Maltempo"].notna()]
+
+    # --- LOGICA GRUPPI PER ANALISI ---
+    if tipo_cliente_sel == "Confronto Privati/Gruppo":
+        grouping = "TipoCliente"
+        grouping_label = "Privati / Gruppo"
+    elif giorno_sel == "Confronto Alti/Bassi":
+        grouping = "TipoGiorno"
+        grouping_label = "Giorni Alti / Bassi"
+    elif area and area != "Tutte":
+        grouping = "Barca_Normalizzata"
+        grouping_label = f"Barca ({area})"
+    elif area is None or area == "Tutte":
+        grouping = "Area"
+        grouping_label = "Area"
+    else:
+        grouping = None
+        grouping_label = None
+
+    # --- TABELLA SINTESI ---
+    cols = [grouping, "Maltempo"] if grouping else ["Maltempo"]
+    sintesi = df_tot.groupby(cols).agg(
+        Incasso_medio=("Incasso", "mean"),
+        Incasso_totale=("Incasso", "sum"),
+        Tour=("Incasso", "count")
+    ).reset_index()
+
+    errore_sintesi = None
+    if grouping:
+        try:
+            sintesi = sintesi.pivot(index=grouping, columns="Maltempo", values=["Incasso_medio", "Incasso_totale", "Tour"])
+            sintesi.columns = [f"{m}_{'Maltempo' if b else 'Buono'}" for m, b in sintesi.columns]
+            sintesi = sintesi.fillna(0)
+            sintesi["Delta % Incasso medio"] = np.where(
+                sintesi.get("Incasso_medio_Buono", 0) > 0,
+                100*(sintesi.get("Incasso_medio_Maltempo", 0) - sintesi.get("Incasso_medio_Buono", 0))/sintesi.get("Incasso_medio_Buono", 1),
+                np.nan
+            )
+        except Exception as e:
+            errore_sintesi = f"Errore nel calcolo della tabella di sintesi: {e}"
+    else:
+        sintesi["Delta % Incasso medio"] = np.nan
+
+    # --- BARCHE SENSIBILI AL MALTEMPO ---
+    sens_ord = None
+    if grouping == "Barca_Normalizzata":
+        df_sens = df_tot.groupby(["Barca_Normalizzata", "Maltempo"])["Incasso"].mean().unstack()
+        df_sens["Delta %"] = np.where(
+            df_sens.get(False, 0) > 0,
+            100*(df_sens.get(True, 0) - df_sens.get(False, 0))/df_sens.get(False, 1),
+            np.nan
+        )
+        sens_ord = df_sens.sort_values("Delta %")
+
+    # --- TEST STATISTICO ---
+    gruppo_test = grouping if grouping and grouping in df_tot.columns else None
+    test = welch_per_gruppo(df_tot, gruppo_test)
+    if not test.empty:
+        test = test.join(bootstrap_delta_meteo(df_tot, gruppo_test))
+
+    return RisultatoMaltempo(
+        df_tot=df_tot, grouping=grouping, grouping_label=grouping_label,
+        sintesi=sintesi, errore_sintesi=errore_sintesi, sens_ord=sens_ord, test=test,
+    )
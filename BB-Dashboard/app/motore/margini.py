@@ -0,0 +1,129 @@
+"""Conto economico mensile per barca: cubo (Mese, Area, Barca) di ricavi e costi ripartiti."""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+CHIAVI_RIPARTIZIONE = {
+    "Incasso": "in proporzione all'incasso del mese",
+    "Barche": "in parti uguali tra le barche attive nel mese",
+    "Giorni": "in proporzione ai giorni di attività nel mese",
+}
+VOCI_COSTO = ["Gasolio", "Costi fissi", "Costi variabili"]
+
+def voce_spesa(df_spese):
+    # Voce di conto economico di ogni spesa: gasolio, investimenti (acquisti nuovi), fissi, variabili
+    macro = df_spese["MACRO_CATEGORIA"]
+    tipo = df_spese["Tipo_spesa"].astype(str).str.strip().str.lower()
+    return pd.Series(np.select(
+        [macro == "Gasolio", macro == "Acquisto nuovo", tipo == "fissi"],
+        ["Gasolio", "Investimenti", "Costi fissi"], "Costi variabili"
+    ), index=df_spese.index)
+
+def cubo_margini(df, df_spese):
+    """
+    Cubo mensile (Mese = anno*100 + mese, Area, Barca) con ricavi (righe Totale), giorni di
+    attività, costi diretti per voce e spese Azienda ripartite con ognuna delle CHIAVI_RIPARTIZIONE
+    (colonne "Generali <chiave>"). Le spese intestate a destinazioni che non sono barche del
+    registro incassi valgono come spese Azienda; la quota non ripartibile (mesi senza barche
+    attive) e gli investimenti Azienda restano sulla riga ("Azienda", "Non ripartite").
+    Da costruire una volta per versione dei dati: i filtri lo affettano soltanto.
+    """
+    tot = df[df["TipoRiga"] == "Totale"]
+    mese = (tot["Data"].dt.year * 100 + tot["Data"].dt.month).rename("Mese")
+    cubo = tot.groupby([mese, "Area", "Barca_Normalizzata"]).agg(
+        Ricavi=("Incasso", "sum"), Giorni=("Data", "nunique")
+    )
+    cubo.index = cubo.index.set_names("Barca", level="Barca_Normalizzata")
+    area_barca = tot.drop_duplicates("Barca_Normalizzata").set_index("Barca_Normalizzata")["Area"]
+
+    colonne_spese = {"Data", "Costo", "Destinazione", "Tipo_spesa", "MACRO_CATEGORIA"}
+    if df_spese is None or not colonne_spese.issubset(df_spese.columns):
+        spese = pd.DataFrame({
+            "Data": pd.Series(dtype="datetime64[ns]"), "Costo": pd.Series(dtype=float),
+            **{c: pd.Series(dtype=object) for c in ["Destinazione", "Tipo_spesa", "MACRO_CATEGORIA"]}
+        })
+    else:
+        spese = df_spese.dropna(subset=["Data", "Costo"])
+    barca = spese["Destinazione"].astype(str).str.strip().str.replace("'", "’", regex=False).rename("Barca")
+    area_spesa = barca.map(area_barca).rename("Area")
+    diretta = area_spesa.notna().to_numpy()
+    voce = voce_spesa(spese).rename("Voce")
+    mese_spesa = (spese["Data"].dt.year * 100 + spese["Data"].dt.month).rename("Mese")
+
+    if diretta.any():
+        dirette = spese[diretta].groupby(
+            [mese_spesa[diretta], area_spesa[diretta], barca[diretta], voce[diretta]]
+        )["Costo"].sum().unstack("Voce", fill_value=0)
+        cubo = cubo.join(dirette, how="outer")
+    for c in VOCI_COSTO + ["Investimenti", "Ricavi", "Giorni"]:
+        cubo[c] = cubo[c].fillna(0) if c in cubo.columns else 0.0
+
+    # Spese Azienda: pool mensile ripartito sulle barche del mese con ogni chiave
+    generali = spese[~diretta & (voce != "Investimenti").to_numpy()].groupby(mese_spesa[~diretta])["Costo"].sum()
+    investimenti_azienda = spese[~diretta & (voce == "Investimenti").to_numpy()].groupby(mese_spesa[~diretta])["Costo"].sum()
+    mesi_cubo = cubo.index.get_level_values("Mese")
+    pool = generali.reindex(mesi_cubo, fill_value=0).to_numpy()
+    pesi = {
+        "Incasso": cubo["Ricavi"].clip(lower=0),
+        "Barche": (cubo["Giorni"] > 0).astype(float),
+        "Giorni": cubo["Giorni"].astype(float),
+    }
+    residui = {}
+    for chiave, peso in pesi.items():
+        totale_mese = peso.groupby(mesi_cubo).transform("sum").to_numpy()
+        cubo[f"Generali {chiave}"] = np.where(totale_mese > 0, peso.to_numpy() / np.where(totale_mese > 0, totale_mese, 1), 0) * pool
+        residui[chiave] = generali.sub(cubo[f"Generali {chiave}"].groupby(mesi_cubo).sum(), fill_value=0)
+
+    non_ripartite = pd.DataFrame({f"Generali {k}": v for k, v in residui.items()})
+    non_ripartite["Investimenti"] = investimenti_azienda
+    non_ripartite = non_ripartite.fillna(0)
+    non_ripartite = non_ripartite[(non_ripartite.abs() > 0.005).any(axis=1)]
+    if not non_ripartite.empty:
+        non_ripartite.index = pd.MultiIndex.from_arrays(
+            [non_ripartite.index, ["Azienda"] * len(non_ripartite), ["Non ripartite"] * len(non_ripartite)],
+            names=["Mese", "Area", "Barca"]
+        )
+        cubo = pd.concat([cubo, non_ripartite]).fillna(0)
+    return cubo.sort_index()
+
+def mesi_selezione(periodo_sel):
+    # Chiavi mese (anno*100 + mese) della selezione; le settimane ISO valgono per il mese del loro giovedì
+    periodi = periodo_sel["periodi"] if periodo_sel["modalita"] == "confronto" else [periodo_sel]
+    tipo = periodo_sel["tipo"]
+    if tipo == "annuale":
+        return [int(p["anno"]) * 100 + m for p in periodi for m in range(1, 13)]
+    if tipo == "mensile":
+        return [int(p["anno"]) * 100 + int(p["mese"]) for p in periodi]
+    giovedi = [datetime.fromisocalendar(int(p["anno"]), int(p["settimana"]), 4) for p in periodi]
+    return sorted({g.year * 100 + g.month for g in giovedi})
+
+def indice_spese(df_spese, periodo_sel, barche=None):
+    # Posizioni delle spese nei mesi della selezione; con `barche` solo quelle intestate a una di esse
+    mese_spesa = df_spese["Data"].dt.year * 100 + df_spese["Data"].dt.month
+    maschera = np.isin(mese_spesa, mesi_selezione(periodo_sel))
+    if barche is not None and "Destinazione" in df_spese.columns:
+        destinazione = df_spese["Destinazione"].astype(str).str.strip().str.replace("'", "’", regex=False)
+        maschera &= destinazione.isin(barche).to_numpy()
+    return np.flatnonzero(maschera)
+
+def fetta_cubo(cubo, periodo_sel, area=None, barca=None):
+    # Affetta il cubo per mesi della selezione, area e barca (la riga Azienda solo senza filtri)
+    maschera = np.isin(cubo.index.get_level_values("Mese"), mesi_selezione(periodo_sel))
+    if area and area != "Tutte":
+        maschera &= cubo.index.get_level_values("Area") == area
+    if barca and barca != "Tutte":
+        maschera &= cubo.index.get_level_values("Barca") == barca
+    return cubo[maschera]
+
+def conto_economico(fetta, chiave, livello=None):
+    """
+    Conto economico della fetta con la chiave di ripartizione scelta, sommato per `livello`
+    ("Mese", "Area", "Barca" o lista) o in totale se livello è None.
+    """
+    voci = ["Ricavi"] + VOCI_COSTO + [f"Generali {chiave}", "Investimenti"]
+    tabella = fetta[voci].groupby(level=livello).sum() if livello else fetta[voci].sum().to_frame().T
+    tabella = tabella.rename(columns={f"Generali {chiave}": "Spese Azienda"})
+    tabella["Margine di contribuzione"] = tabella["Ricavi"] - tabella[VOCI_COSTO].sum(axis=1)
+    tabella["Margine netto"] = tabella["Margine di contribuzione"] - tabella["Spese Azienda"]
+    return tabella
@@ -0,0 +1,205 @@
+"""
+Contabilità della memoria: dimensione profonda degli oggetti, RSS del processo (corrente e
+di picco durante un intervallo), memoria per sessione e per voce di cache, evizione oltre un tetto.
+"""
+import dataclasses
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+
+# ========== DIMENSIONI ==========
+def _byte_serie(serie, campione):
+    base = int(serie.memory_usage(deep=False, index=False))
+    if serie.dtype != object:
+        return base
+    # Oggetti Python contati uno per uno come fa pandas con deep=True (che però rifiuta gli array
+    # in sola lettura); sulle colonne lunghe la media è stimata su un campione a passo fisso
+    valori = serie.to_numpy()
+    if campione is not None and len(valori) > campione:
+        estratto = valori[::len(valori) // campione]
+        return base + int(sum(map(sys.getsizeof, estratto)) * len(valori) / len(estratto))
+    return base + sum(map(sys.getsizeof, valori))
+
+def dimensione_profonda(obj, campione=2000, _visti=None):
+    """
+    Byte occupati da obj e da ciò che contiene (DataFrame, Series, array, contenitori,
+    dataclass). Con `campione` le colonne object più lunghe sono stimate su `campione` valori;
+    None per il conteggio esatto (più lento: visita ogni stringa).
+    """
+    visti = set() if _visti is None else _visti
+    if id(obj) in visti:
+        return 0
+    visti.add(id(obj))
+    if isinstance(obj, pd.DataFrame):
+        indice = int(obj.index.memory_usage(deep=campione is None))
+        return indice + sum(_byte_serie(obj.iloc[:, i], campione) for i in range(obj.shape[1]))
+    if isinstance(obj, pd.Series):
+        return int(obj.index.memory_usage(deep=campione is None)) + _byte_serie(obj, campione)
+    if isinstance(obj, pd.Index):
+        return int(obj.memory_usage(deep=campione is None))
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool)) or obj is None:
+        return sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(dimensione_profonda(k, campione, visti) + dimensione_profonda(v, campione, visti)
+                                        for k, v in list(obj.items()))
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + sum(dimensione_profonda(v, campione, visti) for v in list(obj))
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return sys.getsizeof(obj) + sum(dimensione_profonda(getattr(obj, f.name), campione, visti)
+                                        for f in dataclasses.fields(obj))
+    if isinstance(obj, Future):  # calcoli già sottomessi a un pool: conta il risultato, se pronto
+        pronto = obj.done() and not obj.cancelled() and obj.exception() is None
+        return sys.getsizeof(obj) + (dimensione_profonda(obj.result(), campione, visti) if pronto else 0)
+    byte = getattr(obj, "byte", None)  # CacheLRU: ingombro già contabilizzato
+    if isinstance(byte, int):
+        return byte
+    return sys.getsizeof(obj)
+
+# ========== RSS DEL PROCESSO ==========
+def _picco_getrusage():
+    try:
+        import resource  # solo Unix
+    except ImportError:
+        return None
+    picco = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return picco if sys.platform == "darwin" else picco * 1024  # macOS in byte, Linux in KiB
+
+def rss_byte():
+    """RSS corrente del processo (Linux: /proc/self/statm; altrove il picco da getrusage, 0 se assente)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):  # os.sysconf non esiste su Windows
+        return _picco_getrusage() or 0
+
+def rss_picco_processo():
+    """Picco di RSS del processo da getrusage; dove manca (Windows) l'RSS corrente."""
+    picco = _picco_getrusage()
+    return picco if picco is not None else rss_byte()
+
+class CampionatoreRss:
+    """
+    Thread che campiona l'RSS a intervalli fissi mentre almeno una misura è aperta:
+    `apri()` ritorna un gettone, `chiudi(gettone)` il massimo RSS visto nel frattempo.
+    """
+
+    def __init__(self, intervallo_s=0.05):
+        self.intervallo_s = intervallo_s
+        self._aperte = {}
+        self._prossimo = 0
+        self._lock = threading.Lock()
+        self._sveglia = threading.Event()
+        threading.Thread(target=self._ciclo, name="bb_rss", daemon=True).start()
+
+    def _ciclo(self):
+        while True:
+            self._sveglia.wait()
+            rss = rss_byte()
+            with self._lock:
+                for gettone, picco in self._aperte.items():
+                    self._aperte[gettone] = max(picco, rss)
+                if not self._aperte:
+                    self._sveglia.clear()
+            time.sleep(self.intervallo_s)
+
+    def apri(self):
+        rss = rss_byte()
+        with self._lock:
+            self._prossimo += 1
+            self._aperte[self._prossimo] = rss
+            self._sveglia.set()
+            return self._prossimo
+
+    def chiudi(self, gettone):
+        rss = rss_byte()
+        with self._lock:
+            return max(self._aperte.pop(gettone, rss), rss)
+
+# ========== CONTABILITÀ PER SESSIONE E PER CACHE ==========
+class ContabilitaMemoria:
+    """
+    Registro di processo: byte per sessione (per nome di oggetto) e per voce di cache.
+    Le sessioni non aggiornate da `ttl_sessione_s` sono considerate chiuse.
+    """
+
+    def __init__(self, ttl_sessione_s=1800):
+        self.ttl_sessione_s = ttl_sessione_s
+        self._sessioni = {}
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def registra_sessione(self, id_sessione, oggetti, rss_picco=None):
+        # oggetti: {nome: byte}; rss_picco: picco di RSS del processo durante l'ultimo rerun
+        with self._lock:
+            self._sessioni[id_sessione] = {"oggetti": dict(oggetti), "rss_picco": rss_picco, "visto": time.time()}
+
+    def registra_cache(self, nome, chiave, byte, max_voci=None):
+        # Da chiamare quando una funzione in cache calcola una nuova voce
+        with self._lock:
+            voci = self._cache.setdefault(nome, OrderedDict())
+            voci.pop(chiave, None)
+            voci[chiave] = int(byte)
+            while max_voci is not None and len(voci) > max_voci:
+                voci.popitem(last=False)  # la cache di Streamlit scarta la voce meno recente
+
+    def dimentica_cache(self, nome):
+        with self._lock:
+            self._cache.pop(nome, None)
+
+    def _pulisci(self):
+        limite = time.time() - self.ttl_sessione_s
+        for id_sessione in [s for s, d in self._sessioni.items() if d["visto"] < limite]:
+            del self._sessioni[id_sessione]
+
+    def sessioni(self):
+        """DataFrame sessione × oggetto con i byte registrati."""
+        with self._lock:
+            self._pulisci()
+            righe = [(s, nome, byte, d["rss_picco"]) for s, d in self._sessioni.items() for nome, byte in d["oggetti"].items()]
+        return pd.DataFrame(righe, columns=["sessione", "oggetto", "byte", "rss_picco"])
+
+    def cache(self):
+        """DataFrame cache × voce con i byte registrati."""
+        with self._lock:
+            righe = [(nome, str(chiave)[:80], byte) for nome, voci in self._cache.items() for chiave, byte in voci.items()]
+        return pd.DataFrame(righe, columns=["cache", "voce", "byte"])
+
+    def byte_cache(self, nome):
+        with self._lock:
+            return sum(self._cache.get(nome, {}).values())
+
+    def totali(self, cache_esterne=None):
+        """Totali di processo: sessioni attive, byte per sessioni e cache, RSS corrente e di picco."""
+        sessioni = self.sessioni()
+        cache = self.cache()
+        byte_cache = int(cache["byte"].sum()) + sum((cache_esterne or {}).values())
+        return {
+            "sessioni": int(sessioni["sessione"].nunique()), "byte_sessioni": int(sessioni["byte"].sum()),
+            "byte_cache": byte_cache, "rss": rss_byte(), "rss_picco": rss_picco_processo(),
+        }
+
+    def libera(self, eccesso, svuotamenti, byte_esterni=None):
+        """
+        Svuota le cache nell'ordine di `svuotamenti` ([(nome, funzione senza argomenti)], dalla
+        più economica da ricostruire) finché i byte liberati coprono `eccesso`. Ritorna i nomi svuotati.
+        """
+        liberati, svuotate = 0, []
+        for nome, svuota in svuotamenti:
+            if liberati >= eccesso:
+                break
+            byte = (byte_esterni or {}).get(nome, self.byte_cache(nome))
+            if not byte:
+                continue
+            svuota()
+            self.dimentica_cache(nome)
+            liberati += byte
+            svuotate.append(nome)
+        return svuotate
@@ -0,0 +1,107 @@
+"""Performance: incasso per barca/area/periodo con split e pivot di confronto."""
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from .filtri import assegna_periodo, etichette_confronto
+
+@dataclass
+class RisultatoPerformance:
+    gdf: pd.DataFrame                 # incasso aggregato (colonna "sum") per split_col/color_col
+    split_col: str
+    color_col: Optional[str]
+    pivot: Optional[pd.DataFrame]     # tabella di confronto con i delta, se colorata per Periodo
+    titolo: str
+    caption: str
+    focus_descr: str
+
+def calcola_performance(df_filtrato, periodo_selezionato, giorno_sel, tipo_cliente_sel, area=None, barca=None):
+    """Incasso aggregato per la tab performance; None se il contesto filtrato è vuoto."""
+    if df_filtrato.empty:
+        return None
+
+    # Lavoro su una copia
+    dfw = df_filtrato.copy()
+
+    # --- Crea 'Periodo' PRIMA di fare i subset (solo se modalità confronto) ---
+    period_label_used = False
+    if periodo_selezionato.get("modalita") == "confronto":
+        period_label_used = True
+        dfw["Periodo"] = assegna_periodo(dfw, periodo_selezionato)
+
+    # --- Ora il subset Dettaglio (dopo la creazione di 'Periodo') ---
+    df_dettaglio = dfw[dfw["TipoRiga"] == "Dettaglio"].copy()
+
+    # --- Scelta split ---
+    area_unique = dfw["Area"].nunique() if "Area" in dfw.columns else 0
+    barche_unique = dfw["Barca_Normalizzata"].nunique() if "Barca_Normalizzata" in dfw.columns else 0
+
+    if area and area != "Tutte":
+        focus_descr = f"**Area selezionata:** {area}"
+        if barche_unique > 1:
+            split_col = "Barca_Normalizzata"
+            titolo = f"Incasso per Barca in {area}"
+            caption = f"Confronto tra le barche operative nell’area {area}."
+        else:
+            split_col = "Durata"
+            titolo = f"Incasso per Tipologia di Tour ({barca or ''})"
+            caption = f"Analisi delle tipologie di tour svolte dalla barca {barca or 'selezionata'}."
+    else:
+        focus_descr = "**Nessuna area selezionata:** confronto tra aree"
+        if area_unique > 1:
+            split_col = "Area"
+            titolo = "Incasso per Area"
+            caption = "Confronto tra tutte le aree operative."
+        elif barche_unique > 1:
+            split_col = "Barca_Normalizzata"
+            titolo = "Incasso per Barca"
+            caption = "Confronto tra le barche di tutte le aree."
+        else:
+            split_col = "Durata"
+            titolo = "Incasso per Tipologia Tour"
+            caption = "Analisi delle diverse tipologie di tour nella flotta."
+
+
+    # --- Costruzione colonne di groupby ---
+    gb_cols = [split_col]
+    color_col = None
+
+    # Confronto Alti/Bassi → aggiungo TipoGiorno (e color se non già impostato)
+    if giorno_sel == "Confronto Alti/Bassi":
+        gb_cols.append("TipoGiorno")
+        color_col = "TipoGiorno"
+
+    # Confronto periodi → aggiungo Periodo (e color a Periodo se non già impostato da TipoGiorno)
+    if period_label_used:
+        gb_cols.append("Periodo")
+        if color_col is None:
+            color_col = "Periodo"
+
+    # --- Confronto Privati/Gruppo sui Dettagli ---
+    if tipo_cliente_sel == "Confronto Privati/Gruppo" and "TipoCliente" in df_dettaglio.columns:
+        gb_cols = gb_cols + ["TipoCliente"]
+        color_col = "TipoCliente"  # colore sul tipo cliente
+    gdf = df_dettaglio.groupby(gb_cols, dropna=False)["Incasso"].agg(["sum", "mean"]).reset_index()
+
+    # --- Delta confronto tra periodi (solo se il colore è Periodo): ogni periodo vs il primo scelto ---
+    pivot = None
+    if period_label_used and color_col == "Periodo":
+        periodi = [p for p in etichette_confronto(periodo_selezionato) if p in set(gdf["Periodo"])]
+        if len(periodi) >= 2:
+            pivot = gdf.pivot(index=split_col, columns="Periodo", values="sum").reindex(columns=periodi)
+            base = pivot[periodi[0]].to_numpy()
+            altri = pivot[periodi[1:]].to_numpy()
+            delta = altri - base[:, None]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                delta_pct = np.where(base[:, None] > 0, 100 * delta / base[:, None], np.nan)
+            for i, p in enumerate(periodi[1:]):
+                pivot[f"Delta € {p}"] = delta[:, i]
+                pivot[f"Delta % {p}"] = delta_pct[:, i]
+            pivot.columns.name = None
+
+    return RisultatoPerformance(
+        gdf=gdf, split_col=split_col, color_col=color_col, pivot=pivot,
+        titolo=titolo, caption=caption, focus_descr=focus_descr,
+    )
@@ -0,0 +1,181 @@
+"""Popolarità dei tour: matrice Durata × segmento, top/peggiori e variazioni tra periodi."""
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from .filtri import assegna_periodo, etichette_confronto
+
+@dataclass
+class DeltaPopolarita:
+    periodi: list                     # periodi confrontati, nell'ordine della selezione
+    top_inc: pd.DataFrame             # maggiori incrementi normalizzati per barche attive
+    top_dec: pd.DataFrame             # maggiori decrementi
+
+@dataclass
+class RisultatoPopolarita:
+    top: pd.DataFrame
+    color_col: Optional[str]
+    facet_col: Optional[str]
+    caption_msg: Optional[str]
+    worst5: pd.DataFrame
+    compare_periods: bool
+    periodi_ok: bool = False
+    delta: Optional[DeltaPopolarita] = None
+    msg_delta: Optional[str] = None
+
+def matrice_popolarita(dfw, segmenti):
+    """
+    Conteggio dei tour in una matrice Durata × segmento da un solo groupby
+    (Durata mancante inclusa come riga). segmenti: colonne che identificano il
+    segmento, es. ["TipoCliente", "Periodo"]; lista vuota → una sola colonna "Conteggio".
+    """
+    conteggi = dfw.groupby(["Durata"] + segmenti, dropna=False).size()
+    if not segmenti:
+        return conteggi.to_frame("Conteggio")
+    return conteggi.unstack(segmenti, fill_value=0)
+
+def top_n_matrice(matrice, segmenti, n=5):
+    # Top-n Durata per ogni colonna (segmento) con un argsort sull'asse delle righe
+    valori = matrice.to_numpy()
+    ordine = np.argsort(-valori, axis=0, kind="stable")[:n]
+    conteggi = np.take_along_axis(valori, ordine, axis=0)
+    colonne = np.broadcast_to(np.arange(valori.shape[1]), ordine.shape)
+    presenti = conteggi > 0
+    righe, colonne, conteggi = ordine[presenti], colonne[presenti], conteggi[presenti]
+    parti = [pd.DataFrame({"Durata": matrice.index[righe]})]
+    if segmenti:
+        parti.append(matrice.columns[colonne].to_frame(index=False))
+    top = pd.concat(parti, axis=1)
+    top["Conteggio"] = conteggi
+    return top.sort_values("Conteggio", ascending=False, kind="stable").reset_index(drop=True)
+
+def peggiori_n_matrice(matrice, n=5):
+    # Durata con meno occorrenze (> 0) sommando su tutti i segmenti
+    totali = matrice.to_numpy().sum(axis=1)
+    righe = np.flatnonzero(totali > 0)
+    righe = righe[np.argsort(totali[righe], kind="stable")[:n]]
+    return pd.DataFrame({"Durata": matrice.index[righe], "Conteggio": totali[righe]}, index=righe)
+
+def delta_periodi_matrice(matrice, barche_per_periodo, periodi):
+    """
+    Conteggi per periodo normalizzati per il numero di barche attive (una colonna per periodo,
+    nell'ordine dato) e delta ultimo - primo periodo. NaN dove la Durata non compare nel periodo.
+    """
+    per_periodo = matrice if matrice.columns.nlevels == 1 else matrice.T.groupby(level="Periodo").sum().T
+    conteggi = per_periodo.reindex(columns=periodi, fill_value=0).to_numpy().astype(float)
+    barche = barche_per_periodo.reindex(periodi).to_numpy().astype(float)
+    presenti = (conteggi > 0).any(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        norm = np.where((conteggi > 0) & (barche > 0), conteggi / barche, np.nan)[presenti]
+    primo, ultimo = np.nan_to_num(norm[:, 0]), np.nan_to_num(norm[:, -1])
+    delta = ultimo - primo
+    with np.errstate(divide="ignore", invalid="ignore"):
+        delta_pct = np.where(primo > 0, 100 * delta / primo, np.nan)
+    risultato = pd.DataFrame(norm, columns=periodi)
+    risultato.insert(0, "Durata", per_periodo.index[presenti])
+    risultato["Delta_norm"] = delta
+    risultato["Delta_%"] = delta_pct
+    return risultato
+
+def calcola_popolarita(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area=None, barca=None):
+    if df_kpi.empty:
+        return None
+
+    # ====== PREP E 'Periodo' ======
+    dfw = df_kpi.copy()
+    compare_periods = (periodo_selezionato.get("modalita") == "confronto")
+
+    if compare_periods:
+        dfw["Periodo"] = assegna_periodo(dfw, periodo_selezionato)
+
+    # ====== SCELTA righe (Dettaglio/Totale) in base ai clienti ======
+    if tipo_cliente_sel in ["Privati", "Gruppo", "Confronto Privati/Gruppo"]:
+        dfw = dfw[dfw["TipoRiga"] == "Dettaglio"]
+        if tipo_cliente_sel == "Privati":
+            dfw = dfw[dfw["TipoCliente"] == "Privati"]
+        elif tipo_cliente_sel == "Gruppo":
+            dfw = dfw[dfw["TipoCliente"] == "Gruppo"]
+        # Per "Confronto Privati/Gruppo" tengo entrambe le classi
+    else:
+        dfw = dfw[dfw["TipoRiga"] == "Totale"]
+
+    # ====== SEZIONE GRAFICO PRINCIPALE ======
+    # Rami principali: colonne di groupby e impostazioni del grafico
+    if tipo_cliente_sel == "Confronto Privati/Gruppo" and "TipoCliente" in dfw.columns:
+        if area and area != "Tutte" and (barca in [None, "Tutte"]) and dfw["Barca_Normalizzata"].nunique() > 1:
+            gb_cols = ["Durata", "TipoCliente", "Barca_Normalizzata"]
+            if compare_periods: gb_cols.append("Periodo")
+            color_col = "Barca_Normalizzata"
+            facet_col = ("Periodo" if compare_periods else "TipoCliente")
+            caption_msg = "Top 5 tour per barca e tipologia cliente" + (" con confronto periodi." if compare_periods else ".")
+        else:
+            gb_cols = ["Durata", "TipoCliente"]
+            if compare_periods: gb_cols.append("Periodo")
+            color_col = "TipoCliente"
+            facet_col = ("Periodo" if compare_periods else None)
+            caption_msg = "Top 5 tour per tipologia cliente" + (" per ciascun periodo." if compare_periods else ".")
+
+    elif area and area != "Tutte" and (barca in [None, "Tutte"]) and dfw["Barca_Normalizzata"].nunique() > 1:
+        gb_cols = ["Durata", "Barca_Normalizzata"]
+        if compare_periods: gb_cols.append("Periodo")
+        color_col = "Barca_Normalizzata"
+        facet_col = ("Periodo" if compare_periods else None)
+        caption_msg = "Top 5 tour per ogni barca dell’area selezionata" + (" con confronto tra periodi." if compare_periods else ".")
+
+    elif giorno_sel == "Confronto Alti/Bassi" and "TipoGiorno" in dfw.columns:
+        gb_cols = ["Durata", "TipoGiorno"]
+        if compare_periods: gb_cols.append("Periodo")
+        color_col = "TipoGiorno"
+        facet_col = ("Periodo" if compare_periods else None)
+        caption_msg = "Confronto top 5 tour tra giorni Alti/Bassi" + (" per ciascun periodo." if compare_periods else ".")
+
+    else:
+        gb_cols = ["Durata"]
+        if compare_periods: gb_cols.append("Periodo")
+        color_col = ("Periodo" if compare_periods else None)
+        facet_col = None
+        caption_msg = "Top 5 tour più richiesti nel periodo/segmento selezionato" + (" con confronto tra periodi." if compare_periods else ".")
+
+    # Una sola matrice Durata × segmento: i segmenti sono i gruppi del top (es. TipoCliente, Periodo)
+    segmenti = gb_cols[1:]
+    matrice = matrice_popolarita(dfw, segmenti)
+    top = top_n_matrice(matrice, segmenti, n=5)
+
+    # ====== 1) I 5 PEGGIORI TOUR (meno richiesti) ======
+    # Considero solo tour con almeno 1 occorrenza (per non riempire di zeri)
+    worst5 = peggiori_n_matrice(matrice, n=5)
+
+    risultati = RisultatoPopolarita(
+        top=top, color_col=color_col, facet_col=facet_col, caption_msg=caption_msg,
+        worst5=worst5, compare_periods=compare_periods,
+    )
+
+    # ====== 2) & 3) Maggior incremento/decremento (normalizzato su #barche) ======
+    if not compare_periods:
+        return risultati
+
+    # Periodi scelti presenti nei dati, nell'ordine della selezione (escludo 'Altro')
+    presenti = set(dfw["Periodo"].dropna().unique())
+    periodi_validi = [p for p in etichette_confronto(periodo_selezionato) if p in presenti]
+    if len(periodi_validi) < 2:
+        risultati.msg_delta = "Servono almeno due periodi da confrontare."
+        return risultati
+    risultati.periodi_ok = True
+
+    # # barche attive per periodo (nunique), poi conteggi normalizzati dalla matrice
+    boats = dfw[dfw["Periodo"].isin(periodi_validi)].groupby("Periodo")["Barca_Normalizzata"].nunique()
+    piv = delta_periodi_matrice(matrice, boats, periodi_validi)
+
+    if not piv.empty:
+        risultati.delta = DeltaPopolarita(
+            periodi=periodi_validi,
+            # Top 5 incrementi
+            top_inc=piv.sort_values("Delta_norm", ascending=False, kind="stable").head(5),
+            # Top 5 decrementi
+            top_dec=piv.sort_values("Delta_norm", ascending=True, kind="stable").head(5),
+        )
+    else:
+        risultati.msg_delta = "Non è stato possibile calcolare il delta normalizzato: colonne dei periodi mancanti."
+    return risultati
@@ -0,0 +1,124 @@
+"""
+Profilazione leggera: intervalli con nome, contatori e righe elaborate per esecuzione.
+
+La traccia attiva è in una ContextVar: ogni rerun (un thread per sessione) ha la sua e
+senza traccia attiva `intervallo` e `conta` non fanno nulla. I calcoli sottomessi a un pool
+di thread la ereditano passando da `in_contesto`.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_traccia = contextvars.ContextVar("bb_traccia", default=None)
+_livello = contextvars.ContextVar("bb_livello", default=0)
+_lock_file = threading.Lock()
+
+class Traccia:
+    """Intervalli e contatori di un'esecuzione (un rerun della dashboard)."""
+
+    def __init__(self, nome, **meta):
+        self.nome = nome
+        self.meta = meta
+        self.creata = time.time()
+        self.inizio = time.perf_counter()
+        self.intervalli = []
+        self.contatori = {}
+        self._lock = threading.Lock()
+
+    def conta(self, nome, n=1):
+        with self._lock:
+            self.contatori[nome] = self.contatori.get(nome, 0) + n
+
+    def aggiungi(self, intervallo):
+        with self._lock:
+            self.intervalli.append(intervallo)
+
+    def durata_ms(self):
+        return (time.perf_counter() - self.inizio) * 1000
+
+    def come_dict(self):
+        with self._lock:
+            intervalli = sorted(self.intervalli, key=lambda i: i["inizio_ms"])
+            contatori = dict(self.contatori)
+        return {"traccia": self.nome, "creata": round(self.creata, 3), **self.meta,
+                "durata_ms": round(self.durata_ms(), 2), "intervalli": intervalli, "contatori": contatori}
+
+class Intervallo:
+    """Dati modificabili dentro il blocco misurato (ad es. le righe prodotte)."""
+    __slots__ = ("righe", "cache")
+
+    def __init__(self, righe=None):
+        self.righe = righe
+        self.cache = None
+
+_NULLO = Intervallo()
+
+def avvia(nome, **meta):
+    """Nuova traccia attiva per il contesto corrente (da chiamare all'inizio del rerun)."""
+    traccia = Traccia(nome, **meta)
+    _traccia.set(traccia)
+    _livello.set(0)
+    return traccia
+
+def corrente():
+    return _traccia.get()
+
+def conta(nome, n=1):
+    traccia = _traccia.get()
+    if traccia is not None:
+        traccia.conta(nome, n)
+
+@contextmanager
+def intervallo(nome, righe=None, cache=None):
+    """
+    Misura il blocco come intervallo `nome`. `righe` (o `.righe` impostato nel blocco) sono le
+    righe elaborate; con `cache="<nome>"` l'intervallo è un hit se nel blocco non è stato
+    contato "cache.<nome>.miss" (il corpo della funzione in cache non è stato eseguito).
+    """
+    traccia = _traccia.get()
+    if traccia is None:
+        yield _NULLO
+        return
+    dati = Intervallo(righe)
+    chiave_miss = f"cache.{cache}.miss"
+    miss_prima = traccia.contatori.get(chiave_miss, 0)
+    livello = _livello.get()
+    token = _livello.set(livello + 1)
+    inizio = time.perf_counter()
+    try:
+        yield dati
+    finally:
+        durata = time.perf_counter() - inizio
+        _livello.reset(token)
+        if cache is not None:
+            dati.cache = "miss" if traccia.contatori.get(chiave_miss, 0) > miss_prima else "hit"
+            if dati.cache == "hit":
+                traccia.conta(f"cache.{cache}.hit")
+        traccia.aggiungi({
+            "nome": nome, "livello": livello, "thread": threading.current_thread().name,
+            "inizio_ms": round((inizio - traccia.inizio) * 1000, 2), "durata_ms": round(durata * 1000, 2),
+            "righe": None if dati.righe is None else int(dati.righe), "cache": dati.cache,
+        })
+
+def in_contesto(nome, funzione):
+    """Avvolge funzione per un pool di thread: stessa traccia del chiamante, misurata come `nome`."""
+    contesto = contextvars.copy_context()
+
+    def eseguita(*args, **kwargs):
+        def misurata():
+            with intervallo(nome):
+                return funzione(*args, **kwargs)
+        return contesto.run(misurata)
+    return eseguita
+
+def scrivi_jsonl(traccia, percorso):
+    # Una riga JSON per traccia, in append: il file si analizza offline con pandas.read_json(lines=True)
+    riga = json.dumps(traccia.come_dict(), ensure_ascii=False, default=str)
+    cartella = os.path.dirname(percorso)
+    if cartella:
+        os.makedirs(cartella, exist_ok=True)
+    with _lock_file, open(percorso, "a", encoding="utf-8") as f:
+        f.write(riga + "\n")
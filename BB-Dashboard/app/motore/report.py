@@ -0,0 +1,88 @@
+"""Report PDF analitico: costruzione headless, usata dalla coda della dashboard e dal batch."""
+import os
+import tempfile
+
+def _testo_pdf(testo):
+    # I font standard di FPDF sono latin-1: sostituisco i caratteri fuori codifica
+    testo = testo.replace("€", "EUR").replace("–", "-").replace("’", "'")
+    return testo.encode("latin-1", "replace").decode("latin-1")
+
+def _immagine_figura(fig, cartella, nome):
+    # Figure matplotlib senza pyplot (sicuro nei thread): salvataggio diretto con il canvas Agg
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    FigureCanvasAgg(fig)
+    fig.tight_layout()
+    percorso = os.path.join(cartella, nome)
+    fig.savefig(percorso)
+    return percorso
+
+def costruisci_report_pdf(df_kpi, avanzamento=lambda quota, messaggio: None, ambito=None):
+    """
+    Report PDF analitico del contesto filtrato (coda di background della dashboard o batch).
+    avanzamento(quota 0-1, messaggio) riceve l'avanzamento dei passi; ambito (es. "Area Sirmione")
+    compare sotto il titolo. Ritorna i byte del PDF.
+    """
+    from fpdf import FPDF
+    from matplotlib.figure import Figure
+    import shutil
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        avanzamento(0.05, "Calcolo KPI")
+        pdf = FPDF()
+        pdf.set_auto_page_break(auto=True, margin=15)
+        pdf.add_page()
+        pdf.set_font("Arial", "B", 16)
+        pdf.cell(0, 10, "Report Analitico Tour Boat Taxi", ln=True, align="C")
+        pdf.set_font("Arial", "", 12)
+        if ambito:
+            pdf.cell(0, 8, _testo_pdf(ambito), ln=True, align="C")
+        df_tot = df_kpi[df_kpi["TipoRiga"] == "Totale"]
+        if not df_tot.empty:
+            start_date = df_tot["Data"].min()
+            end_date = df_tot["Data"].max()
+            pdf.cell(0, 10, _testo_pdf(f"Periodo analisi: {start_date.strftime('%d/%m/%Y')} – {end_date.strftime('%d/%m/%Y')}"), ln=True)
+        pdf.ln(5)
+        pdf.cell(0, 8, _testo_pdf(f"Incasso totale: {df_tot['Incasso'].sum():,.0f} €"), ln=True)
+        pdf.cell(0, 8, _testo_pdf(f"Numero clienti: {df_tot['Clienti'].sum():,.0f}"), ln=True)
+        pdf.cell(0, 8, _testo_pdf(f"Tour effettuati: {len(df_tot)}"), ln=True)
+        gasolio = df_tot["Gasolio"].sum()
+        efficienza = f"{df_tot['Incasso'].sum() / gasolio:.2f}" if gasolio > 0 else "—"
+        pdf.cell(0, 8, _testo_pdf(f"Efficienza €/litro: {efficienza}"), ln=True)
+        pdf.ln(5)
+
+        # Il tipo cliente esiste solo sulle righe Dettaglio
+        avanzamento(0.3, "Boxplot incasso per cliente")
+        df_det = df_kpi[(df_kpi["TipoRiga"] == "Dettaglio") & df_kpi["Incasso"].notna()]
+        if not df_det.empty:
+            gruppi = df_det.groupby("TipoCliente")["Incasso"]
+            fig = Figure(figsize=(5, 3))
+            ax = fig.add_subplot()
+            ax.boxplot([v.to_numpy() for _, v in gruppi])
+            ax.set_xticks(range(1, gruppi.ngroups + 1), [str(k) for k in gruppi.groups])
+            ax.set_title("Boxplot Incasso per Cliente")
+            pdf.image(_immagine_figura(fig, tmpdir, "boxplot.png"), w=100)
+
+        avanzamento(0.6, "Trend incasso mensile")
+        if not df_tot.empty:
+            trend = df_tot.groupby(df_tot["Data"].dt.to_period("M").astype(str))["Incasso"].sum()
+            fig2 = Figure(figsize=(5, 3))
+            ax2 = fig2.add_subplot()
+            ax2.plot(trend.index, trend.to_numpy())
+            ax2.set_title("Trend incasso mensile")
+            ax2.tick_params(axis="x", labelrotation=45, labelsize=7)
+            pdf.image(_immagine_figura(fig2, tmpdir, "trend.png"), w=100)
+
+        avanzamento(0.85, "Scrittura PDF")
+        pdf.set_font("Arial", "B", 12)
+        pdf.cell(0, 10, "Statistiche principali:", ln=True)
+        pdf.set_font("Arial", "", 11)
+        pdf.cell(0, 8, "Vedi dashboard per ulteriori approfondimenti.", ln=True)
+        pdf_file = os.path.join(tmpdir, "report_analitico.pdf")
+        pdf.output(pdf_file)
+        with open(pdf_file, "rb") as f:
+            contenuto = f.read()
+        avanzamento(1.0, "Report pronto")
+        return contenuto
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
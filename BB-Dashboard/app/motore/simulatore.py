@@ -0,0 +1,228 @@
+"""Simulatore flotta: statistiche storiche per stagione e area, curve, Monte Carlo, ottimizzazione."""
+import numpy as np
+import pandas as pd
+
+STAGIONI_SIMULATORE = {
+    "Bassa (gen, feb, mar, nov, dic)":   [1, 2, 3, 11, 12],
+    "Alta (apr, mag, set, ott)":         [4, 5, 9, 10],
+    "Altissima (giu, lug, ago)":         [6, 7, 8],
+    "8 mesi (mar-ott)":                  [3, 4, 5, 6, 7, 8, 9, 10],
+    "12 mesi (anno intero)":             list(range(1,13)),
+}
+
+def _trend_annuo(valori_per_anno):
+    # Crescita media annua composta tra il primo e l'ultimo anno disponibile
+    valori_per_anno = valori_per_anno.sort_index()
+    if len(valori_per_anno) > 1:
+        return (valori_per_anno.iloc[-1] / valori_per_anno.iloc[0]) ** (1/(len(valori_per_anno)-1))
+    return 1
+
+def giorno_barca_simulatore(df_kpi):
+    # Aggregato giorno-barca delle righe Dettaglio: incasso e clienti di ogni barca in ogni giorno
+    df_det = df_kpi[df_kpi["TipoRiga"] == "Dettaglio"]
+    giorno_barca = (
+        df_det.groupby(["Area", df_det["Data"].dt.normalize().rename("Giorno"), "Barca_Normalizzata"])
+        .agg(Incasso=("Incasso", "sum"), Clienti=("Clienti", "sum"))
+        .reset_index()
+    )
+    giorno_barca["Mese"] = giorno_barca["Giorno"].dt.month
+    return giorno_barca
+
+def statistiche_simulatore(df_kpi):
+    """
+    Statistiche storiche del simulatore per ogni (stagione, area), calcolate una volta sola
+    per df_kpi: i widget del tab non ripassano più sulle righe Dettaglio.
+    Ritorna (DataFrame indicizzato per Stagione/Area, primo anno delle righe Dettaglio).
+    """
+    aree = sorted(df_kpi["Area"].dropna().unique())
+    df_det = df_kpi[df_kpi["TipoRiga"] == "Dettaglio"]
+    anno_min = int(df_det["Data"].dt.year.min()) if not df_det.empty else None
+    giorno_barca = giorno_barca_simulatore(df_kpi)
+
+    # --- Aggregato mensile per il trend (medie per riga, come lo storico) ---
+    mensile = (
+        df_det.groupby(["Area", df_det["Data"].dt.year.rename("Anno"), df_det["Data"].dt.month.rename("Mese")])
+        .agg(Incasso_sum=("Incasso", "sum"), Incasso_n=("Incasso", "count"),
+             Clienti_sum=("Clienti", "sum"), Clienti_n=("Clienti", "count"))
+        .reset_index()
+    )
+
+    righe = []
+    for stagione, mesi_scelti in STAGIONI_SIMULATORE.items():
+        gb = giorno_barca[giorno_barca["Mese"].isin(mesi_scelti)]
+        max_barche = gb.groupby(["Area", "Giorno"]).size().groupby("Area").max()
+        per_area = gb.groupby("Area").agg(
+            giorni_barca=("Incasso", "size"),
+            incasso_medio=("Incasso", "mean"),
+            clienti_medio=("Clienti", "mean"),
+        )
+        per_anno = mensile[mensile["Mese"].isin(mesi_scelti)].groupby(["Area", "Anno"]).sum()
+        inc_per_anno = per_anno["Incasso_sum"] / per_anno["Incasso_n"]
+        cli_per_anno = per_anno["Clienti_sum"] / per_anno["Clienti_n"]
+
+        for area in aree:
+            n_max = int(max_barche.get(area, 0))
+            if n_max == 0:
+                righe.append({
+                    "Stagione": stagione, "Area": area, "max_barche": 0, "giorni_barca": 0,
+                    "incasso_medio": 0.0, "clienti_medio": 0.0, "giorni_per_barca": 0.0,
+                    "trend_incasso": 1.0, "trend_clienti": 1.0,
+                })
+                continue
+            righe.append({
+                "Stagione": stagione, "Area": area, "max_barche": n_max,
+                "giorni_barca": int(per_area.at[area, "giorni_barca"]),
+                "incasso_medio": per_area.at[area, "incasso_medio"],
+                "clienti_medio": per_area.at[area, "clienti_medio"],
+                "giorni_per_barca": per_area.at[area, "giorni_barca"] / max(1, n_max),
+                "trend_incasso": _trend_annuo(inc_per_anno.xs(area, level="Area")),
+                "trend_clienti": _trend_annuo(cli_per_anno.xs(area, level="Area")),
+            })
+
+    stats = pd.DataFrame(righe, columns=[
+        "Stagione", "Area", "max_barche", "giorni_barca", "incasso_medio", "clienti_medio",
+        "giorni_per_barca", "trend_incasso", "trend_clienti",
+    ]).set_index(["Stagione", "Area"])
+    return stats, anno_min
+
+def simula_curve(stats_stagione, n_anni, n_max):
+    """
+    Simulazione vettoriale: incasso e clienti attesi per ogni area e per ogni numero di
+    barche da 1 a n_max, con il trend storico attualizzato di n_anni.
+    Ritorna un DataFrame lungo con colonne Area, Barche, Incasso, Clienti.
+    """
+    barche = np.arange(1, n_max + 1)
+    attive = stats_stagione["giorni_per_barca"].to_numpy() > 0
+    base_incasso = np.where(
+        attive,
+        stats_stagione["incasso_medio"].to_numpy() * stats_stagione["giorni_per_barca"].to_numpy()
+        * stats_stagione["trend_incasso"].to_numpy() ** n_anni,
+        0.0
+    )
+    base_clienti = np.where(
+        attive,
+        stats_stagione["clienti_medio"].to_numpy() * stats_stagione["giorni_per_barca"].to_numpy()
+        * stats_stagione["trend_clienti"].to_numpy() ** n_anni,
+        0.0
+    )
+    aree = stats_stagione.index.to_numpy()
+    return pd.DataFrame({
+        "Area": np.repeat(aree, n_max),
+        "Barche": np.tile(barche, len(aree)),
+        "Incasso": (base_incasso[:, None] * barche[None, :]).ravel(),
+        "Clienti": (base_clienti[:, None] * barche[None, :]).ravel(),
+    })
+
+def _classi_bootstrap(incassi, clienti, n_classi):
+    # Raggruppa i giorni-barca in classi di quantile dell'incasso (coppie incasso/clienti
+    # mantenute) con media e varianza interna. Con pochi campioni ogni giorno-barca è una
+    # classe a varianza nulla: il bootstrap è esatto.
+    ordine = np.argsort(incassi, kind="stable")
+    blocchi = np.array_split(ordine, min(n_classi, len(ordine)))
+    classi = {
+        "incasso": np.array([incassi[b].mean() for b in blocchi]),
+        "clienti": np.array([clienti[b].mean() for b in blocchi]),
+        "var_incasso": np.array([incassi[b].var() for b in blocchi]),
+        "var_clienti": np.array([clienti[b].var() for b in blocchi]),
+        "pesi": np.array([len(b) for b in blocchi], dtype=float) / len(ordine),
+    }
+    # Correlazione incasso/clienti dentro le classi (comune a tutte)
+    dimensioni = [len(b) for b in blocchi]
+    posizione = np.argsort(ordine)
+    scarti_inc = incassi - np.repeat(classi["incasso"], dimensioni)[posizione]
+    scarti_cli = clienti - np.repeat(classi["clienti"], dimensioni)[posizione]
+    den = np.sqrt((scarti_inc ** 2).sum() * (scarti_cli ** 2).sum())
+    classi["rho"] = float((scarti_inc * scarti_cli).sum() / den) if den > 0 else 0.0
+    return classi
+
+def simula_monte_carlo(giorno_barca, stats_stagione, mesi_scelti, barche_per_area, n_anni,
+                       n_scenari=20000, seed=42, n_classi=32, percentili=(10, 50, 90)):
+    """
+    Monte Carlo del simulatore What-If: per ogni area e scenario ricampiona (bootstrap)
+    i giorni-barca storici della stagione, tanti quanti i giorni attesi per il numero di barche.
+    Le estrazioni sono contate per classe di quantile con una multinomiale, più un termine
+    gaussiano per la varianza interna alle classi: ogni area costa una matrice
+    (n_scenari × n_classi). RNG con seed: risultati riproducibili.
+    Ritorna (tabella percentili per area + Totale, array incasso e clienti totali per scenario).
+    """
+    rng = np.random.default_rng(seed)
+    campioni = giorno_barca[giorno_barca["Mese"].isin(mesi_scelti)]
+    totale_incasso = np.zeros(n_scenari)
+    totale_clienti = np.zeros(n_scenari)
+    righe = []
+
+    def _riga(nome, incasso, clienti):
+        p_inc = np.percentile(incasso, percentili)
+        p_cli = np.percentile(clienti, percentili)
+        riga = {"Area": nome}
+        riga.update({f"Incasso P{p}": v for p, v in zip(percentili, p_inc)})
+        riga.update({f"Clienti P{p}": v for p, v in zip(percentili, p_cli)})
+        return riga
+
+    for area, n_barche in barche_per_area.items():
+        s = stats_stagione.loc[area]
+        camp_area = campioni[campioni["Area"] == area]
+        n_giorni = int(round(s["giorni_per_barca"] * n_barche))
+        if n_giorni == 0 or camp_area.empty:
+            incasso = np.zeros(n_scenari)
+            clienti = np.zeros(n_scenari)
+        else:
+            classi = _classi_bootstrap(
+                camp_area["Incasso"].to_numpy(dtype=float),
+                camp_area["Clienti"].to_numpy(dtype=float),
+                n_classi
+            )
+            conteggi = rng.multinomial(n_giorni, classi["pesi"], size=n_scenari)
+            z_inc = rng.standard_normal(n_scenari)
+            z_cli = classi["rho"] * z_inc + np.sqrt(1 - classi["rho"] ** 2) * rng.standard_normal(n_scenari)
+            incasso = conteggi @ classi["incasso"] + np.sqrt(conteggi @ classi["var_incasso"]) * z_inc
+            clienti = conteggi @ classi["clienti"] + np.sqrt(conteggi @ classi["var_clienti"]) * z_cli
+            incasso = np.maximum(incasso, 0) * s["trend_incasso"] ** n_anni
+            clienti = np.maximum(clienti, 0) * s["trend_clienti"] ** n_anni
+        totale_incasso += incasso
+        totale_clienti += clienti
+        righe.append(_riga(area, incasso, clienti))
+
+    righe.append(_riga("Totale", totale_incasso, totale_clienti))
+    return pd.DataFrame(righe).set_index("Area"), totale_incasso, totale_clienti
+
+def ottimizza_flotta(curve, totale_barche, minimi, massimi, obiettivo="Incasso", top_k=10):
+    """
+    Ricerca esaustiva dell'allocazione di totale_barche tra le aree che massimizza l'obiettivo
+    ("Incasso" o "Clienti") letto dalle curve di simula_curve.
+    Le allocazioni parziali sono costruite area per area e potate appena non possono più
+    sommare a totale_barche (branch-and-bound sui vincoli min/max); il valore di tutte le
+    candidate è poi valutato in un colpo solo con un lookup sulla matrice area × barche.
+    Ritorna (DataFrame delle top_k allocazioni, numero di candidate valutate).
+    """
+    aree = list(minimi.keys())
+    valori = curve.pivot(index="Area", columns="Barche", values=obiettivo).reindex(aree)
+    n_max = int(valori.columns.max())
+    matrice = np.zeros((len(aree), n_max + 1))
+    matrice[:, valori.columns.to_numpy()] = valori.fillna(0).to_numpy()
+
+    lim_min = np.array([minimi[a] for a in aree])
+    lim_max = np.minimum(np.array([massimi[a] for a in aree]), n_max)
+    # Somme minime/massime ancora raggiungibili con le aree successive
+    resto_min = np.append(np.cumsum(lim_min[::-1])[::-1], 0)
+    resto_max = np.append(np.cumsum(lim_max[::-1])[::-1], 0)
+
+    alloc = np.zeros((1, 0), dtype=int)
+    for i in range(len(aree)):
+        scelte = np.arange(lim_min[i], lim_max[i] + 1)
+        alloc = np.hstack([
+            np.repeat(alloc, len(scelte), axis=0),
+            np.tile(scelte, len(alloc))[:, None]
+        ])
+        somma = alloc.sum(axis=1)
+        ok = (somma + resto_min[i + 1] <= totale_barche) & (somma + resto_max[i + 1] >= totale_barche)
+        alloc = alloc[ok]
+
+    if len(alloc) == 0:
+        return pd.DataFrame(columns=aree + [obiettivo]), 0
+
+    valore = matrice[np.arange(len(aree)), alloc].sum(axis=1)
+    migliori = np.argsort(-valore, kind="stable")[:top_k]
+    risultato = pd.DataFrame(alloc[migliori], columns=aree)
+    risultato[obiettivo] = valore[migliori]
+    return risultato, len(alloc)
@@ -0,0 +1,118 @@
+"""Stagionalità: incasso mensile per anno, media storica e confronto YoY allineato."""
+import calendar
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from .filtri import indice_allineamento, serie_yoy_allineata
+
+@dataclass
+class RisultatoStagionalita:
+    vuoto: bool                                   # nessun anno con dati dopo i filtri
+    grouping_label: Optional[str] = None          # TipoGiorno / TipoCliente nei confronti
+    anno_1: Optional[int] = None                  # primo e ultimo anno disponibili
+    anno_2: Optional[int] = None
+    mesi: Optional[list] = None
+    df_trend: Optional[pd.DataFrame] = None
+    g: Optional[pd.DataFrame] = None              # incasso per Anno, mese (X) ed eventuale grouping
+    df_cmp: Optional[pd.DataFrame] = None
+    media_storica: Optional[pd.DataFrame] = None
+    yoy: Optional[pd.DataFrame] = None            # mesi × anni allineati per giorno della settimana
+
+def calcola_stagionalita(df_kpi, periodo_selezionato, giorno_sel, tipo_cliente_sel, area=None, barca=None):
+    """Trend mensile per anno, media storica e YoY allineato; None se il contesto filtrato è vuoto."""
+    if df_kpi.empty:
+        return None
+
+    oggi = pd.Timestamp(datetime.now().date())
+    df_kpi = df_kpi[df_kpi["Data"] <= oggi]
+
+    # --- FILTRO AGGIUNTIVO: GIORNO E CLIENTE (con distinzione TipoRiga) ---
+    grouping_label = None  # Nessun grouping extra di default
+
+    # Filtro giorno
+    if giorno_sel == "Alti":
+        df_kpi = df_kpi[df_kpi["TipoGiorno"] == "Alti"]
+    elif giorno_sel == "Bassi":
+        df_kpi = df_kpi[df_kpi["TipoGiorno"] == "Bassi"]
+    elif giorno_sel == "Confronto Alti/Bassi":
+        df_kpi = df_kpi[df_kpi["TipoGiorno"].isin(["Alti", "Bassi"])]
+        grouping_label = "TipoGiorno"
+
+    # Filtro cliente con distinzione TipoRiga
+    if tipo_cliente_sel == "Privati":
+        df_kpi = df_kpi[(df_kpi["TipoCliente"] == "Privati") & (df_kpi["TipoRiga"] == "Dettaglio")]
+    elif tipo_cliente_sel == "Gruppo":
+        df_kpi = df_kpi[(df_kpi["TipoCliente"] == "Gruppo") & (df_kpi["TipoRiga"] == "Dettaglio")]
+    elif tipo_cliente_sel == "Confronto Privati/Gruppo":
+        df_kpi = df_kpi[(df_kpi["TipoCliente"].isin(["Privati", "Gruppo"])) & (df_kpi["TipoRiga"] == "Dettaglio")]
+        grouping_label = "TipoCliente"
+    else:
+        # Tutti i dati, usiamo solo Totale per evitare sovrapposizioni
+        df_kpi = df_kpi[df_kpi["TipoRiga"] == "Totale"]
+
+    # --- Impostazioni base ---
+    anni_disp = sorted(df_kpi["Data"].dt.year.dropna().unique())
+    if len(anni_disp) == 0:
+        return RisultatoStagionalita(vuoto=True)
+    anno_1 = anni_disp[0]
+    anno_2 = anni_disp[-1] if len(anni_disp) > 1 else anni_disp[0]
+    mesi = [calendar.month_name[m] for m in range(1,13)]
+
+    df_trend = df_kpi.copy()
+    df_trend["Anno"] = df_trend["Data"].dt.year
+    df_trend["Mese"] = df_trend["Data"].dt.month
+    df_trend["Settimana"] = df_trend["Data"].dt.isocalendar().week
+    df_trend["X"] = pd.Categorical(df_trend["Mese"].apply(lambda m: calendar.month_name[m]), categories=mesi, ordered=True)
+
+    # --- Raggruppamento dati ---
+    group_fields = ["Anno", "X"]
+    if grouping_label:
+        group_fields.append(grouping_label)
+
+    g = df_trend.groupby(group_fields, observed=True)["Incasso"].sum().reset_index()
+
+    # --- Serie tabellare pivotata ---
+    if grouping_label:
+        df_cmp = g.pivot_table(index="X", columns=[grouping_label, "Anno"], values="Incasso").fillna(0)
+    else:
+        g1 = g[g["Anno"] == anno_1].groupby("X")["Incasso"].sum()
+        g2 = g[g["Anno"] == anno_2].groupby("X")["Incasso"].sum()
+        g1 = g1.reindex(mesi)
+        g2 = g2.reindex(mesi)
+        df_cmp = pd.DataFrame({
+            f"Incasso {anno_1}": g1,
+            f"Incasso {anno_2}": g2
+        }).fillna(0)
+
+    # --- YoY allineato per giorno della settimana: base = stagione più recente, fino all'ultimo dato ---
+    yoy = None
+    giornaliero = df_trend.groupby(df_trend["Data"].dt.normalize())["Incasso"].sum()
+    date_base = giornaliero.index[giornaliero.index.year == anno_2]
+    if len(anni_disp) > 1 and len(date_base):
+        intervallo = pd.date_range(f"{anno_2}-01-01", date_base.max(), freq="D")
+        allineata = serie_yoy_allineata(
+            giornaliero, intervallo, anni_disp, indice_allineamento(int(anni_disp[0]), int(anni_disp[-1]))
+        )
+        yoy = allineata.groupby(allineata.index.month).sum()
+        precedente, ultimo = yoy[anni_disp[-2]].to_numpy(), yoy[anni_disp[-1]].to_numpy()
+        yoy.index = [calendar.month_name[m] for m in yoy.index]
+        yoy.columns = [f"Incasso {a}" for a in anni_disp]
+        yoy[f"Delta % {anni_disp[-1]} vs {anni_disp[-2]}"] = np.where(
+            precedente > 0, 100 * (ultimo - precedente) / np.where(precedente > 0, precedente, 1), np.nan
+        )
+
+    # --- Media storica ---
+    if grouping_label:
+        media_storica = g.groupby(["X", grouping_label])["Incasso"].mean().reset_index(name="Media storica")
+    else:
+        media_storica = g.groupby("X")["Incasso"].mean().reindex(mesi).reset_index(name="Media storica")
+
+    return RisultatoStagionalita(
+        vuoto=False, grouping_label=grouping_label, anno_1=anno_1, anno_2=anno_2,
+        mesi=mesi, df_trend=df_trend, g=g, df_cmp=df_cmp, media_storica=media_storica,
+        yoy=yoy,
+    )
@@ -0,0 +1,151 @@
+"""
+Test di regressione delle prestazioni sui percorsi caldi, con dataset sintetici fissi.
+
+    python regressione_prestazioni.py                      # confronto con baseline_prestazioni.json
+    python regressione_prestazioni.py --tolleranza 0.5     # o BB_TOLLERANZA_PERF=0.5
+    python regressione_prestazioni.py --aggiorna-baseline  # dopo un cambiamento voluto
+
+Esce con codice 1 se uno stadio rallenta oltre la tolleranza rispetto alla baseline, o se
+dashboard.py e motore/ contengono cicli per riga (DataFrame.apply con axis=1).
+I tempi sono divisi per quello di un carico di calibrazione fisso (groupby e ordinamento
+pandas), misurato nella stessa esecuzione: la baseline committata resta confrontabile anche
+su macchine più lente o più veloci di quella su cui è stata registrata.
+"""
+import argparse
+import ast
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import warnings
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from benchmark import cronometra, stadi_benchmark
+from dati_sintetici import genera_dataset
+
+CARTELLA_APP = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(CARTELLA_APP, "baseline_prestazioni.json")
+# Dataset fissi: stesso seed e stessa data finale → stessi file a ogni esecuzione
+DATASET_REGRESSIONE = {
+    "piccola": {"anni": 2, "barche": 6, "tour_giorno": 3.0},
+    "media": {"anni": 4, "barche": 12, "tour_giorno": 3.3},
+}
+FINE_DATASET = date(2024, 12, 31)
+SEED_DATASET = 7
+STADI_REGRESSIONE = [
+    "carica_dati", "carica_spese",
+    "filtra_dataframe[annuale]", "filtra_dataframe[mensile]", "filtra_dataframe[settimanale]",
+    "filtra_dataframe[confronto]",
+    "tab_forecast", "tab_simulatore", "tab_suggerimenti",
+]
+# File controllati per i cicli per riga, relativi alla cartella app
+FILE_CONTROLLATI = ["dashboard.py", "motore/*.py"]
+
+
+def apply_per_riga(percorsi):
+    """(file, riga) di ogni chiamata .apply(..., axis=1 / "columns") nei file indicati."""
+    trovati = []
+    for percorso in percorsi:
+        with open(percorso, encoding="utf-8") as f:
+            albero = ast.parse(f.read(), filename=percorso)
+        for nodo in ast.walk(albero):
+            if not (isinstance(nodo, ast.Call) and isinstance(nodo.func, ast.Attribute) and nodo.func.attr == "apply"):
+                continue
+            assi = [k.value for k in nodo.keywords if k.arg == "axis"] + nodo.args[1:2]
+            if any(isinstance(a, ast.Constant) and a.value in (1, "columns") for a in assi):
+                trovati.append((os.path.relpath(percorso, CARTELLA_APP), nodo.lineno))
+    return trovati
+
+
+def calibrazione(ripetizioni=7):
+    # Carico fisso rappresentativo del motore: groupby/aggregazione e ordinamento su 2M righe
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"chiave": rng.integers(0, 5000, 2_000_000), "valore": rng.random(2_000_000)})
+    return min(cronometra(lambda: df.groupby("chiave")["valore"].agg(["sum", "mean"]).sort_values("sum"), ripetizioni))
+
+
+def misura(ripetizioni):
+    """{dataset: {stadio: secondi (minimo delle ripetizioni)}} sui dataset di regressione."""
+    tempi = {}
+    for nome, parametri in DATASET_REGRESSIONE.items():
+        cartella = tempfile.mkdtemp(prefix=f"bb_regressione_{nome}_")
+        try:
+            genera_dataset(cartella, seed=SEED_DATASET, anno_finale=FINE_DATASET.year, fino_a=FINE_DATASET, **parametri)
+            stadi, _ = stadi_benchmark(cartella)
+            tempi[nome] = {}
+            for stadio in STADI_REGRESSIONE:
+                funzione, prepara = stadi[stadio]
+                cronometra(funzione, 1, prepara)  # riscaldamento: import pigri e cache del primo giro
+                tempi[nome][stadio] = min(cronometra(funzione, ripetizioni, prepara))
+        finally:
+            shutil.rmtree(cartella, ignore_errors=True)
+    return tempi
+
+
+def confronta(tempi, calib, baseline, tolleranza, soglia_s):
+    """Righe (dataset, stadio, secondi, secondi attesi, rapporto, esito) rispetto alla baseline."""
+    scala = calib / baseline["calibrazione_s"]
+    righe = []
+    for dataset, stadi in tempi.items():
+        for stadio, secondi in stadi.items():
+            atteso = baseline["tempi_s"].get(dataset, {}).get(stadio)
+            if atteso is None:
+                righe.append((dataset, stadio, secondi, None, None, "NUOVO"))
+                continue
+            atteso *= scala
+            rapporto = secondi / atteso
+            # Gli stadi di pochi millisecondi oscillano: serve anche uno scarto assoluto oltre soglia_s
+            lento = rapporto > 1 + tolleranza and secondi - atteso > soglia_s
+            righe.append((dataset, stadio, secondi, atteso, rapporto, "LENTO" if lento else "ok"))
+    return righe
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Regressioni di prestazioni rispetto a baseline_prestazioni.json.")
+    parser.add_argument("--tolleranza", type=float, default=float(os.environ.get("BB_TOLLERANZA_PERF", "0.3")),
+                        help="rallentamento relativo ammesso (0.3 = +30%%)")
+    parser.add_argument("--soglia-ms", type=float, default=5.0, help="scarto assoluto minimo per segnalare uno stadio")
+    parser.add_argument("--ripetizioni", type=int, default=3)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--aggiorna-baseline", action="store_true", help="registra i tempi misurati come nuova baseline")
+    args = parser.parse_args(argv)
+
+    percorsi = sorted(p for modello in FILE_CONTROLLATI for p in glob.glob(os.path.join(CARTELLA_APP, modello)))
+    cicli = apply_per_riga(percorsi)
+    for percorso, riga in cicli:
+        print(f"{percorso}:{riga}: DataFrame.apply(..., axis=1) — usare operazioni vettoriali", file=sys.stderr)
+
+    warnings.simplefilter("ignore")  # avvisi di parsing date dei fogli: non sono oggetto della misura
+    calib = calibrazione()
+    tempi = misura(args.ripetizioni)
+    calib = min(calib, calibrazione())  # prima e dopo: il minimo scarta i disturbi momentanei
+
+    if args.aggiorna_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"creato": datetime.now().isoformat(timespec="seconds"), "calibrazione_s": calib,
+                       "tempi_s": tempi}, f, indent=2)
+        print(f"Baseline aggiornata in {args.baseline} (calibrazione {calib * 1000:.1f} ms)")
+        return 1 if cicli else 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    righe = confronta(tempi, calib, baseline, args.tolleranza, args.soglia_ms / 1000)
+    print(f"Calibrazione {calib * 1000:.1f} ms (baseline {baseline['calibrazione_s'] * 1000:.1f} ms), "
+          f"tolleranza +{args.tolleranza:.0%}")
+    for dataset, stadio, secondi, atteso, rapporto, esito in righe:
+        confronto = f"attesi {atteso * 1000:>9.1f} ms  x{rapporto:.2f}" if atteso is not None else ""
+        print(f"  {esito:<5} {dataset:<8} {stadio:<30} {secondi * 1000:>9.1f} ms  {confronto}")
+    lenti = [r for r in righe if r[-1] == "LENTO"]
+    if lenti or cicli:
+        print(f"{len(lenti)} stadi oltre la tolleranza, {len(cicli)} apply per riga", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+from motore.anomalie import aggiorna_anomalie, calcola_anomalie, serie_giornaliera_barche
+
+def registro(giorni=120, seed=0):
+    rng = np.random.default_rng(seed)
+    date = pd.date_range("2025-04-01", periods=giorni, freq="D")
+    righe = []
+    for barca in ["Beluga", "Libera", "Ghibli"]:
+        for data in date:
+            for ora in (9, 15):  # due tratte al giorno per barca
+                righe.append({"Barca_Normalizzata": barca, "Data": data + pd.Timedelta(hours=ora), "TipoRiga": "Totale",
+                              "Incasso": rng.gamma(4, 150), "Clienti": rng.integers(2, 12), "Gasolio": rng.gamma(3, 20)})
+    return pd.DataFrame(righe)
+
+def completo(df):
+    return calcola_anomalie(serie_giornaliera_barche(df), finestra=14, min_osservazioni=5)
+
+def aggiorna(stato, df, versione):
+    return aggiorna_anomalie(stato, df, versione, finestra=14, min_osservazioni=5)
+
+def test_stessa_versione_non_ricalcola():
+    df = registro()
+    stato = aggiorna(None, df, "v1")
+    assert aggiorna(stato, df.iloc[:10], "v1") is stato
+
+def test_giorni_aggiunti_come_ricalcolo_completo():
+    df = registro()
+    taglio = df["Data"] < "2025-07-01"
+    stato = aggiorna(None, df[taglio], "v1")
+    stato = aggiorna(stato, df, "v2")
+    pd.testing.assert_frame_equal(stato["risultati"], completo(df))
+
+def test_storico_modificato_a_parita_di_giorni():
+    # Importi di giorni già elaborati cambiano senza che cambi il numero di giorni per barca
+    df = registro()
+    prima = df[df["Data"] < "2025-07-29"]
+    stato = aggiorna(None, prima, "v1")
+    dopo = prima[prima["Data"] != pd.Timestamp("2025-05-10 09:00")].copy()
+    dopo.loc[(dopo["Barca_Normalizzata"] == "Ghibli") & (dopo["Data"] == pd.Timestamp("2025-06-15 15:00")), "Incasso"] += 5000
+    assert serie_giornaliera_barche(dopo).index.equals(serie_giornaliera_barche(prima).index)
+    stato = aggiorna(stato, dopo, "v2")
+    pd.testing.assert_frame_equal(stato["risultati"], completo(dopo))
+
+def test_giorno_rimosso_e_giorno_nuovo():
+    df = registro()
+    prima = df[df["Data"] < "2025-07-29"]
+    stato = aggiorna(None, prima, "v1")
+    dopo = df[(df["Data"] < "2025-07-29") | ((df["Barca_Normalizzata"] == "Libera") & (df["Data"] < "2025-07-30"))]
+    dopo = dopo[~((dopo["Barca_Normalizzata"] == "Libera") & (dopo["Data"].dt.normalize() == pd.Timestamp("2025-06-02")))]
+    stato = aggiorna(stato, dopo, "v2")
+    pd.testing.assert_frame_equal(stato["risultati"], completo(dopo))
+
+def test_barca_rimossa():
+    df = registro()
+    stato = aggiorna(None, df, "v1")
+    senza = df[df["Barca_Normalizzata"] != "Ghibli"]
+    stato = aggiorna(stato, senza, "v2")
+    pd.testing.assert_frame_equal(stato["risultati"], completo(senza))
@@ -0,0 +1,23 @@
+import io
+
+import pandas as pd
+
+from motore.esporta import esporta_a_pezzi, esporta_su_file
+
+def tabella():
+    return pd.DataFrame({"Barca": ["Beluga", "Libera", None] * 20, "Incasso": range(60), "Maltempo": [True, False, None] * 20})
+
+def test_file_uguale_ai_pezzi():
+    df = tabella()
+    for formato in ("csv", "parquet", "xlsx"):
+        with esporta_su_file(df, formato, posizioni=range(5, 45)) as f:
+            assert isinstance(f, io.RawIOBase)  # tipo accettato da st.download_button
+            contenuto = f.read()
+        if formato != "xlsx":  # lo zip dell'xlsx contiene la data di creazione
+            assert contenuto == b"".join(esporta_a_pezzi(df, formato, posizioni=range(5, 45)))
+
+def test_parquet_rileggibile():
+    df = tabella()
+    with esporta_su_file(df, "parquet", colonne=["Barca", "Incasso"]) as f:
+        letto = pd.read_parquet(io.BytesIO(f.read()))
+    assert letto["Incasso"].tolist() == list(range(60))
@@ -0,0 +1,38 @@
+import pandas as pd
+
+from motore.maltempo import bootstrap_delta_meteo, calcola_maltempo, welch_per_gruppo
+
+def registro(maltempo_per_area):
+    # Righe Totale di luglio 2025: per ogni area 6 giorni con i flag Maltempo indicati
+    righe = []
+    for area, flag in maltempo_per_area.items():
+        for i, m in enumerate(flag):
+            righe.append({
+                "Data": pd.Timestamp("2025-07-01") + pd.Timedelta(days=i), "Area": area,
+                "Barca_Normalizzata": f"{area} 1", "TipoRiga": "Totale", "TipoGiorno": "Alti",
+                "TipoCliente": None, "Incasso": 100.0 + 10 * i, "Maltempo": m,
+            })
+    return pd.DataFrame(righe)
+
+def test_welch_gruppo_con_un_solo_tipo_di_meteo():
+    df = registro({"Sirmione": [False, True, False, True, False, True], "Riva": [False] * 6})
+    test = welch_per_gruppo(df, "Area")
+    assert list(test.index) == ["Sirmione"]
+    assert test.loc["Sirmione", "n buono"] == 3 and test.loc["Sirmione", "n maltempo"] == 3
+
+def test_welch_periodo_solo_bel_tempo():
+    test = welch_per_gruppo(registro({"Riva": [False] * 6}), "Area")
+    assert test.empty
+
+def test_bootstrap_salta_gruppi_con_un_solo_tipo_di_meteo():
+    df = registro({"Sirmione": [False, True, False, True, False, True], "Riva": [True] * 6})
+    ic = bootstrap_delta_meteo(df, "Area", n_boot=200)
+    assert list(ic.index) == ["Sirmione"]
+    assert bootstrap_delta_meteo(registro({"Riva": [True] * 6}), "Area", n_boot=200).empty
+
+def test_calcola_maltempo_periodo_con_un_solo_tipo_di_meteo():
+    df = registro({"Riva": [False] * 6, "Desenzano": [True] * 6})
+    periodo = {"modalita": "analisi", "tipo": "mensile", "anno": 2025, "mese": 7}
+    r = calcola_maltempo(df, periodo, "Alti", "Tutti", "Tutte")
+    assert r.test.empty
+    assert r.errore_sintesi is None and sorted(r.sintesi.index) == ["Desenzano", "Riva"]
@@ -0,0 +1,22 @@
+import builtins
+import sys
+
+from motore import memoria
+
+def test_rss_senza_modulo_resource(monkeypatch):
+    # Windows: il modulo resource non esiste, il picco ricade sull'RSS corrente
+    monkeypatch.setitem(sys.modules, "resource", None)
+    assert memoria._picco_getrusage() is None
+    assert memoria.rss_picco_processo() > 0
+
+def test_rss_senza_proc_ne_resource(monkeypatch):
+    monkeypatch.setitem(sys.modules, "resource", None)
+    apri = builtins.open
+
+    def senza_proc(percorso, *args, **kwargs):
+        if str(percorso).startswith("/proc/"):
+            raise OSError("assente")
+        return apri(percorso, *args, **kwargs)
+    monkeypatch.setattr(builtins, "open", senza_proc)
+    assert memoria.rss_byte() == 0
+    assert memoria.rss_picco_processo() == 0
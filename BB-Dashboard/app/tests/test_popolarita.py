@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+
+from motore.popolarita import delta_periodi_matrice, matrice_popolarita, peggiori_n_matrice, top_n_matrice
+
+DURATE = ["30 minuti", "45 minuti", "1 ora", "1 ora e 30 minuti", "2 ore", "3 ore", "4 ore", "8 ore"]
+PERIODI = ["2024", "2025"]
+
+def registro():
+    # Conteggi tutti diversi per segmento e per totale di riga (nessun pareggio al confine del top 5);
+    # "8 ore" solo nel 2025 e "4 ore" solo tra i Privati
+    conteggi = {
+        ("Privati", "2024"): [40, 3, 25, 7, 12, 5, 2, 0], ("Privati", "2025"): [44, 6, 21, 9, 15, 1, 4, 8],
+        ("Gruppo", "2024"): [30, 11, 2, 14, 19, 8, 0, 0], ("Gruppo", "2025"): [27, 13, 5, 17, 16, 10, 0, 22],
+    }
+    righe = []
+    for (cliente, periodo), valori in conteggi.items():
+        for durata, n in zip(DURATE, valori):
+            barche = ["Beluga", "Libera", "Ghibli"] if periodo == "2024" else ["Beluga", "Libera"]
+            righe += [{"Durata": durata, "TipoCliente": cliente, "Periodo": periodo,
+                       "Barca_Normalizzata": barche[i % len(barche)]} for i in range(n)]
+    return pd.DataFrame(righe)
+
+# Tabelle calcolate come prima della matrice (sort/groupby/head, nsmallest, apply per riga)
+def top_precedente(dfw, gb_cols, group_for_top, n=5):
+    gdf = dfw.groupby(gb_cols, dropna=False).size().reset_index(name="Conteggio")
+    if not group_for_top:
+        return gdf.nlargest(n, "Conteggio")
+    return gdf.sort_values("Conteggio", ascending=False).groupby(group_for_top, group_keys=False).head(n)
+
+def peggiori_precedente(dfw, n=5):
+    base = dfw.groupby("Durata", dropna=False).size().reset_index(name="Conteggio")
+    return base[base["Conteggio"] > 0].nsmallest(n, "Conteggio")
+
+def delta_precedente(dfw, p1, p2):
+    cnt = dfw[dfw["Periodo"].isin([p1, p2])].groupby(["Durata", "Periodo"], dropna=False).size().reset_index(name="Conteggio")
+    boats = dfw[dfw["Periodo"].isin([p1, p2])].groupby("Periodo")["Barca_Normalizzata"].nunique().rename("Boats").reset_index()
+    cnt_norm = cnt.merge(boats, on="Periodo", how="left")
+    cnt_norm["NormConteggio"] = cnt_norm.apply(
+        lambda r: (r["Conteggio"] / r["Boats"]) if (pd.notnull(r["Boats"]) and r["Boats"] > 0) else np.nan, axis=1
+    )
+    piv = cnt_norm.pivot(index="Durata", columns="Periodo", values="NormConteggio").reset_index()
+    piv.columns.name = None
+    piv["Delta_norm"] = piv[p2].fillna(0) - piv[p1].fillna(0)
+    piv["Delta_%"] = np.where(piv[p1].fillna(0) > 0, 100 * piv["Delta_norm"] / piv[p1].fillna(0), np.nan)
+    return piv
+
+def righe_ordinate(df, colonne):
+    return sorted(df[colonne].itertuples(index=False, name=None))
+
+def test_top_n_come_sort_groupby_head():
+    dfw = registro()
+    for segmenti in ([], ["Periodo"], ["TipoCliente"], ["TipoCliente", "Periodo"]):
+        top = top_n_matrice(matrice_popolarita(dfw, segmenti), segmenti, n=5)
+        atteso = top_precedente(dfw, ["Durata"] + segmenti, segmenti, n=5)
+        colonne = ["Durata"] + segmenti + ["Conteggio"]
+        assert righe_ordinate(top, colonne) == righe_ordinate(atteso, colonne), segmenti
+        assert top["Conteggio"].is_monotonic_decreasing
+
+def test_peggiori_n_come_nsmallest():
+    dfw = registro()
+    for segmenti in ([], ["TipoCliente", "Periodo"]):
+        peggiori = peggiori_n_matrice(matrice_popolarita(dfw, segmenti), n=5)
+        atteso = peggiori_precedente(dfw, n=5)
+        assert peggiori["Durata"].tolist() == atteso["Durata"].tolist()
+        assert peggiori["Conteggio"].tolist() == atteso["Conteggio"].tolist()
+
+def test_delta_periodi_come_apply_per_riga():
+    dfw = registro()
+    matrice = matrice_popolarita(dfw, ["TipoCliente", "Periodo"])
+    barche = dfw.groupby("Periodo")["Barca_Normalizzata"].nunique()
+    delta = delta_periodi_matrice(matrice, barche, PERIODI).set_index("Durata").sort_index()
+    atteso = delta_precedente(dfw, *PERIODI).set_index("Durata").sort_index()
+    pd.testing.assert_frame_equal(delta[PERIODI + ["Delta_norm", "Delta_%"]], atteso[PERIODI + ["Delta_norm", "Delta_%"]],
+                                  check_names=False)
+    assert np.isnan(delta.loc["8 ore", "2024"])